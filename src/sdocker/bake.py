@@ -0,0 +1,67 @@
+import re
+from bootstrap import ready_agent, ready_agent_path, baked_marker_path, generate_agent_install
+
+# dind images used by DockerHost instances, see Commands.launch_instances
+dind_images = ["docker:dind", "brandsight/dind:nvidia-docker"]
+# Printed to the console by the bake script, read back with get_console_output
+bake_success_message = "sdocker-bake: success"
+bake_failure_message = "sdocker-bake: failed"
+
+
+def get_ecr_registries(images):
+    """
+    ECR registries of images, they need a docker login before pulling
+    """
+    registries = set()
+    for image in images:
+        registry = image.split("/")[0]
+        match = re.match(r"^\d+\.dkr\.ecr\.([a-z0-9-]+)\.amazonaws\.com(\.cn)?$", registry)
+        if match:
+            registries.add((registry, match.group(1)))
+    return sorted(registries)
+
+
+def generate_bake_script(images):
+    """
+    User data that prepares a DockerHost AMI then shuts the instance down:
+    installs packages, pulls dind images, pulls framework images into the docker data root
+    used by DockerHost instances and installs the readiness agent
+    """
+    pulls = []
+    for registry, region in get_ecr_registries(images):
+        pulls.append(f"aws ecr get-login-password --region {region} | docker exec -i sdocker-bake docker login --username AWS --password-stdin {registry}")
+    for image in images:
+        pulls.append(f"docker exec sdocker-bake docker pull {image}")
+    pull_commands = "\n    ".join(pulls)
+    dind_pulls = "\n    ".join(f"docker pull {image}" for image in dind_images)
+    bake_script = f"""#!/bin/bash
+set -x
+exec > >(tee /var/log/sdocker-bake.log|logger -t sdocker-bake -s 2>/dev/console) 2>&1
+
+# errexit is ignored in if conditions, bake runs as a plain command and its status is checked after
+bake() {{
+    set -eo pipefail
+    yum install -y nfs-utils mdadm cachefilesd
+    {dind_pulls}
+
+    mkdir -p /var/lib/sdocker/docker
+    docker run -d --privileged --name sdocker-bake -v /var/lib/sdocker/docker:/var/lib/docker -e DOCKER_TLS_CERTDIR="" docker:dind
+    timeout 300 bash -c 'until docker exec sdocker-bake docker info > /dev/null 2>&1; do sleep 1; done'
+    {pull_commands}
+    docker rm -f sdocker-bake
+
+    {generate_agent_install(ready_agent_path, ready_agent)}
+    echo "nfs-utils mdadm cachefilesd {' '.join(dind_images)} {' '.join(images)}" > {baked_marker_path}
+}}
+
+( bake )
+if [[ $? -eq 0 ]]
+then
+    echo "{bake_success_message}"
+else
+    echo "{bake_failure_message}"
+    docker rm -f sdocker-bake
+fi
+shutdown -h now
+"""
+    return bake_script
@@ -1,4 +1,148 @@
-def generate_bootstrap_script(home, efs_ip_address, port, user_uid, gpu_option, docker_image_name):
+import os
+import threading
+from imagegc import default_image_gc
+from hostmetrics import exporter_port
+
+# dockerd defaults for the dind daemon, overridden by "DockerDaemon" in sdocker.conf
+default_daemon_options = {
+    "StorageDriver": "overlay2",
+    "MaxConcurrentDownloads": 10,
+    "MaxConcurrentUploads": 10,
+    "RegistryMirrors": [],
+    "LogDriver": "json-file",
+    "LogOpts": {"max-size": "100m", "max-file": "3"}
+}
+
+
+# EFS mount profile defaults, overridden by "EfsMount" in sdocker.conf
+default_efs_mount = {
+    "NConnect": None,
+    "Actimeo": None,
+    "ReadAheadKb": 15360,
+    "FsCache": False
+}
+# Installed by the bootstrap script, or pre-installed on AMIs baked with sdocker bake-ami
+ready_agent_path = "/opt/sdocker/ready.sh"
+spot_agent_path = "/opt/sdocker/spot.sh"
+# Tag recording the volume of the docker data root of a host, "nvme" or "ebs"
+data_root_tag = "sdocker:data-root"
+# Spot interruption agent, polls the instance metadata for an interruption notice every 5 seconds as AWS
+# recommends. On notice it writes the marker read by sdocker on the user's EFS home, then drains the host:
+# containers get SIGTERM and 90 seconds to checkpoint before the instance is reclaimed 2 minutes after the notice
+spot_agent = """#!/bin/bash
+PORT=$1
+USER_UID=$2
+imds() {
+    TOKEN=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+    curl -sf -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/$1
+}
+[[ "$(imds instance-life-cycle)" == "spot" ]] || exit 0
+INSTANCE_ID=$(imds instance-id)
+until ACTION=$(imds spot/instance-action)
+do
+    sleep 5
+done
+mkdir -p /root/.sdocker/interrupted
+echo "$ACTION" > /root/.sdocker/interrupted/$INSTANCE_ID
+chown -R $USER_UID /root/.sdocker/interrupted
+docker -H tcp://localhost:$PORT ps -q | xargs -r docker -H tcp://localhost:$PORT stop -t 90
+echo "drained $(date +%s.%N)" >> /root/.sdocker/interrupted/$INSTANCE_ID
+"""
+# Agents too large for user data are copied to the EFS home before launch, the bootstrap script installs them from there
+efs_agents_dir = ".sdocker/agents"
+host_agents = ["imagegc.py", "hostmetrics.py"]
+imagegc_agent_path = "/opt/sdocker/imagegc.py"
+hostmetrics_agent_path = "/opt/sdocker/hostmetrics.py"
+# Present on AMIs baked with sdocker bake-ami
+baked_marker_path = "/opt/sdocker/baked"
+# Readiness agent, waits on dockerd then writes the ready marker on the user's EFS home
+ready_agent = """#!/bin/bash
+PORT=$1
+USER_UID=$2
+IMDS_TOKEN=$(curl -s -X PUT "http://169.254.169.254/latest/api/token" -H "X-aws-ec2-metadata-token-ttl-seconds: 300")
+INSTANCE_ID=$(curl -s -H "X-aws-ec2-metadata-token: $IMDS_TOKEN" http://169.254.169.254/latest/meta-data/instance-id)
+timeout 600 bash -c "until curl -sf http://localhost:$PORT/_ping > /dev/null; do sleep 0.2; done"
+mkdir -p /root/.sdocker/ready
+# Marker holds the step timings of the user data script, then the time dockerd answered
+cat /run/sdocker/timings > /root/.sdocker/ready/$INSTANCE_ID.tmp 2> /dev/null
+echo "dockerd $(date +%s.%N)" >> /root/.sdocker/ready/$INSTANCE_ID.tmp
+mv /root/.sdocker/ready/$INSTANCE_ID.tmp /root/.sdocker/ready/$INSTANCE_ID
+chown -R $USER_UID /root/.sdocker/ready
+"""
+
+
+def generate_agent_install(path, content):
+    """
+    Shell snippet writing an agent script to path unless it is already installed
+    """
+    return f"""if ! [[ -x {path} ]]
+    then
+        sudo mkdir -p {os.path.dirname(path)}
+        cat <<'SDOCKER_AGENT_EOF' | sudo tee {path} > /dev/null
+{content}SDOCKER_AGENT_EOF
+        sudo chmod +x {path}
+    fi"""
+
+
+def copy_agents_to_efs(home):
+    """
+    Write host agents to the EFS home, replacing agents of older sdocker versions
+    """
+    agents_dir = f"{home}/{efs_agents_dir}"
+    os.makedirs(agents_dir, exist_ok=True)
+    for agent in host_agents:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), agent), "r") as source_file:
+            source = source_file.read()
+        # Concurrent launches of one invocation copy agents from several threads
+        temporary = f"{agents_dir}/{agent}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, "w") as agent_file:
+            agent_file.write(source)
+        os.replace(temporary, f"{agents_dir}/{agent}")
+
+
+def generate_dockerd_args(daemon_options):
+    """
+    Translate DockerDaemon options into dockerd command line flags passed to the dind image
+    """
+    options = {**default_daemon_options, **daemon_options}
+    args = []
+    if options["StorageDriver"]:
+        args.append(f"--storage-driver={options['StorageDriver']}")
+    args.append(f"--max-concurrent-downloads={options['MaxConcurrentDownloads']}")
+    args.append(f"--max-concurrent-uploads={options['MaxConcurrentUploads']}")
+    for mirror in options["RegistryMirrors"]:
+        args.append(f"--registry-mirror={mirror}")
+    if options["LogDriver"]:
+        args.append(f"--log-driver={options['LogDriver']}")
+    for key, value in options["LogOpts"].items():
+        args.append(f"--log-opt={key}={value}")
+    return " ".join(args)
+
+
+def generate_efs_mount_options(efs_mount):
+    """
+    NFS mount options for EFS from EfsMount options
+    """
+    mount_options = ["nfsvers=4.1", "rsize=1048576", "wsize=1048576", "hard", "timeo=600", "retrans=2"]
+    if efs_mount["NConnect"]:
+        mount_options.append(f"nconnect={efs_mount['NConnect']}")
+    if efs_mount["Actimeo"] is not None:
+        mount_options.append(f"actimeo={efs_mount['Actimeo']}")
+    return ",".join(mount_options)
+
+
+def get_data_root_volume(data_root, has_nvme):
+    """
+    Volume holding the docker data root for a DockerDataRoot mode, as the bootstrap script picks it
+    """
+    return "nvme" if data_root != "ebs" and has_nvme else "ebs"
+
+
+def generate_bootstrap_script(home, efs_ip_address, port, user_uid, gpu_option, docker_image_name, data_root="auto", daemon_options={}, efs_mount={}, has_nvme=True, image_gc={}):
+    dockerd_args = generate_dockerd_args(daemon_options)
+    image_gc = {**default_image_gc, **image_gc}
+    efs_mount = {**default_efs_mount, **efs_mount}
+    efs_mount_options = generate_efs_mount_options(efs_mount)
     bootstrap_script = f"""Content-Type: multipart/mixed; boundary="//"
 MIME-Version: 1.0
 
@@ -22,46 +166,167 @@ Content-Disposition: attachment; filename="userdata.txt"
 set -x
 exec > >(tee /var/log/user-data.log|logger -t user-data -s 2>/dev/console) 2>&1
     
-    echo "Mounting EFS to /root"
+    # Step timings, copied to the ready marker by the readiness agent. /run is emptied on every boot
+    sudo mkdir -p /run/sdocker
+    awk -v now=$(date +%s.%N) '{{printf "boot %.3f\\n", now - $1}}' /proc/uptime | sudo tee /run/sdocker/timings > /dev/null
+    mark_step() {{ echo "$1 $(date +%s.%N)" | sudo tee -a /run/sdocker/timings > /dev/null; }}
+    mark_step start
+    
+    if [[ -f {baked_marker_path} ]]
+    then
+        echo "Baked AMI: $(cat {baked_marker_path})"
+    else
+        rpm -q nfs-utils mdadm > /dev/null || sudo yum install -y nfs-utils mdadm
+    fi
+    mark_step packages
+    
+    # NVMe instance store is mounted at /mnt/sdocker when the instance type has it, per the instance type catalog
+    NVME_DEVICES=""
+    if [[ "{has_nvme}" == "True" ]]
+    then
+        NVME_DEVICES=$(lsblk -dpno NAME,MODEL | grep "Amazon EC2 NVMe Instance Storage" | awk '{{print $1}}' | xargs)
+    fi
+    if [[ -n "$NVME_DEVICES" ]]
+    then
+        NVME_COUNT=$(echo $NVME_DEVICES | wc -w)
+        if [[ $NVME_COUNT -gt 1 ]]
+        then
+            sudo mdadm --assemble --scan || true
+            if ! [[ -e /dev/md0 ]]
+            then
+                sudo mdadm --create /dev/md0 --level=0 --force --run --raid-devices=$NVME_COUNT $NVME_DEVICES
+            fi
+            NVME_DEVICE=/dev/md0
+        else
+            NVME_DEVICE=$NVME_DEVICES
+        fi
+        # Instance store is blank after a stop/start, format it only when it has no filesystem
+        if ! sudo blkid $NVME_DEVICE
+        then
+            sudo mkfs.xfs -f $NVME_DEVICE
+        fi
+        sudo mkdir -p /mnt/sdocker
+        mountpoint -q /mnt/sdocker || sudo mount -o noatime $NVME_DEVICE /mnt/sdocker
+    fi
+    
+    # Data root of the dind daemon lives on a host volume, NVMe instance store when available
+    DATA_ROOT=/var/lib/sdocker/docker
+    DATA_ROOT_MODE={data_root}
+    if [[ -f {baked_marker_path} ]] && [[ "$DATA_ROOT_MODE" == "auto" ]]
+    then
+        # Framework images baked into the AMI live in the EBS data root
+        DATA_ROOT_MODE=ebs
+    fi
+    if [[ "$DATA_ROOT_MODE" != "ebs" ]] && mountpoint -q /mnt/sdocker
+    then
+        DATA_ROOT=/mnt/sdocker/docker
+    elif [[ "$DATA_ROOT_MODE" == "nvme" ]]
+    then
+        echo "No NVMe instance store found, using root EBS volume for docker data root"
+    fi
+    sudo mkdir -p $DATA_ROOT
+    
+    # Datasets staged with sdocker stage, the daemon sees them at ~/.sdocker/staging
+    STAGING_ROOT=/var/lib/sdocker/staging
+    if mountpoint -q /mnt/sdocker
+    then
+        STAGING_ROOT=/mnt/sdocker/staging
+    fi
+    sudo mkdir -p $STAGING_ROOT
+    mark_step disks
+    
+    # Mount EFS once, then bind mount it to every path Studio uses as home directory
+    EFS_MOUNT_OPTIONS={efs_mount_options}
+    if [[ "{efs_mount["FsCache"]}" == "True" ]]
+    then
+        # FS-Cache keeps EFS reads on local disk, NVMe instance store when mounted
+        rpm -q cachefilesd > /dev/null || sudo yum install -y cachefilesd
+        FSCACHE_DIR=/var/cache/fscache
+        if mountpoint -q /mnt/sdocker
+        then
+            FSCACHE_DIR=/mnt/sdocker/fscache
+        fi
+        sudo mkdir -p $FSCACHE_DIR
+        sudo sed -i "s|^dir .*|dir $FSCACHE_DIR|" /etc/cachefilesd.conf
+        sudo systemctl restart cachefilesd && EFS_MOUNT_OPTIONS="$EFS_MOUNT_OPTIONS,fsc"
+    fi
     
-    sudo mkdir -p /root
-    sudo mount -t nfs \
-    -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-    {efs_ip_address}:/{user_uid} \
-    /root
+    echo "Mounting EFS to /mnt/efs"
+    sudo mkdir -p /mnt/efs
+    mountpoint -q /mnt/efs || sudo mount -t nfs -o $EFS_MOUNT_OPTIONS {efs_ip_address}:/{user_uid} /mnt/efs
+    if [[ -n "{efs_mount["ReadAheadKb"] or ""}" ]]
+    then
+        echo {efs_mount["ReadAheadKb"]} | sudo tee /sys/class/bdi/$(mountpoint -d /mnt/efs)/read_ahead_kb
+    fi
     
-    sudo mkdir -p /home/sagemaker-user
-    sudo mount -t nfs \
-    -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-    {efs_ip_address}:/{user_uid} \
-    /home/sagemaker-user
+    for EFS_PATH in /root /home/sagemaker-user
+    do
+        sudo mkdir -p $EFS_PATH
+        mountpoint -q $EFS_PATH || sudo mount --bind /mnt/efs $EFS_PATH
+    done
     
+    HOME_VOLUME=""
     if ( ! [[ "{home}" == "/home/sagemaker-user" ]] || [[ "{home}" == "/root" ]] )
     then
         sudo mkdir -p {home}
-        sudo mount -t nfs \
-        -o nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2 \
-        {efs_ip_address}:/{user_uid} \
-        {home}
-        
-        sudo -u ec2-user docker run -d \
-        -p {port}:2375 \
-        -p 8080:8080 {gpu_option} \
-        -v /root:/root \
-        -v /home/sagemaker-user:/home/sagemaker-user \
-        -v {home}:{home} \
-        --privileged \
-        --name dockerd-server \
-        -e DOCKER_TLS_CERTDIR="" {docker_image_name}
+        mountpoint -q {home} || sudo mount --bind /mnt/efs {home}
+        HOME_VOLUME="-v {home}:{home}"
+    fi
+    mark_step efs
+    
+    # User data runs on every boot, restart the daemon container of a stopped or warm pool host
+    if [[ -n "$(sudo -u ec2-user docker ps -aq --filter name=^dockerd-server$)" ]]
+    then
+        sudo -u ec2-user docker start dockerd-server
     else
         sudo -u ec2-user docker run -d \
         -p {port}:2375 \
         -p 8080:8080 {gpu_option} \
         -v /root:/root \
         -v /home/sagemaker-user:/home/sagemaker-user \
+        $HOME_VOLUME \
+        -v $DATA_ROOT:/var/lib/docker \
+        -v $STAGING_ROOT:{home}/.sdocker/staging \
         --privileged \
         --name dockerd-server \
-        -e DOCKER_TLS_CERTDIR="" {docker_image_name}
+        -e DOCKER_TLS_CERTDIR="" {docker_image_name} {dockerd_args}
+    fi
+    mark_step container
+    
+    echo "Waiting on dockerd-server"
+    {generate_agent_install(ready_agent_path, ready_agent)}
+    sudo {ready_agent_path} {port} {user_uid}
+    
+    # Spot interruption agent, exits right away on on-demand instances
+    {generate_agent_install(spot_agent_path, spot_agent)}
+    sudo setsid nohup {spot_agent_path} {port} {user_uid} >> /var/log/sdocker-spot.log 2>&1 < /dev/null &
+    
+    # Host agents run with the python3 of the host once dockerd is ready, sdocker copies them to EFS before launch
+    if command -v python3 > /dev/null || sudo yum install -y python3
+    then
+        # Metrics exporter next to dockerd-server, read by sdocker status
+        if [[ -f /mnt/efs/{efs_agents_dir}/hostmetrics.py ]]
+        then
+            sudo install -D -m 755 /mnt/efs/{efs_agents_dir}/hostmetrics.py {hostmetrics_agent_path}
+            sudo setsid nohup python3 {hostmetrics_agent_path} \
+            --port {exporter_port} \
+            --data-root $DATA_ROOT \
+            --nfs-mount /mnt/efs \
+            >> /var/log/sdocker-metrics.log 2>&1 < /dev/null &
+        fi
+        # Garbage collection agent keeps the data root volume under the ImageGC high-water mark
+        if [[ -n "{image_gc["HighWater"] or ""}" ]] && [[ -f /mnt/efs/{efs_agents_dir}/imagegc.py ]]
+        then
+            sudo install -D -m 755 /mnt/efs/{efs_agents_dir}/imagegc.py {imagegc_agent_path}
+            sudo setsid nohup python3 {imagegc_agent_path} \
+            --docker-host tcp://localhost:{port} \
+            --data-root $DATA_ROOT \
+            --high-water {image_gc["HighWater"]} \
+            --low-water {image_gc["LowWater"]} \
+            --interval {image_gc["Interval"]} \
+            --container-age {image_gc["ContainerAge"]} \
+            >> /var/log/sdocker-gc.log 2>&1 < /dev/null &
+        fi
     fi
 --//--"""
 
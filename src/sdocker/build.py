@@ -0,0 +1,89 @@
+import os
+import re
+import shlex
+import subprocess
+import logging as log
+from config import get_home
+from errors import InvalidRequestError
+
+# Image running the docker CLI with buildx on the host, next to the daemon
+builder_image = "docker:cli"
+# buildx builder kept on the host daemon, its BuildKit state makes re-runs incremental
+builder_name = "sdocker"
+# Paths of the user's EFS home that the host mounts at the same location
+efs_mount_paths = ["/root", "/home/sagemaker-user"]
+
+
+def get_efs_path(path):
+    """
+    Absolute path of path on the host, only paths on the user's EFS home are mounted there
+    """
+    path = os.path.realpath(os.path.expanduser(path))
+    for mount_path in [get_home(), *efs_mount_paths]:
+        if path == mount_path or path.startswith(f"{mount_path}/"):
+            return path
+    message = f"Build context {path} is not on the EFS home directory, it is not visible to the docker host"
+    log.error(message)
+    raise InvalidRequestError(message)
+
+
+def get_cache_dir(tag):
+    """
+    Default BuildKit cache directory on EFS for image tag
+    """
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", tag)
+    return f"{get_home()}/.sdocker/build-cache/{name}"
+
+
+def generate_build_script(context_path, tag, dockerfile=None, build_args=[], target=None, cache_dir=None):
+    """
+    Shell script run in the builder container, creates the buildx builder once then builds and loads the image
+    """
+    build = ["docker", "buildx", "build", "--builder", builder_name, "--load", "-t", tag]
+    if dockerfile:
+        build += ["-f", dockerfile]
+    for build_arg in build_args:
+        build += ["--build-arg", build_arg]
+    if target:
+        build += ["--target", target]
+    if cache_dir:
+        if os.path.exists(f"{cache_dir}/index.json"):
+            build += ["--cache-from", f"type=local,src={cache_dir}"]
+        build += ["--cache-to", f"type=local,dest={cache_dir},mode=max"]
+    build.append(context_path)
+    return "\n".join([
+        f"docker buildx inspect {builder_name} > /dev/null 2>&1 || docker buildx create --name {builder_name} --driver docker-container",
+        shlex.join(build)
+    ])
+
+
+def build_on_host(host, context_path, tag, dockerfile=None, build_args=[], target=None, cache_dir=None):
+    """
+    Build image on host from the context on EFS, nothing is uploaded from Studio. Returns build exit code
+    """
+    context_path = get_efs_path(context_path)
+    volumes = [context_path]
+    if dockerfile:
+        dockerfile = get_efs_path(dockerfile if os.path.isabs(dockerfile) else os.path.join(context_path, dockerfile))
+        volumes.append(os.path.dirname(dockerfile))
+    if cache_dir:
+        cache_dir = get_efs_path(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        volumes.append(cache_dir)
+    # buildx keeps its builder configuration in DOCKER_CONFIG, persist it on EFS between runs
+    buildx_config = f"{get_home()}/.sdocker/buildx"
+    os.makedirs(buildx_config, exist_ok=True)
+    script = generate_build_script(context_path, tag, dockerfile, build_args, target, cache_dir)
+    command = [
+        "docker", "-H", f"tcp://{host['InstanceDns']}:{host['Port']}",
+        "run", "--rm",
+        "-v", "/var/run/docker.sock:/var/run/docker.sock",
+        "-v", f"{buildx_config}:/buildx-config",
+        "-e", "DOCKER_CONFIG=/buildx-config"
+    ]
+    for volume in sorted(set(volumes)):
+        command += ["-v", f"{volume}:{volume}"]
+    command += ["-w", context_path, "--entrypoint", "sh", builder_image, "-c", script]
+    log.info(f"Building {tag} from {context_path} on host {host['InstanceId']}")
+    log.debug(f"Build script: {script}")
+    return subprocess.run(command).returncode
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import logging as log
+from config import get_home, UnhandledError
+from errors import InvalidRequestError
+
+# Seconds the instance type catalog stays valid, instance type capabilities rarely change
+catalog_ttl = 7 * 24 * 3600
+# Docker data root needs room for compressed layers and the extracted image
+image_disk_factor = 2
+
+
+def get_catalog_filename():
+    """
+    Location of the on-disk instance type catalog, one entry per region
+    """
+    return f"{get_home()}/.sdocker/instance-types.json"
+
+
+def summarize_instance_type(instance_type):
+    """
+    Capabilities of an instance type relevant to a DockerHost, from a describe_instance_types entry
+    """
+    gpus = instance_type.get("GpuInfo", {}).get("Gpus", [])
+    storage = instance_type.get("InstanceStorageInfo", {})
+    return {
+        "VCpus": instance_type["VCpuInfo"]["DefaultVCpus"],
+        "MemoryMiB": instance_type["MemoryInfo"]["SizeInMiB"],
+        "Gpus": sum(gpu["Count"] for gpu in gpus),
+        "GpuManufacturer": gpus[0]["Manufacturer"] if gpus else None,
+        "GpuMemoryMiB": instance_type.get("GpuInfo", {}).get("TotalGpuMemoryInMiB", 0),
+        "NvmeGiB": storage.get("TotalSizeInGB", 0) if storage.get("NvmeSupport", "unsupported") != "unsupported" else 0,
+        "Architectures": instance_type["ProcessorInfo"]["SupportedArchitectures"],
+        "NetworkPerformance": instance_type.get("NetworkInfo", {}).get("NetworkPerformance"),
+        "CurrentGeneration": instance_type.get("CurrentGeneration", False)
+    }
+
+
+def read_catalog_file():
+    """
+    Whole catalog file, empty if missing
+    """
+    try:
+        with open(get_catalog_filename(), "r") as catalog_file:
+            return json.load(catalog_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def refresh_catalog(ec2_client, region):
+    """
+    Describe every instance type of region with paginated calls and store their capabilities atomically
+    """
+    instance_types = {}
+    try:
+        paginator = ec2_client.get_paginator("describe_instance_types")
+        for page in paginator.paginate(PaginationConfig={"PageSize": 100}):
+            for instance_type in page["InstanceTypes"]:
+                instance_types[instance_type["InstanceType"]] = summarize_instance_type(instance_type)
+    except Exception as error:
+        UnhandledError(error)
+    catalog = read_catalog_file()
+    catalog[region] = {"Timestamp": time.time(), "InstanceTypes": instance_types}
+    filename = get_catalog_filename()
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(f"{filename}.{os.getpid()}", "w") as catalog_file:
+            json.dump(catalog, catalog_file)
+        os.replace(f"{filename}.{os.getpid()}", filename)
+    except OSError as error:
+        log.warning(f"Unable to write instance type catalog {filename}: {error}")
+    log.info(f"Refreshed instance type catalog of {region} with {len(instance_types)} instance types")
+    return instance_types
+
+
+def load_catalog(ec2_client, region, refresh=False):
+    """
+    Instance type capabilities of region, refreshed when missing, expired or refresh is requested
+    """
+    entry = read_catalog_file().get(region)
+    if refresh or not entry or time.time() - entry.get("Timestamp", 0) > catalog_ttl:
+        return refresh_catalog(ec2_client, region)
+    return entry["InstanceTypes"]
+
+
+def get_instance_type_info(ec2_client, region, instance_type, catalog=None):
+    """
+    Capabilities of instance_type, the catalog is refreshed once for instance types it does not know yet
+    """
+    catalog = catalog if catalog is not None else load_catalog(ec2_client, region)
+    if instance_type not in catalog:
+        catalog = refresh_catalog(ec2_client, region)
+    if instance_type not in catalog:
+        message = f"InvalidInstanceType: {instance_type} is not available in {region}"
+        log.error(message)
+        raise InvalidRequestError(message)
+    return catalog[instance_type]
+
+
+def is_nvidia_gpu(info):
+    """
+    Instance type has NVIDIA GPUs, the only ones the GPU dind image supports
+    """
+    return info["Gpus"] > 0 and info["GpuManufacturer"] == "NVIDIA"
+
+
+def recommend_instance_types(catalog, gpus=0, memory_gib=0, vcpus=0, image_size_gib=0, ebs_volume_size=0, data_root="auto", architecture="x86_64", nvme=False):
+    """
+    Current generation instance types meeting the stated needs, smallest first.
+    Images are stored on NVMe instance store when available, on the root EBS volume otherwise or with data_root "ebs"
+    """
+    candidates = []
+    for name, info in catalog.items():
+        if not info["CurrentGeneration"] or architecture not in info["Architectures"]:
+            continue
+        if info["VCpus"] < vcpus or info["MemoryMiB"] < memory_gib * 1024:
+            continue
+        if gpus and (info["Gpus"] < gpus or not is_nvidia_gpu(info)):
+            continue
+        if nvme and not info["NvmeGiB"]:
+            continue
+        data_root_size = ebs_volume_size if data_root == "ebs" or not info["NvmeGiB"] else info["NvmeGiB"]
+        if data_root_size < image_size_gib * image_disk_factor:
+            continue
+        candidates.append((name, info))
+    # Fewest GPUs, vCPUs and memory first, NVMe instance store preferred between equal sizes
+    candidates.sort(key=lambda candidate: (
+        candidate[1]["Gpus"],
+        candidate[1]["VCpus"],
+        candidate[1]["MemoryMiB"],
+        not candidate[1]["NvmeGiB"],
+        candidate[0]
+    ))
+    return candidates
@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import boto3
+import logging as log
+from config import ReadConfig, read_config_cache
+from parse import get_command_args
+from commands import Commands
+from registry import get_host, get_current_host, list_hosts
+from jobqueue import list_jobs
+
+
+async def run_in_thread(function, *args, **kwargs):
+    """
+    Await function run in the default executor of the running loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+class SDockerClient():
+    """
+    Python API of sdocker for notebooks and scripts. Configuration is discovered and boto3 clients are
+    created once per client, then reused by every call. Methods return registry entries (dicts with
+    InstanceId, InstanceDns, Port, InstanceType, Status, ...) and raise errors from errors.py:
+    InvalidRequestError, HostNotFoundError, HostNotReadyError or CommandFailedError.
+    Methods ending with _async run in a worker thread and can be awaited concurrently.
+    Configuration is read again once its cache entry expires or is invalidated, eg. by a stale resource
+
+        client = SDockerClient()
+        host = client.create_host("c5.xlarge")[0]
+        client.terminate_host(host["InstanceId"])
+    """
+    def __init__(self, refresh_config=False):
+        """
+        Read Studio configuration, pass refresh_config=True to bypass the configuration cache
+        """
+        self.load_config(refresh_config)
+
+
+    def load_config(self, refresh=False):
+        """
+        Read configuration and create the EC2 client
+        """
+        read_config = ReadConfig(refresh=refresh)
+        self.config = read_config.config
+        self.config_ttl = read_config.ttl
+        self.ec2_client = boto3.client("ec2", region_name=self.config["Region"])
+
+
+    def is_config_stale(self):
+        """
+        Resolved configuration is stale when its cache entry was invalidated or expired
+        """
+        return bool(self.config.resolved) and read_config_cache(self.config["DomainId"], self.config["UserProfile"], self.config_ttl) is None
+
+
+    def run(self, command, **fields):
+        """
+        Run sdocker command with the same arguments as the command line, eg. run("pool", action="list")
+        """
+        if self.is_config_stale():
+            log.info("SDockerClient configuration cache was invalidated or expired, reading configuration again")
+            self.load_config()
+        log.info(f"SDockerClient running {command} with {fields}")
+        return Commands(get_command_args(command, **fields), self.config, self.ec2_client).run()
+
+
+    def create_host(self, instance_type, count=1, subnet_id=None, no_pool=False, reuse=False, wait=True, fallback_instance_types=[], market="on-demand"):
+        """
+        Create hosts, instance_type can be "type[:count],..." as for create-host. fallback_instance_types are
+        tried in order without capacity, market is "on-demand", "spot" or "spot-preferred". Returns registry
+        entries, hosts are still pending when wait=False, see wait_ready
+        """
+        return self.run(
+            "create-host", instance_type=instance_type, count=count, subnet_id=subnet_id, no_pool=no_pool, reuse=reuse, no_wait=not wait,
+            fallback_instance_types=",".join(fallback_instance_types), market=market
+        )
+
+
+    def wait_ready(self, instance_id=None, timeout=900):
+        """
+        Wait on a host created with wait=False, or on every pending host. Returns their registry entries
+        """
+        return self.run("wait", instance_id=instance_id, timeout=timeout)
+
+
+    def terminate_host(self, instance_id=None):
+        """
+        Terminate host, the current host by default. Returns its instance id
+        """
+        if instance_id:
+            return self.run("terminate-host", instance_id=instance_id)
+        return self.run("terminate-current-host")
+
+
+    def relaunch(self, instance_id=None, market=None):
+        """
+        Replace host, eg. an interrupted spot host, with a new host of the same instance type, fallbacks and
+        market unless market is given, then terminate it. Returns the registry entry of the new host
+        """
+        return self.run("relaunch", instance_id=instance_id, market=market)
+
+
+    def stop_host(self, instance_id=None):
+        """
+        Stop host, the current host by default. Returns its instance id
+        """
+        return self.run("stop-host", instance_id=instance_id)
+
+
+    def start_host(self, instance_id=None):
+        """
+        Start a stopped host and wait on it, the current host by default. Returns its registry entry
+        """
+        return self.run("start-host", instance_id=instance_id)
+
+
+    def attach(self, instance_id=None, instance_type=None):
+        """
+        Register running hosts missing from the host registry. Returns their registry entries
+        """
+        return self.run("attach", instance_id=instance_id, instance_type=instance_type)
+
+
+    def use_host(self, instance_id):
+        """
+        Make host current host. Returns its registry entry
+        """
+        return self.run("use-host", instance_id=instance_id)
+
+
+    def list_hosts(self):
+        """
+        Registry entries of all registered hosts
+        """
+        return list_hosts()
+
+
+    def status(self, instance_id=None):
+        """
+        Registry entries of hosts, every registered host by default, with "Metrics" of running hosts:
+        container stats, disk usage and host CPU, memory, GPU and EFS figures
+        """
+        return self.run("status", instance_id=instance_id)
+
+
+    def get_host(self, instance_id=None):
+        """
+        Registry entry of host, the current host by default, None if not registered
+        """
+        return get_host(instance_id) if instance_id else get_current_host()
+
+
+    def build(self, path, tag, file=None, build_args=[], target=None, cache_dir=None, cache_export=True, instance_id=None):
+        """
+        Build image on host from a build context on EFS. Returns the tag
+        """
+        return self.run("build", path=path, tag=tag, file=file, build_arg=build_args, target=target, cache_dir=cache_dir, no_cache_export=not cache_export, instance_id=instance_id)
+
+
+    def stage(self, path, name=None, delete=False, instance_id=None):
+        """
+        Stage dataset from EFS to local disk of host. Returns the staged path, usable as a file:// channel
+        """
+        return self.run("stage", path=path, name=name, delete=delete, instance_id=instance_id)
+
+
+    def recommend(self, gpus=0, memory=0, vcpus=0, image_size=0, architecture="x86_64", nvme=False, limit=5):
+        """
+        Instance types meeting the stated needs, smallest first, as (instance type, capabilities)
+        """
+        return self.run("recommend", gpus=gpus, memory=memory, vcpus=vcpus, image_size=image_size, architecture=architecture, nvme=nvme, limit=limit)
+
+
+    def submit(self, command=[], image=None, local_mode=False, cpus=1, memory=1, gpus=0, name=None, env=[], instance_id=None):
+        """
+        Queue a job, placed on a host with cpus, memory GiB and gpus free. Returns the queued job, its
+        JobId identifies it in list_jobs and cancel_job
+        """
+        return self.run("submit", job_command=command, image=image, local_mode=local_mode, cpus=cpus, memory=memory, gpus=gpus, name=name, env=env, instance_id=instance_id)
+
+
+    def list_jobs(self):
+        """
+        Submitted jobs with their Status (queued, running, succeeded, failed, cancelled), oldest first
+        """
+        return list_jobs()
+
+
+    def cancel_job(self, job_id):
+        """
+        Cancel a queued or running job. Returns the cancelled job
+        """
+        return self.run("queue", action="cancel", job_id=job_id)
+
+
+    async def create_host_async(self, *args, **kwargs):
+        return await run_in_thread(self.create_host, *args, **kwargs)
+
+
+    async def wait_ready_async(self, *args, **kwargs):
+        return await run_in_thread(self.wait_ready, *args, **kwargs)
+
+
+    async def terminate_host_async(self, *args, **kwargs):
+        return await run_in_thread(self.terminate_host, *args, **kwargs)
+
+
+    async def stop_host_async(self, *args, **kwargs):
+        return await run_in_thread(self.stop_host, *args, **kwargs)
+
+
+    async def start_host_async(self, *args, **kwargs):
+        return await run_in_thread(self.start_host, *args, **kwargs)
+
+
+    async def build_async(self, *args, **kwargs):
+        return await run_in_thread(self.build, *args, **kwargs)
+
+
+    async def stage_async(self, *args, **kwargs):
+        return await run_in_thread(self.stage, *args, **kwargs)
+
+
+    async def submit_async(self, *args, **kwargs):
+        return await run_in_thread(self.submit, *args, **kwargs)
@@ -1,219 +1,492 @@
+import os
 import botocore
 import logging as log
 import boto3
-import requests
-import json
 import time
-import os
-from config import get_home, ReadFromFile, UnhandledError
-from bootstrap import generate_bootstrap_script
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from config import get_home, UnhandledError, invalidate_config_cache, update_config_file, user_profile_tag, is_stale_resource_error
+from bootstrap import generate_bootstrap_script, copy_agents_to_efs, data_root_tag, get_data_root_volume
+from imagegc import default_image_gc, gc_on_host
+from placement import get_placements, filter_offered_placements, get_offered_zones, capacity_errors, fallback_errors, spot_market_options
+from registry import add_host, update_host, remove_host, get_host, get_current_host, set_current_host, list_hosts, get_context_name
+from bake import generate_bake_script, bake_success_message, bake_failure_message
+from build import build_on_host, get_cache_dir
+from stage import stage_on_host
+from readiness import wait_until_ready, clear_ready_marker
+from pool import pool_tag, pool_state_tag, claim_pool_host, list_pool_hosts, set_pool_state
+from discovery import find_healthy_hosts
+from catalog import load_catalog, get_instance_type_info, is_nvidia_gpu, recommend_instance_types
+from worker import start_worker, is_worker_alive
+from errors import InvalidRequestError, HostNotFoundError, HostNotReadyError, CommandFailedError, CapacityError
+from spot import markets, check_interruptions, read_interruption, clear_interruption_marker
+from parse import get_command_args
+from timing import phase, read_traces, summarize_traces
+from registrycache import registry_cache_tag, generate_registry_cache_script, find_registry_caches, get_mirror_url, probe_registry, wait_for_registry
+from jobqueue import add_job, list_jobs, get_job, cancel_job, start_scheduler, is_scheduler_alive, locked_queue, get_jobs_dir, get_host_url
+from monitor import collect_host_status, format_host_status, format_prometheus
+from contexts import create_context, use_context, remove_context, list_contexts, default_context
 
 port = 1111
-retry_wait = 5
 timeout = 720
-max_retries = 720 // retry_wait
 
-def ping_host(dns, port, retry=True):
+def parse_instance_types(instance_types, count=1):
     """
-    Check Docker host health by requesting /version from docker daemon on host
+    Parse "type[:count][,type[:count]]" into [(type, count)], types without a count use count
     """
-    try:
-        log.info(f"Pinging {dns}")
-        response = requests.get(f"http://{dns}:{port}/version")
-        log.info(f"DockerHost {dns} is healthy!")
-        return (True, None)
-    except Exception as error:
-        if retry:
-            log.error(f"Failed to reach {dns}, retrying in {retry_wait}s")
-        else:
-            log.error(f"Failed to reach {dns}, with error message {error.message}")
-        return (False, error)
+    fleet = []
+    for item in instance_types.split(","):
+        instance_type, _, type_count = item.strip().partition(":")
+        fleet.append((instance_type, int(type_count) if type_count else count))
+    return fleet
 
 
 class Commands():
     """
     Class for sdocker commands
     """
-    def __init__(self, args, config):
+    def __init__(self, args, config, ec2_client=None):
         """
-        Create ec2 client and passes args and config
+        Create ec2 client, or reuse ec2_client, and passes args and config. Use run to execute args.func
         """
-        commands = {
+        self.commands = {
             "create-host": self.create_host,
             "terminate-current-host": self.terminate_current_host,
-            "terminate-host": self.terminate_host
+            "terminate-host": self.terminate_host,
+            "pool": self.pool,
+            "stop-host": self.stop_host,
+            "start-host": self.start_host,
+            "list-hosts": self.list_hosts,
+            "use-host": self.use_host,
+            "build": self.build,
+            "bake-ami": self.bake_ami,
+            "stage": self.stage,
+            "attach": self.attach,
+            "recommend": self.recommend,
+            "wait": self.wait,
+            "status": self.status,
+            "timings": self.timings,
+            "registry-cache": self.registry_cache,
+            "submit": self.submit,
+            "queue": self.queue,
+            "gc": self.gc,
+            "relaunch": self.relaunch
         }
-        self.ec2_client = boto3.client("ec2", region_name=config["Region"])
+        self.ec2_client = ec2_client or boto3.client("ec2", region_name=config["Region"])
         self.args = args
         self.config = config
-        commands[self.args.func]()
+        self.catalog = None
+
+
+    def run(self):
+        """
+        Run command of args.func, returns its structured result
+        """
+        return self.commands[self.args.func]()
+
+
+    def check_stale_config(self, error):
+        """
+        Invalidate cached configuration when error shows a cached resource no longer exists
+        """
+        if is_stale_resource_error(error):
+            log.error(f"Cached configuration is stale ({error.response['Error']['Code']}), it will be refreshed on next run")
+            print("Cached configuration is stale, please run the command again")
+            invalidate_config_cache(self.config["DomainId"], self.config["UserProfile"])
 
 
-    def create_sg(self, name, desc, source_sg, from_port, to_port):
+    def terminate_instance(self, instance_id):
         """
-        Creates security group if not found in VPC
+        Terminate instance, remove its docker context and registry entry
         """
-        sg_exist = False
-        log.info(f"Checking {name} security group exists")
+        host = get_host(instance_id)
+        current_host = get_current_host()
         try:
-            check_response= self.ec2_client.describe_security_groups(
-                Filters=[
-                    {
-                        "Name": "group-name",
-                        "Values": [name]
-                    },
-                    {
-                        "Name": "vpc-id",
-                        "Values": [self.config["VpcId"]]
-                    }
-                ]
+            self.ec2_client.terminate_instances(
+                InstanceIds=[instance_id]
             )
-            if len(check_response['SecurityGroups']) > 0:
-                sg_exist = True
-                log.info(f"Found {name} security group {check_response['SecurityGroups'][0]['GroupId']}")
-            else:
-                log.info(f"Security group {name} not found")
-        except botocore.exceptions.ClientError as error:
-            if error.response["Error"]["Code"] == "InvalidGroup.NotFound":
-                log.info(f"Security group {name} not found, 'ClientError' was raised")
-                sg_exist = False
+        except Exception as error:
+            UnhandledError(error)
+        finally:
+            if current_host is None or current_host["InstanceId"] == instance_id:
+                use_context(default_context)
+            if host:
+                remove_context(get_context_name(host))
             else:
-                UnhandledError(error)
+                # Unregistered host, remove contexts named after it by earlier sdocker versions
+                for context in list_contexts():
+                    if context.endswith(f"_{instance_id}"):
+                        remove_context(context)
+            remove_host(instance_id)
+
+
+    def terminate_host(self):
+        """
+        Terminate Docker Host by instance id command
+        """
+        self.terminate_instance(self.args.instance_id)
+        return self.args.instance_id
+
+
+    def terminate_current_host(self):
+        """
+        Terminate Docker Host command
+        """
+        host = get_current_host()
+        if not host:
+            raise HostNotFoundError("No current host, see sdocker list-hosts")
+        instance_id = host["InstanceId"]
+        instance_dns = host["InstanceDns"]
+        self.terminate_instance(instance_id)
+        print(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+        log.info(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+        return instance_id
+
+
+    def get_host_instance_id(self):
+        """
+        Instance id from --instance-id, or the current host in the host registry
+        """
+        if self.args.instance_id:
+            return self.args.instance_id
+        host = get_current_host()
+        if not host:
+            raise HostNotFoundError("No current host, pass --instance-id")
+        return host["InstanceId"]
+
+
+    def get_target_host(self):
+        """
+        Registry entry of --instance-id, or of the current host
+        """
+        host = get_host(self.get_host_instance_id())
+        if not host:
+            raise HostNotFoundError(f"Host {self.args.instance_id} is not registered, see sdocker list-hosts")
+        return host
+
+
+    def stop_host(self):
+        """
+        Stop Docker Host command, the root EBS volume and its image cache are kept
+        """
+        instance_id = self.get_host_instance_id()
+        current_host = get_current_host()
+        host = get_host(instance_id)
+        if host and host.get("DataRoot") == "nvme":
+            message = (f"Docker data root of {instance_id} is on NVMe instance store, which is wiped when the instance stops: "
+                       "its images and build cache will be lost. Set \"DockerDataRoot\": \"ebs\" to keep them across stops")
+            log.warning(message)
+            print(f"Warning: {message}")
+        try:
+            self.ec2_client.stop_instances(InstanceIds=[instance_id])
         except Exception as error:
             UnhandledError(error)
-                
-        if not sg_exist:
-            log.info(f"Creating {name} security group")
-            try:
-                response = self.ec2_client.create_security_group(
-                    Description=desc,
-                    GroupName=name,
-                    VpcId=self.config["VpcId"]
-                )
-                rule_response = self.ec2_client.authorize_security_group_ingress(
-                    GroupId=response["GroupId"],
-                    IpPermissions=[
-                        {
-                            "FromPort": from_port,
-                            "IpProtocol": 'tcp',
-                            "ToPort": to_port,
-                            "UserIdGroupPairs": [
-                                {
-                                    "Description": desc,
-                                    "GroupId": response["GroupId"] if source_sg=="self" else source_sg,
-                                },
-                            ],
-                        },
-                    ]
-                )
-                log.info(f"Security Group id: {response['GroupId']}")
-            except botocore.exceptions.ClientError as error:
-                if error.response["Error"]["Code"] != "InvalidGroup.Duplicate":
-                    UnhandledError(error)
-            except Exception as error:
-                UnhandledError(error)
-            sg = response["GroupId"]
+        update_host(instance_id, Status="stopped")
+        if current_host and current_host["InstanceId"] == instance_id:
+            use_context(default_context)
+        log.info(f"Stopping instance {instance_id}")
+        print(f"Stopping DockerHost instance {instance_id}, use start-host to resume it")
+        return instance_id
+
+
+    def start_host(self):
+        """
+        Start a stopped Docker Host command, refreshes its DNS and docker context then checks health.
+        The host becomes current host if it was before it stopped, or if no host is current
+        """
+        instance_id = self.get_host_instance_id()
+        current_host = get_current_host()
+        make_current = current_host is None or current_host["InstanceId"] == instance_id
+        clear_ready_marker(instance_id)
+        try:
+            self.ec2_client.start_instances(InstanceIds=[instance_id])
+            print(f"Starting DockerHost instance {instance_id}")
+            self.ec2_client.get_waiter("instance_running").wait(InstanceIds=[instance_id])
+            instance = self.ec2_client.describe_instances(InstanceIds=[instance_id])["Reservations"][0]["Instances"][0]
+        except Exception as error:
+            UnhandledError(error)
+        host = get_host(instance_id)
+        if host:
+            remove_context(get_context_name(host))
+            update_host(instance_id, InstanceDns=instance["PrivateDnsName"], Status="pending")
         else:
-            sg = check_response['SecurityGroups'][0]["GroupId"]
-        return sg
+            self.register_host(instance, instance["InstanceType"])
+        print("Waiting on docker host to be ready")
+        IsHealthy = self.wait_for_host(instance_id, instance["PrivateDnsName"])
+        if not IsHealthy[0]:
+            update_host(instance_id, Status="unhealthy")
+            log.error(f"Not able to reach docker daemon on host: {IsHealthy[1]}")
+            raise HostNotReadyError(f"Failed to establish connection with docker daemon on DockerHost instance {instance_id}. Aborting.")
+        print("Docker host is ready!")
+        self.activate_host(instance_id, current=make_current)
+        return get_host(instance_id)
 
 
-    def prepare_efs(self, sg):
+    def list_hosts(self):
         """
-        Adds mount target to EFS
+        List registered hosts command, current host is marked with *
         """
-        if sg not in self.config["MountTargetSecurityGroups"]:
-            try:
-                response = self.config["EFSClient"].modify_mount_target_security_groups(
-                    MountTargetId=self.config["MountTargetId"],
-                    SecurityGroups=[*self.config["MountTargetSecurityGroups"], sg]
-                )
-            except Exception as error:
-                UnhandledError(error)
-    
-    def terminate_host(self):
-        instance_id = self.args.instance_id
+        current_host = get_current_host()
+        check_interruptions(list_hosts())
+        hosts = list_hosts()
+        if not hosts:
+            print("No registered hosts")
+        for host in hosts:
+            current = "*" if current_host and host["InstanceId"] == current_host["InstanceId"] else " "
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(host.get("CreatedAt", 0)))
+            gpu = "gpu" if host.get("Gpu") else "cpu"
+            print(f"{current} {host['InstanceId']}\t{host['InstanceType']}\t{gpu}\t{host.get('Market', 'on-demand')}\t{host.get('AvailabilityZone')}\t{host.get('Status')}\t{created}\t{host['InstanceDns']}")
+            self.print_interruptions([host])
+        return hosts
+
+
+    def use_host(self):
+        """
+        Switch current host and docker context to a registered host command
+        """
+        host = self.make_current_host(self.args.instance_id)
+        print(f"Current host is now {host['InstanceId']} ({host['InstanceType']})")
+        return host
+
+
+    def build(self):
+        """
+        Build image on the docker host from a build context on EFS command
+        """
+        host = self.get_target_host()
+        cache_dir = None
+        if not self.args.no_cache_export:
+            cache_dir = self.args.cache_dir or get_cache_dir(self.args.tag)
+        returncode = build_on_host(
+            host,
+            self.args.path,
+            self.args.tag,
+            self.args.file,
+            self.args.build_arg,
+            self.args.target,
+            cache_dir
+        )
+        if returncode != 0:
+            log.error(f"Build of {self.args.tag} failed with exit code {returncode}")
+            raise CommandFailedError(f"Build of {self.args.tag} failed.", returncode)
+        print(f"Successfully built {self.args.tag} on host {host['InstanceId']}")
+        return self.args.tag
+
+
+    def stage(self):
+        """
+        Stage dataset from EFS to local disk of the docker host command
+        """
+        host = self.get_target_host()
+        returncode, destination = stage_on_host(host, self.args.path, self.args.name, self.args.delete)
+        if returncode != 0:
+            log.error(f"Staging {self.args.path} failed with exit code {returncode}")
+            raise CommandFailedError(f"Staging {self.args.path} failed.", returncode)
+        print(f"Staged {self.args.path} on host {host['InstanceId']} at {destination}")
+        print(f"Use file://{destination} as input channel in SageMaker local mode")
+        return destination
+
+
+    def gc(self):
+        """
+        Garbage collection command, removes stale containers, then images and build cache least recently used
+        first until the data root volume of host is under the low-water mark
+        """
+        host = self.get_target_host()
+        image_gc = {**default_image_gc, **self.config["ImageGC"]}
+        low_water = self.args.low_water if self.args.low_water is not None else image_gc["LowWater"]
+        returncode = gc_on_host(host, low_water, image_gc["ContainerAge"], self.args.dry_run)
+        if returncode != 0:
+            log.error(f"Garbage collection on host {host['InstanceId']} failed with exit code {returncode}")
+            raise CommandFailedError(f"Garbage collection on host {host['InstanceId']} failed.", returncode)
+        return host
+
+
+    def relaunch(self):
+        """
+        Relaunch command, replaces a host, eg. a spot host after an interruption notice, with a new host of
+        the same instance type, fallbacks and market. The replaced host is terminated once the new one is ready
+        """
+        host = self.get_target_host()
+        current_host = get_current_host()
+        market = self.args.market or host.get("Market", "on-demand")
+        args = get_command_args(
+            "create-host",
+            instance_type=host["InstanceType"],
+            fallback_instance_types=",".join(host.get("FallbackInstanceTypes", [])),
+            market=market,
+            subnet_id=self.args.subnet_id
+        )
+        print(f"Relaunching {market} {host['InstanceType']} host {host['InstanceId']}")
+        replacement = Commands(args, self.config, self.ec2_client).create_host()[0]
+        self.terminate_instance(host["InstanceId"])
+        clear_interruption_marker(host["InstanceId"])
+        # create-host made the replacement current, keep another current host current
+        if current_host and current_host["InstanceId"] != host["InstanceId"]:
+            self.make_current_host(current_host["InstanceId"])
+        print(f"Replaced host {host['InstanceId']} with {replacement['InstanceId']} ({replacement['InstanceType']})")
+        return get_host(replacement["InstanceId"])
+
+
+    def print_interruptions(self, hosts):
+        """
+        Offer to relaunch spot hosts that received an interruption notice
+        """
+        for host in hosts:
+            if host.get("Status") == "interrupted":
+                notice = host.get("Interruption") or read_interruption(host["InstanceId"]) or {}
+                print(f"  Spot interruption notice ({notice.get('action')} at {notice.get('time')}), its containers were stopped. "
+                      f"Replace it with: sdocker relaunch --instance-id {host['InstanceId']}")
+
+
+    def bake_ami(self):
+        """
+        Bake DockerHost AMI command, with dind images, packages, framework images and readiness agent
+        pre-installed. The AMI id is recorded in sdocker.conf and used by create-host from then on
+        """
+        images = [*self.config["BakeImages"], *self.args.image]
+        print(f"Baking AMI from {self.config['ImageId']} with framework images {images}")
+        instance = self.launch_instances(
+            self.args.instance_type,
+            user_data=generate_bake_script(images),
+            name="DockerHostBake",
+            iam_instance_profile=self.args.iam_instance_profile
+        )[0]
+        instance_id = instance["InstanceId"]
+        print(f"Launched bake instance {instance_id}, waiting for it to finish and stop")
         try:
-            response = self.ec2_client.terminate_instances(
-                InstanceIds=[instance_id]
+            self.ec2_client.get_waiter("instance_stopped").wait(
+                InstanceIds=[instance_id],
+                WaiterConfig={"Delay": 15, "MaxAttempts": 240}
+            )
+            console = self.ec2_client.get_console_output(InstanceId=instance_id, Latest=True).get("Output", "")
+        except Exception as error:
+            self.ec2_client.terminate_instances(InstanceIds=[instance_id])
+            UnhandledError(error)
+        if bake_failure_message in console:
+            log.error(f"Bake script failed on {instance_id}, see /var/log/sdocker-bake.log in console output")
+            self.ec2_client.terminate_instances(InstanceIds=[instance_id])
+            raise CommandFailedError("Baking AMI failed. Aborting.")
+        if bake_success_message not in console:
+            log.warning(f"Bake result not found in console output of {instance_id}, creating image anyway")
+        name = self.args.name or f"sdocker-{time.strftime('%Y%m%d%H%M%S')}"
+        try:
+            image_id = self.ec2_client.create_image(
+                InstanceId=instance_id,
+                Name=name,
+                Description=f"sdocker DockerHost AMI baked from {self.config['ImageId']}",
+                TagSpecifications=[{"ResourceType": "image", "Tags": [{"Key": user_profile_tag, "Value": self.config["UserProfile"]}]}]
+            )["ImageId"]
+            print(f"Creating image {image_id} ({name})")
+            self.ec2_client.get_waiter("image_available").wait(
+                ImageIds=[image_id],
+                WaiterConfig={"Delay": 15, "MaxAttempts": 240}
             )
-        except Excpetion as error:
+        except Exception as error:
             UnhandledError(error)
-        finally:            
-            os.system(f"docker context use default")
-            os.system(f'docker context rm `docker context list -q | grep "{instance_id}"`')
+        finally:
+            self.ec2_client.terminate_instances(InstanceIds=[instance_id])
+        update_config_file(ImageId=image_id)
+        log.info(f"Baked AMI {image_id}")
+        print(f"Successfully baked AMI {image_id}, saved as ImageId in ~/.sdocker/sdocker.conf")
+        return image_id
 
 
-    def terminate_current_host(self, instance_id=None):
+    def get_instance_type_info(self, instance_type):
         """
-        Terminate Docker Host command
+        Capabilities of instance type from the cached instance type catalog
         """
-        home = get_home()
-        sdocker_host_filename = f"{home}/.sdocker/sdocker-hosts.conf"
+        if self.catalog is None:
+            self.catalog = load_catalog(self.ec2_client, self.config["Region"], self.args.refresh_config)
+        return get_instance_type_info(self.ec2_client, self.config["Region"], instance_type, self.catalog)
+
+
+    def check_architecture(self, instance_type, info):
+        """
+        Fail before launching when instance type cannot run the AMI, eg. an arm64 instance type with an x86_64 AMI
+        """
+        if "x86_64" in info["Architectures"]:
+            return
         try:
-            if not instance_id:
-                sdocker_host_config = ReadFromFile(sdocker_host_filename)
-                instance_id = sdocker_host_config["ActiveHosts"][0]["InstanceId"]
-            response = self.ec2_client.terminate_instances(
-                InstanceIds=[instance_id]
-            )
-        except Excpetion as error:
+            image = self.ec2_client.describe_images(ImageIds=[self.config["ImageId"]])["Images"][0]
+        except Exception as error:
+            self.check_stale_config(error)
             UnhandledError(error)
-        finally:            
-            os.system(f"docker context use default")
-            os.system(f'docker context rm `docker context list -q | grep "{instance_id}"`')
-        instance_id = sdocker_host_config["ActiveHosts"][0]["InstanceId"]
-        instance_dns = sdocker_host_config["ActiveHosts"][0]["InstanceDns"]
-        print(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
-        log.info(f"Successfully terminated instance {instance_id} with private DNS {instance_dns}")
+        if image["Architecture"] not in info["Architectures"]:
+            message = f"InvalidInstanceType: {instance_type} supports {info['Architectures']}, AMI {self.config['ImageId']} is {image['Architecture']}, set an ImageId for it in ~/.sdocker/sdocker.conf"
+            log.error(message)
+            raise InvalidRequestError(message)
 
 
-    def create_host(self):
+    def recommend(self):
         """
-        Create Docker Host command
+        Recommend command, suggests instance types meeting the stated needs from the instance type catalog
         """
-        home = get_home()
-        if self.args.subnet_id:
-            if self.args.subnet_id in self.config["SubnetIds"]:
-                self.config["SubnetId"] = self.args.subnet_id
-            else:
-                message = f"InvalidSubnetId: {self.args.subnet_id} is either invalid subnet id or not part of {self.config['VpcId']}"
-                log.error(message)
-                raise ValueError(message)
-        else:
-            self.config["SubnetId"] = self.config["SubnetIds"][0]
-        docker_sg = self.create_sg(
-            "DockerHost",
-            "Docker host security group",
-            self.config["SecurityGroups"][0],
-            0,
-            65535
+        catalog = load_catalog(self.ec2_client, self.config["Region"], self.args.refresh_config)
+        candidates = recommend_instance_types(
+            catalog,
+            gpus=self.args.gpus,
+            memory_gib=self.args.memory,
+            vcpus=self.args.vcpus,
+            image_size_gib=self.args.image_size,
+            ebs_volume_size=self.config["EBSVolumeSize"],
+            data_root=self.config["DockerDataRoot"],
+            architecture=self.args.architecture,
+            nvme=self.args.nvme
         )
-        efs_sg = self.create_sg(
-            "EFSDockerHost",
-            "EFS security group used with Docker host",
-            "self",
-            2049,
-            2049
+        if not candidates:
+            raise InvalidRequestError("No instance type meets the requested needs.")
+        print("InstanceType\tvCPUs\tMemoryGiB\tGPUs\tGPUMemoryGiB\tNVMeGB\tNetwork")
+        for name, info in candidates[:self.args.limit]:
+            print(f"{name}\t{info['VCpus']}\t{info['MemoryMiB'] / 1024:g}\t{info['Gpus']}\t{info['GpuMemoryMiB'] / 1024:g}\t{info['NvmeGiB']}\t{info['NetworkPerformance']}")
+        print(f"Suggested: sdocker create-host --instance-type {candidates[0][0]}")
+        return candidates[:self.args.limit]
+
+
+    def prepare_launch(self):
+        """
+        Validate subnet, prepare security groups and EFS mount targets, returns security group ids.
+        The preflight result is cached with the configuration, a warm run makes no calls here
+        """
+        self.config.prefetch(
+            "SubnetIds", "VpcId", "SecurityGroups", "UserUid", "Tags", "ImageId",
+            "MountTargets", "SubnetAvailabilityZones", "LaunchSecurityGroups"
         )
-        self.prepare_efs(efs_sg)
+        if self.args.subnet_id and self.args.subnet_id not in self.config["SubnetIds"]:
+            message = f"InvalidSubnetId: {self.args.subnet_id} is either invalid subnet id or not part of {self.config['VpcId']}"
+            log.error(message)
+            raise InvalidRequestError(message)
+        return self.config["LaunchSecurityGroups"]
+
+
+    def launch_instances(self, instance_type, count=1, extra_tags=[], hibernate=False, user_data=None, name="DockerHost", iam_instance_profile=None, market="on-demand", offered=None, data_root=None):
+        """
+        Prepare networking and EFS, then launch count DockerHost instances of instance_type in a single call.
+        Hosts are placed in a subnet in the same AZ as an EFS mount target, other AZs are tried when
+        instance type has no capacity. user_data replaces the DockerHost bootstrap script, eg. to bake an AMI,
+        it can be a function of the EFS mount target of the placement. market "spot" launches one-time spot
+        instances. offered are the AZs offering instance_type when already known. data_root overrides
+        DockerDataRoot. Raises CapacityError when no subnet can launch instance_type in market
+        """
+        home = get_home()
+        data_root = data_root or self.config["DockerDataRoot"]
+        security_groups = self.prepare_launch()
+        info = self.get_instance_type_info(instance_type)
+        self.check_architecture(instance_type, info)
         docker_image_name = "docker:dind"
         gpu_option = ""
-        if "GpuInfo" in self.ec2_client.describe_instance_types(InstanceTypes=[self.args.instance_type])['InstanceTypes'][0].keys():
+        if not user_data and is_nvidia_gpu(info):
             # https://stackoverflow.com/a/71866959/18516713
             docker_image_name = "brandsight/dind:nvidia-docker"
             gpu_option = "--gpus all"
-        bootstrap_script = generate_bootstrap_script(home, self.config['EfsIpAddress'], port, self.config['UserUid'], gpu_option, docker_image_name)
         args = {}
         args["ImageId"] = self.config["ImageId"]
-        args["InstanceType"] = self.args.instance_type
+        args["InstanceType"] = instance_type
         if self.config["Key"]:
             args["KeyName"] = self.config["Key"]
-        args["SecurityGroupIds"] = [docker_sg, efs_sg]
-        args["SubnetId"] = self.config["SubnetId"]
-        args["MinCount"] = 1
-        args["MaxCount"] = 1
-        args["UserData"] = bootstrap_script
+        args["SecurityGroupIds"] = security_groups
+        args["MinCount"] = count
+        args["MaxCount"] = count
         args["BlockDeviceMappings"] = [
                 {
                     "DeviceName": "/dev/xvda",
@@ -222,49 +495,713 @@ class Commands():
                     }
                 }
             ]
-        self.config["Tags"].append({"Key": "Name", "Value": "DockerHost"})
-        args["TagSpecifications"] = [{"Tags": self.config["Tags"], "ResourceType": "instance"}]
+        if hibernate:
+            # Hibernation stores RAM on the root volume, which must be encrypted
+            args["HibernationOptions"] = {"Configured": True}
+            args["BlockDeviceMappings"][0]["Ebs"]["Encrypted"] = True
+        if iam_instance_profile:
+            args["IamInstanceProfile"] = {"Name": iam_instance_profile}
+        if market == "spot":
+            args["InstanceMarketOptions"] = spot_market_options
+        tags = [
+            *self.config["Tags"],
+            {"Key": "Name", "Value": name},
+            {"Key": user_profile_tag, "Value": self.config["UserProfile"]},
+            *extra_tags
+        ]
+        if not user_data:
+            tags.append({"Key": data_root_tag, "Value": get_data_root_volume(data_root, info["NvmeGiB"] > 0)})
+        args["TagSpecifications"] = [{"Tags": tags, "ResourceType": "instance"}]
+        daemon_options = self.config["DockerDaemon"]
+        if self.config["RegistryMirror"]:
+            # dockerd falls back to the upstream registry when the mirror is unreachable
+            daemon_options = {**daemon_options, "RegistryMirrors": [self.config["RegistryMirror"], *daemon_options.get("RegistryMirrors", [])]}
+        if not user_data:
+            copy_agents_to_efs(home)
+        placements = filter_offered_placements(
+            self.ec2_client,
+            self.config,
+            instance_type,
+            get_placements(self.config, self.args.subnet_id),
+            offered
+        )
+        for index, (subnet_id, mount_target) in enumerate(placements):
+            args["SubnetId"] = subnet_id
+            if callable(user_data):
+                args["UserData"] = user_data(mount_target)
+            else:
+                args["UserData"] = user_data or generate_bootstrap_script(
+                    home,
+                    mount_target["IpAddress"],
+                    port,
+                    self.config['UserUid'],
+                    gpu_option,
+                    docker_image_name,
+                    data_root,
+                    daemon_options,
+                    self.config["EfsMount"],
+                    info["NvmeGiB"] > 0,
+                    self.config["ImageGC"]
+                )
+            try:
+                response = self.ec2_client.run_instances(**args)
+                break
+            except botocore.exceptions.ClientError as error:
+                if error.response["Error"]["Code"] in capacity_errors and index < len(placements) - 1:
+                    next_subnet = placements[index + 1][0]
+                    message = (f"No {market} {instance_type} capacity in {self.config['SubnetAvailabilityZones'].get(subnet_id)} "
+                               f"({error.response['Error']['Code']}), falling back to subnet {next_subnet} "
+                               f"in {self.config['SubnetAvailabilityZones'].get(next_subnet)}")
+                    log.warning(message)
+                    print(message)
+                    continue
+                if error.response["Error"]["Code"] in fallback_errors:
+                    message = f"Unable to launch {market} {instance_type} in any subnet: {error.response['Error']['Code']}"
+                    log.warning(message)
+                    raise CapacityError(message) from error
+                self.check_stale_config(error)
+                UnhandledError(error)
+            except Exception as error:
+                UnhandledError(error)
+        for instance in response["Instances"]:
+            log.info(f"Successfully launched instance {instance['InstanceId']} with private DNS {instance['PrivateDnsName']} in {instance['Placement']['AvailabilityZone']}, mounting EFS mount target {mount_target['MountTargetId']} in {mount_target['AvailabilityZone']}")
+        return response["Instances"]
+
+
+    def launch_with_fallback(self, instance_type, count, fallback_instance_types=[], market="on-demand", offered_zones=None):
+        """
+        Launch count hosts with the first (instance type, market) candidate that has capacity in a Studio subnet.
+        Every acceptable instance type is tried in the preferred market before the next market, instance types
+        not offered in the AZ of any Studio subnet are skipped unless none is offered. Instance types of a market
+        are launched concurrently, the first success in priority order is kept and the others are terminated.
+        Returns the instances
+        """
+        instance_types = list(dict.fromkeys([instance_type, *fallback_instance_types]))
+        if offered_zones:
+            subnet_zones = {self.config["SubnetAvailabilityZones"].get(subnet_id) for subnet_id, _ in get_placements(self.config, self.args.subnet_id)}
+            offered_types = [candidate for candidate in instance_types if offered_zones.get(candidate, set()) & subnet_zones]
+            for candidate in set(instance_types) - set(offered_types):
+                log.info(f"{candidate} is not offered in the AZ of any Studio subnet, skipping it")
+            instance_types = offered_types or instance_types
+        errors = []
+
+        def attempt(candidate, candidate_market):
+            try:
+                with phase("launch-attempt", InstanceType=candidate, Market=candidate_market):
+                    return self.launch_instances(candidate, count, market=candidate_market, offered=offered_zones.get(candidate) if offered_zones else None)
+            except Exception as error:
+                return error
+
+        for candidate_market in markets[market]:
+            with ThreadPoolExecutor(max_workers=len(instance_types)) as executor:
+                results = list(executor.map(lambda candidate: attempt(candidate, candidate_market), instance_types))
+            launched = [instances for instances in results if not isinstance(instances, Exception)]
+            if launched:
+                for error in results:
+                    if isinstance(error, Exception) and not isinstance(error, CapacityError):
+                        log.error(f"Launch of a fallback instance type failed: {error}")
+                surplus = [instance["InstanceId"] for instances in launched[1:] for instance in instances]
+                if surplus:
+                    log.info(f"Terminating {surplus}, launched for lower priority instance types")
+                    try:
+                        self.ec2_client.terminate_instances(InstanceIds=surplus)
+                    except Exception as error:
+                        UnhandledError(error)
+                return launched[0]
+            for error in results:
+                if not isinstance(error, CapacityError):
+                    raise error
+            errors.extend(str(error) for error in results)
+            if candidate_market != markets[market][-1]:
+                print(f"No {candidate_market} capacity for {', '.join(instance_types)}, falling back to {markets[market][markets[market].index(candidate_market) + 1]}")
+        raise CapacityError(f"Unable to launch {count} {instance_type} host(s) or an acceptable fallback: {'; '.join(errors)}")
+
+
+    def wait_for_host(self, instance_id, instance_dns):
+        """
+        Wait on instance and docker daemon of host to be ready, returns (healthy, error)
+        """
+        return wait_until_ready(self.ec2_client, instance_id, instance_dns, port, timeout)
+
+
+    def register_host(self, instance, instance_type, fallback_instance_types=None):
+        """
+        Record launched or resumed host in the host registry as pending, with what relaunch needs to replace it.
+        Fields of a host already registered are kept unless known here
+        """
+        add_host(
+            instance["InstanceId"],
+            instance["PrivateDnsName"],
+            port,
+            instance_type,
+            gpu=is_nvidia_gpu(self.get_instance_type_info(instance_type)),
+            availability_zone=instance["Placement"]["AvailabilityZone"],
+            status="pending"
+        )
+        tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+        fields = {"Market": "spot" if instance.get("InstanceLifecycle") == "spot" else "on-demand"}
+        if fallback_instance_types is not None:
+            fields["FallbackInstanceTypes"] = fallback_instance_types
+        if data_root_tag in tags:
+            fields["DataRoot"] = tags[data_root_tag]
+        update_host(instance["InstanceId"], **fields)
+
+
+    def activate_host(self, instance_id, current=True):
+        """
+        Mark healthy host as running, create its docker context and optionally make it current host
+        """
+        host = update_host(instance_id, Status="running")
         try:
-            response = self.ec2_client.run_instances(**args)
+            create_context(get_context_name(host), f"tcp://{host['InstanceDns']}:{host['Port']}", f"sdocker DockerHost {instance_id}")
         except Exception as error:
             UnhandledError(error)
-        instance_id = response['Instances'][0]['InstanceId']
-        instance_dns = response['Instances'][0]['PrivateDnsName']
-        log.info(f"Successfully launched instance {instance_id} with private DNS {instance_dns}")
-        print(f"Successfully launched DockerHost on instance {instance_id} with private DNS {instance_dns}")
-        print("Waiting on docker host to be ready")
-        IsHealthy = (False, "")
-        retries = 0
-        while not IsHealthy[0] and retries < max_retries:
-            time.sleep(retry_wait)
-            IsHealthy = ping_host(instance_dns, port)
-            retries += 1
-        
-        if not IsHealthy[0]:
-            print("Failed to establish connection with docker daemon on DockerHost instance. Terminating instance")
-            log.error("Failed to establish connection with docker daemon on DockerHost instance. Terminating instance")
-            log.error(f"Not able to reach docker daemon on host: {IsHealthy[1]}")
-            self.terminate_current_host(instance_id)
-        
-        assert IsHealthy[0], "Aborting."
+        if current:
+            self.make_current_host(instance_id)
+
+
+    def make_current_host(self, instance_id):
+        """
+        Make registered host current host and switch docker context to it
+        """
+        set_current_host(instance_id)
+        host = get_host(instance_id)
+        try:
+            use_context(get_context_name(host))
+        except Exception as error:
+            UnhandledError(error)
+        return host
+
+
+    def attach_hosts(self, instances):
+        """
+        Restore registry entries and docker contexts of healthy running hosts, returns their (instance id, dns, port)
+        """
+        attached = []
+        for instance in instances:
+            self.register_host(instance, instance["InstanceType"])
+            self.activate_host(instance["InstanceId"], current=False)
+            print(f"Attached DockerHost on instance {instance['InstanceId']} with private DNS {instance['PrivateDnsName']}")
+            attached.append((instance["InstanceId"], instance["PrivateDnsName"], port))
+        return attached
+
+
+    def attach(self):
+        """
+        Attach command, registers running DockerHost instances of the user profile that are missing
+        from the host registry, eg. after the Studio app restarted
+        """
+        instance_ids = [self.args.instance_id] if self.args.instance_id else None
+        instance_types = [self.args.instance_type] if self.args.instance_type else None
+        instances = find_healthy_hosts(self.ec2_client, self.config, port, instance_types, instance_ids)
+        if not instances:
+            raise HostNotReadyError("No healthy running DockerHost found to attach. Aborting.")
+        attached = self.attach_hosts(instances)
+        host = self.make_current_host(attached[0][0])
+        print(f"Current host is now {host['InstanceId']} ({host['InstanceType']})")
+        return [get_host(instance_id) for instance_id, _, _ in attached]
+
+
+    def create_host(self):
+        """
+        Create Docker Host command. Launches --count hosts per instance type with one run_instances
+        call per type, claims warm pool hosts first when available, then health checks all hosts concurrently.
+        With --reuse, healthy running hosts of the user profile are attached before anything is launched
+        """
+        fleet = parse_instance_types(self.args.instance_type, self.args.count)
+        fallback_instance_types = [instance_type.strip() for instance_type in (self.args.fallback_instance_types or "").split(",") if instance_type.strip()]
+        # Validates instance types and loads the catalog once, before launches run concurrently
+        for instance_type in [*[instance_type for instance_type, _ in fleet], *fallback_instance_types]:
+            self.get_instance_type_info(instance_type)
+        hosts = []
+        launches = []
+        ready = []
+        reusable = []
+        if self.args.reuse:
+            reusable = find_healthy_hosts(self.ec2_client, self.config, port, [instance_type for instance_type, _ in fleet])
+        for instance_type, count in fleet:
+            reused = [instance for instance in reusable if instance["InstanceType"] == instance_type][:count]
+            ready.extend(self.attach_hosts(reused))
+            count -= len(reused)
+            claimed = 0
+            # Pool hosts are on-demand instances
+            while not self.args.no_pool and self.args.market != "spot" and claimed < count:
+                with phase("claim-pool", InstanceType=instance_type):
+                    instance = claim_pool_host(self.ec2_client, self.config, instance_type, self.args.subnet_id)
+                if not instance:
+                    break
+                clear_ready_marker(instance["InstanceId"])
+                print(f"Resuming warm pool DockerHost on instance {instance['InstanceId']} with private DNS {instance['PrivateDnsName']}")
+                hosts.append((instance, instance_type))
+                claimed += 1
+            if count > claimed:
+                launches.append((instance_type, count - claimed))
+        fallbacks = {}
+        if launches:
+            with phase("prepare-launch"):
+                self.prepare_launch()
+                # AZs offering every acceptable instance type, candidates offered in no Studio subnet are skipped
+                offered_zones = get_offered_zones(self.ec2_client, {candidate for instance_type, _ in launches for candidate in [instance_type, *fallback_instance_types]})
+
+            def launch(launch):
+                instance_type, count = launch
+                try:
+                    return self.launch_with_fallback(instance_type, count, fallback_instance_types, self.args.market, offered_zones)
+                except CapacityError as error:
+                    log.error(str(error))
+                    print(str(error))
+                    return error
+
+            with phase("launch"), ThreadPoolExecutor(max_workers=len(launches)) as executor:
+                launched = list(executor.map(launch, launches))
+            for (instance_type, _), instances in zip(launches, launched):
+                if isinstance(instances, CapacityError):
+                    continue
+                for instance in instances:
+                    print(f"Successfully launched {instance.get('InstanceLifecycle', 'on-demand')} DockerHost {instance['InstanceType']} on instance {instance['InstanceId']} with private DNS {instance['PrivateDnsName']}")
+                    hosts.append((instance, instance["InstanceType"]))
+                    fallbacks[instance["InstanceId"]] = [candidate for candidate in dict.fromkeys([instance_type, *fallback_instance_types]) if candidate != instance["InstanceType"]]
+            failed_launches = [str(error) for error in launched if isinstance(error, CapacityError)]
+            if failed_launches and not hosts and not ready:
+                raise CapacityError("; ".join(failed_launches))
+        for instance, instance_type in hosts:
+            self.register_host(instance, instance_type, fallbacks.get(instance["InstanceId"], []))
+
+        if self.args.no_wait:
+            if ready:
+                self.make_current_host(ready[0][0])
+            if hosts:
+                start_worker(self.config["Region"], [instance["InstanceId"] for instance, _ in hosts], timeout, make_current=not ready)
+                for instance, _ in hosts:
+                    print(instance["InstanceId"])
+                print("Hosts are booting in the background, use sdocker wait or sdocker status to follow them")
+            return [get_host(instance_id) for instance_id, _, _ in ready] + [get_host(instance["InstanceId"]) for instance, _ in hosts]
+
+        health = []
+        if hosts:
+            print("Waiting on docker host to be ready" if len(hosts) == 1 else f"Waiting on {len(hosts)} docker hosts to be ready")
+            with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+                health = list(executor.map(lambda host: self.wait_for_host(host[0]["InstanceId"], host[0]["PrivateDnsName"]), hosts))
+
+        for (instance, instance_type), IsHealthy in zip(hosts, health):
+            instance_id = instance["InstanceId"]
+            if IsHealthy[0]:
+                with phase("activate", InstanceId=instance_id):
+                    self.activate_host(instance_id, current=False)
+                ready.append((instance_id, instance["PrivateDnsName"], port))
+            else:
+                print(f"Failed to establish connection with docker daemon on DockerHost instance {instance_id}. Terminating instance")
+                log.error(f"Failed to establish connection with docker daemon on DockerHost instance {instance_id}. Terminating instance")
+                log.error(f"Not able to reach docker daemon on host: {IsHealthy[1]}")
+                self.terminate_instance(instance_id)
         
-        print("Docker host is ready!")
-        active_host = {
-            "ActiveHosts": [
-                {
-                    "InstanceId": instance_id,
-                    "InstanceDns": instance_dns,
-                    "Port": port,
-                    "InstanceType": self.args.instance_type
-                }
-            ]
+        if not ready:
+            raise HostNotReadyError("No docker host became ready. Aborting.")
+
+        # First healthy host of the fleet becomes current host
+        self.make_current_host(ready[0][0])
+        print("Docker host is ready!" if len(ready) == 1 else f"{len(ready)} docker hosts are ready!")
+        return [get_host(instance_id) for instance_id, _, _ in ready]
+
+
+    def get_waited_hosts(self):
+        """
+        Hosts selected by --instance-id, or every pending host started by create-host --no-wait
+        """
+        if self.args.instance_id:
+            host = get_host(self.args.instance_id)
+            if not host:
+                raise HostNotFoundError(f"Host {self.args.instance_id} is not registered, see sdocker list-hosts")
+            return [host]
+        return [host for host in list_hosts() if host.get("Status") == "pending" and "WorkerPid" in host]
+
+
+    def wait(self):
+        """
+        Wait command, blocks until hosts started with create-host --no-wait are ready or failed
+        """
+        deadline = time.time() + self.args.timeout
+        while True:
+            hosts = self.get_waited_hosts()
+            pending = [host for host in hosts if host.get("Status") == "pending" and is_worker_alive(host)]
+            if not pending or time.time() > deadline:
+                break
+            time.sleep(1)
+        for host in pending:
+            print(f"Timed out waiting on host {host['InstanceId']}")
+        failed = []
+        for host in hosts:
+            if host.get("Status") == "running":
+                print(f"Docker host {host['InstanceId']} is ready!")
+            elif host.get("Status") in ["failed", "pending"] and host not in pending:
+                # Pending without a worker means the worker died before recording a result
+                print(f"DockerHost {host['InstanceId']} failed: {host.get('Error', 'background worker exited')}")
+                log.error(f"DockerHost {host['InstanceId']} failed: {host.get('Error', 'background worker exited')}")
+                if host.get("Status") == "failed":
+                    remove_host(host["InstanceId"])
+                failed.append(host["InstanceId"])
+        if pending or failed:
+            raise HostNotReadyError(f"Hosts {[host['InstanceId'] for host in pending] + failed} are not ready. Aborting.")
+        return [get_host(host["InstanceId"]) for host in hosts]
+
+
+    def status(self):
+        """
+        Status command, prints registry status of hosts and whether their background worker runs, with
+        container stats, disk usage and host metrics of running hosts. Repeats every --interval with --watch
+        """
+        check_interruptions(list_hosts())
+        hosts = [get_host(self.args.instance_id)] if self.args.instance_id else list_hosts()
+        if not hosts or hosts == [None]:
+            print("No registered hosts")
+            return []
+        previous_metrics = {}
+        while True:
+            statuses = self.collect_status(hosts, previous_metrics)
+            if self.args.format == "prometheus":
+                text = format_prometheus([(host, status) for host, status in statuses if isinstance(status, dict)])
+                if self.args.output:
+                    with open(f"{self.args.output}.{os.getpid()}", "w") as output_file:
+                        output_file.write(text)
+                    os.replace(f"{self.args.output}.{os.getpid()}", self.args.output)
+                else:
+                    print(text, end="")
+            else:
+                if self.args.watch:
+                    # Clear the terminal between refreshes
+                    print("\033[2J\033[H", end="")
+                for host, status in statuses:
+                    worker = "waiting" if host.get("Status") == "pending" and is_worker_alive(host) else ""
+                    print(f"{host['InstanceId']}\t{host['InstanceType']}\t{host.get('Status')}\t{worker}\t{host.get('Error', '')}".rstrip())
+                    self.print_interruptions([host])
+                    if isinstance(status, dict):
+                        print("\n".join(format_host_status(status)))
+                    elif status:
+                        print(f"  Metrics unavailable: {status}")
+            if not self.args.watch:
+                break
+            try:
+                time.sleep(self.args.interval)
+            except KeyboardInterrupt:
+                break
+            hosts = [get_host(host["InstanceId"]) or host for host in hosts]
+        return [{**host, "Metrics": status if isinstance(status, dict) else None} for host, status in statuses]
+
+
+    def collect_status(self, hosts, previous_metrics):
+        """
+        Metrics of running hosts, read concurrently, as (host, status) pairs. Status is None for hosts that
+        are not running and the error message for unreachable ones. previous_metrics keeps host metrics
+        between refreshes so rates cover the whole interval
+        """
+        def collect(host):
+            if host.get("Status", "running") != "running":
+                return None
+            try:
+                status = collect_host_status(host, previous_metrics.get(host["InstanceId"]))
+            except Exception as error:
+                log.info(f"Failed to read metrics of {host['InstanceId']}: {error}")
+                return str(error)
+            if status["HostMetrics"]:
+                previous_metrics[host["InstanceId"]] = status["HostMetrics"]
+            return status
+
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            return list(zip(hosts, executor.map(collect, hosts)))
+
+
+    def submit(self):
+        """
+        Submit command, queues a container run or a local-mode command, placed on a host with enough free capacity
+        """
+        job_command = self.args.job_command or []
+        # argparse keeps the -- separating sdocker options from the job command
+        if job_command[:1] == ["--"]:
+            job_command = job_command[1:]
+        if not job_command and not self.args.image:
+            raise InvalidRequestError("Nothing to run, give an --image and/or a command")
+        if self.args.local_mode and not job_command:
+            raise InvalidRequestError("--local-mode needs a command to run")
+        if self.args.local_mode and self.args.image:
+            raise InvalidRequestError("--image is not used with --local-mode, the command starts its own containers")
+        if not self.args.local_mode and not self.args.image:
+            raise InvalidRequestError("Container jobs need --image, use --local-mode to run the command in Studio")
+        if self.args.instance_id and not get_host(self.args.instance_id):
+            raise HostNotFoundError(f"Host {self.args.instance_id} is not registered, see sdocker list-hosts")
+        cwd = os.getcwd()
+        job = add_job(
+            job_command,
+            image=self.args.image,
+            local_mode=self.args.local_mode,
+            cpus=self.args.cpus,
+            memory_mib=int(self.args.memory * 1024),
+            gpus=self.args.gpus,
+            name=self.args.name,
+            env=self.args.env,
+            instance_id=self.args.instance_id,
+            # Container jobs see the EFS home at the same path, other directories do not exist on the host
+            working_dir=cwd if self.args.local_mode or cwd == get_home() or cwd.startswith(f"{get_home()}/") else None
+        )
+        start_scheduler(self.config["Region"], self.config["MaxJobsPerHost"])
+        if not [host for host in list_hosts() if host.get("Status", "running") in ["running", "pending"]]:
+            print("No running host, the job waits until one is created, see sdocker create-host")
+        print(f"Queued job {job['JobId']}")
+        return job
+
+
+    def queue(self):
+        """
+        Queue command, list, cancel or print logs of submitted jobs
+        """
+        actions = {
+            "list": self.list_queue,
+            "cancel": self.cancel_queued_job,
+            "logs": self.job_logs
         }
-        home = get_home()
+        if self.args.action != "list" and not self.args.job_id:
+            raise InvalidRequestError(f"--job-id is required to {self.args.action} a job")
+        return actions[self.args.action]()
+
+
+    def list_queue(self):
+        """
+        Print active jobs and recently finished ones, with the host they run on
+        """
+        jobs = list_jobs()
+        with locked_queue(write=False) as queue:
+            scheduler = "running" if is_scheduler_alive(queue["SchedulerPid"]) else "idle"
+        print(f"Job scheduler is {scheduler}")
+        for job in jobs:
+            print(f"{job['JobId']}\t{job['Name']}\t{job['Mode']}\t{job['Status']}\t{job.get('InstanceId') or ''}\t"
+                  f"cpus={job['Cpus']} memory={job['MemoryMiB'] / 1024:g}GiB gpus={job['Gpus']}\t"
+                  f"{job.get('ExitCode') if job.get('ExitCode') is not None else ''}\t{job.get('Error') or ''}".rstrip())
+        return jobs
+
+
+    def cancel_queued_job(self):
+        """
+        Cancel a queued or running job, running containers are removed and local-mode commands terminated
+        """
+        job = cancel_job(self.args.job_id)
+        if job is None:
+            raise InvalidRequestError(f"Job {self.args.job_id} is not queued or running, see sdocker queue list")
+        print(f"Cancelled job {self.args.job_id}")
+        return job
+
+
+    def job_logs(self):
+        """
+        Print output of a started job, from its container on the host or its local-mode log file
+        """
+        job = get_job(self.args.job_id)
+        if job is None:
+            raise InvalidRequestError(f"Unknown job {self.args.job_id}, see sdocker queue list")
+        if job["Mode"] == "local" and job.get("Pid"):
+            with open(f"{get_jobs_dir()}/{job['JobId']}.log", "r") as log_file:
+                print(log_file.read(), end="")
+        elif job.get("ContainerId"):
+            host = get_host(job["InstanceId"])
+            if not host:
+                raise HostNotFoundError(f"Host {job['InstanceId']} of job {job['JobId']} is not registered anymore")
+            returncode = subprocess.run(["docker", "-H", get_host_url(host), "logs", job["ContainerId"]]).returncode
+            if returncode != 0:
+                raise CommandFailedError(f"Unable to read logs of job {job['JobId']}", returncode)
+        else:
+            print(f"Job {job['JobId']} is {job['Status']}, it has no logs yet")
+        return job
+
+
+    def timings(self):
+        """
+        Timings command, prints percentiles of phase, AWS API call and bootstrap step durations across saved traces
+        """
+        traces = read_traces(self.args.command, self.args.last)
+        if not traces:
+            print(f"No traces of {self.args.command} in ~/.sdocker/traces")
+            return []
+        summary = summarize_traces(traces)
+        print(f"{len(traces)} {self.args.command} run(s), durations in seconds")
+        print(f"{'Phase':<48}{'Runs':>6}{'Calls':>7}{'P50':>9}{'P90':>9}{'P99':>9}{'Max':>9}")
+        for row in summary:
+            print(f"{row['Name']:<48}{row['Runs']:>6}{row['CallsPerRun']:>7.1f}{row['P50']:>9.2f}{row['P90']:>9.2f}{row['P99']:>9.2f}{row['Max']:>9.2f}")
+        return summary
+
+
+    def registry_cache(self):
+        """
+        Registry cache command, create, use, terminate or show the pull-through registry cache of the VPC
+        """
+        actions = {
+            "create": self.create_registry_cache,
+            "use": self.use_registry_cache,
+            "terminate": self.terminate_registry_cache,
+            "status": self.registry_cache_status
+        }
+        return actions[self.args.action]()
+
+
+    def create_registry_cache(self):
+        """
+        Launch a registry cache instance in the VPC, wait on it and use it as registry mirror of new hosts
+        """
+        caches = find_registry_caches(self.ec2_client, self.config["VpcId"], ["pending", "running"])
+        if caches:
+            print(f"Registry cache {caches[0]['InstanceId']} already serves {self.config['VpcId']}, using it")
+            return self.use_registry_cache()
+        # Hosts reach the cache through the DockerHost security group, its rule may predate the cached preflight
+        self.config.refresh("preflight")
+        storage = self.args.storage
+        user_uid = self.config["UserUid"]
+        instance = self.launch_instances(
+            self.args.instance_type,
+            extra_tags=[{"Key": registry_cache_tag, "Value": self.config["VpcId"]}],
+            user_data=lambda mount_target: generate_registry_cache_script(storage, mount_target["IpAddress"], user_uid),
+            name="DockerRegistryCache"
+        )[0]
+        url = get_mirror_url(instance)
+        print(f"Launched registry cache {instance['InstanceId']} at {url}, waiting on it to be ready")
         try:
-            with open(f"{home}/.sdocker/sdocker-hosts.conf", "w") as file:
-                json.dump(active_host, file)
-            os.system(f"docker context create {self.args.instance_type}_{instance_id} --docker host=tcp://{instance_dns}:{port}")
-            os.system(f"docker context use {self.args.instance_type}_{instance_id}")
+            self.ec2_client.get_waiter("instance_running").wait(InstanceIds=[instance["InstanceId"]])
         except Exception as error:
             UnhandledError(error)
-        return instance_id, instance_dns, port
\ No newline at end of file
+        if not wait_for_registry(url):
+            log.error(f"Registry cache {instance['InstanceId']} did not answer at {url}, terminating it")
+            self.ec2_client.terminate_instances(InstanceIds=[instance["InstanceId"]])
+            raise HostNotReadyError(f"Registry cache did not answer at {url}. Aborting.")
+        update_config_file(RegistryMirror=url)
+        print(f"Registry cache is ready, new hosts use {url} as registry mirror")
+        return url
+
+
+    def use_registry_cache(self):
+        """
+        Use the running registry cache of the VPC as registry mirror of new hosts, eg. one created by another user
+        """
+        caches = find_registry_caches(self.ec2_client, self.config["VpcId"], ["running"])
+        if not caches:
+            raise HostNotFoundError(f"No running registry cache in {self.config['VpcId']}, see sdocker registry-cache create")
+        url = get_mirror_url(caches[0])
+        update_config_file(RegistryMirror=url)
+        print(f"New hosts use registry cache {caches[0]['InstanceId']} at {url} as registry mirror")
+        return url
+
+
+    def terminate_registry_cache(self):
+        """
+        Terminate registry caches of the VPC and stop using them, running hosts fall back to the upstream registry
+        """
+        caches = find_registry_caches(self.ec2_client, self.config["VpcId"])
+        if caches:
+            try:
+                self.ec2_client.terminate_instances(InstanceIds=[instance["InstanceId"] for instance in caches])
+            except Exception as error:
+                UnhandledError(error)
+            print(f"Terminated registry cache(s) {[instance['InstanceId'] for instance in caches]}")
+        else:
+            print(f"No registry cache in {self.config['VpcId']}")
+        update_config_file(RegistryMirror=None)
+        return [instance["InstanceId"] for instance in caches]
+
+
+    def registry_cache_status(self):
+        """
+        Print registry caches of the VPC, whether they answer and the registry mirror used by new hosts
+        """
+        caches = find_registry_caches(self.ec2_client, self.config["VpcId"])
+        if not caches:
+            print(f"No registry cache in {self.config['VpcId']}")
+        for instance in caches:
+            url = get_mirror_url(instance) if instance.get("PrivateIpAddress") else None
+            reachable = "reachable" if url and instance["State"]["Name"] == "running" and probe_registry(url) else "unreachable"
+            print(f"{instance['InstanceId']}\t{instance['InstanceType']}\t{instance['State']['Name']}\t{url}\t{reachable}")
+        print(f"Registry mirror of new hosts: {self.config['RegistryMirror']}")
+        return caches
+
+
+    def pool(self):
+        """
+        Warm pool command, refill, drain or list pre-booted stopped hosts
+        """
+        actions = {
+            "refill": self.refill_pool,
+            "drain": self.drain_pool,
+            "list": self.list_pool
+        }
+        return actions[self.args.action]()
+
+
+    def refill_pool(self):
+        """
+        Launch hosts until pool for instance type has the requested size, then stop them once healthy.
+        Returns the instance ids of the new pool hosts
+        """
+        if not self.args.instance_type:
+            raise InvalidRequestError("--instance-type is required to refill the pool")
+        members = list_pool_hosts(self.ec2_client, self.config, self.args.instance_type)
+        missing = self.args.size - len(members)
+        if missing <= 0:
+            print(f"Pool for {self.args.instance_type} already has {len(members)} host(s)")
+            return []
+        hibernate = self.config["PoolHibernate"]
+        # Pool hosts are stopped once warm, instance store would lose the warmed image cache
+        data_root = "ebs" if self.config["DockerDataRoot"] == "auto" else self.config["DockerDataRoot"]
+        if data_root == "nvme":
+            log.warning("DockerDataRoot is nvme, pool hosts lose their image cache on instance store when stopped")
+        print(f"Launching {missing} {self.args.instance_type} pool host(s)")
+        instances = self.launch_instances(
+            self.args.instance_type,
+            count=missing,
+            extra_tags=[
+                {"Key": pool_tag, "Value": self.args.instance_type},
+                {"Key": pool_state_tag, "Value": "warming"}
+            ],
+            hibernate=hibernate,
+            data_root=data_root
+        )
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            health = list(executor.map(lambda instance: self.wait_for_host(instance["InstanceId"], instance["PrivateDnsName"]), instances))
+        ready = [instance["InstanceId"] for instance, IsHealthy in zip(instances, health) if IsHealthy[0]]
+        failed = [instance["InstanceId"] for instance, IsHealthy in zip(instances, health) if not IsHealthy[0]]
+        if failed:
+            log.error(f"Pool hosts {failed} never became healthy, terminating them")
+            print(f"Pool hosts {failed} never became healthy, terminating them")
+            self.ec2_client.terminate_instances(InstanceIds=failed)
+        if ready:
+            try:
+                self.ec2_client.stop_instances(InstanceIds=ready, Hibernate=hibernate)
+            except Exception as error:
+                UnhandledError(error)
+            set_pool_state(self.ec2_client, ready, "ready")
+            print(f"Pool host(s) {ready} are warm and stopping")
+        return ready
+
+
+    def drain_pool(self):
+        """
+        Terminate pool hosts, of one instance type or all of them. Returns their instance ids
+        """
+        members = list_pool_hosts(self.ec2_client, self.config, self.args.instance_type)
+        if not members:
+            print("Pool is empty")
+            return []
+        instance_ids = [instance["InstanceId"] for instance in members]
+        try:
+            self.ec2_client.terminate_instances(InstanceIds=instance_ids)
+        except Exception as error:
+            UnhandledError(error)
+        log.info(f"Drained pool hosts {instance_ids}")
+        print(f"Terminated pool host(s) {instance_ids}")
+        return instance_ids
+
+
+    def list_pool(self):
+        """
+        Print pool hosts with their instance type and state, returns the instances
+        """
+        members = list_pool_hosts(self.ec2_client, self.config, self.args.instance_type)
+        if not members:
+            print("Pool is empty")
+        for instance in members:
+            tags = {tag["Key"]: tag["Value"] for tag in instance.get("Tags", [])}
+            print(f"{instance['InstanceId']}\t{instance['InstanceType']}\t{tags.get(pool_state_tag)}\t{instance['State']['Name']}")
+        return members
@@ -1,7 +1,43 @@
 import os
 import json
+import time
+import threading
 import boto3
+import botocore
 import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from preflight import run_preflight
+from timing import phase
+
+# Tag identifying the Studio user profile owning a DockerHost instance
+user_profile_tag = "sdocker:user-profile"
+# Seconds a cached discovery result stays valid, overridable via "ConfigCacheTTL" in sdocker.conf
+config_cache_ttl = 3600
+# Fields resolved through AWS API calls that are safe to reuse between invocations
+cached_fields = [
+    "SubnetIds",
+    "VpcId",
+    "EfsId",
+    "UserUid",
+    "SecurityGroups",
+    "ExecutionRole",
+    "UserProfileArn",
+    "Tags",
+    "ImageId",
+    "MountTargets",
+    "SubnetAvailabilityZones",
+    "LaunchSecurityGroups"
+]
+# Error codes meaning a cached resource (AMI, subnet, security group, mount target) no longer exists
+stale_resource_errors = [
+    "InvalidAMIID.NotFound",
+    "InvalidAMIID.Unavailable",
+    "InvalidSubnetID.NotFound",
+    "InvalidGroup.NotFound",
+    "InvalidVpcID.NotFound",
+    "MountTargetNotFound",
+    "SecurityGroupNotFound"
+]
 
 def get_home():
     """
@@ -27,96 +63,418 @@ def ReadFromFile(filename):
     except Exception as error:
         UnhandledError(error)
 
+def get_config_cache_filename():
+    """
+    Location of the on-disk cache of resolved configuration
+    """
+    return f"{get_home()}/.sdocker/config-cache.json"
+
+
+def get_config_cache_key(domain_id, user_profile):
+    """
+    Cache entries are keyed by Studio domain and user profile
+    """
+    return f"{domain_id}/{user_profile}"
+
+
+def read_config_cache(domain_id, user_profile, ttl=config_cache_ttl):
+    """
+    Return cached configuration for domain and user profile, or None if missing or expired
+    """
+    try:
+        with open(get_config_cache_filename(), "r") as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    entry = cache.get(get_config_cache_key(domain_id, user_profile))
+    if not entry or time.time() - entry.get("Timestamp", 0) > ttl:
+        return None
+    return entry["Config"]
+
+
+def write_config_cache(domain_id, user_profile, config):
+    """
+    Store resolved configuration for domain and user profile, replacing the cache file atomically
+    """
+    filename = get_config_cache_filename()
+    try:
+        with open(filename, "r") as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+    cache[get_config_cache_key(domain_id, user_profile)] = {
+        "Timestamp": time.time(),
+        "Config": {field: config[field] for field in cached_fields if field in config}
+    }
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(f"{filename}.{os.getpid()}", "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(f"{filename}.{os.getpid()}", filename)
+    except OSError as error:
+        log.warning(f"Unable to write configuration cache {filename}: {error}")
+
+
+def invalidate_config_cache(domain_id, user_profile):
+    """
+    Drop cached configuration for domain and user profile, next invocation resolves it again
+    """
+    filename = get_config_cache_filename()
+    try:
+        with open(filename, "r") as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return
+    if cache.pop(get_config_cache_key(domain_id, user_profile), None) is None:
+        return
+    log.info(f"Invalidated configuration cache for {domain_id}/{user_profile}")
+    with open(f"{filename}.{os.getpid()}", "w") as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(f"{filename}.{os.getpid()}", filename)
+
+
+def is_stale_resource_error(error):
+    """
+    AWS error shows a resource that may come from cached configuration no longer exists
+    """
+    return isinstance(error, botocore.exceptions.ClientError) and error.response["Error"]["Code"] in stale_resource_errors
+
+
+def get_config_filename():
+    """
+    Location of the user configuration file
+    """
+    return f"{get_home()}/.sdocker/sdocker.conf"
+
+
+def update_config_file(**fields):
+    """
+    Set fields in sdocker.conf, keeping the rest of the user configuration
+    """
+    filename = get_config_filename()
+    try:
+        config_data = ReadFromFile(filename)
+    except FileNotFoundError:
+        config_data = {}
+    config_data.update(fields)
+    with open(f"{filename}.{os.getpid()}", "w") as config_file:
+        json.dump(config_data, config_file, indent=4)
+    os.replace(f"{filename}.{os.getpid()}", filename)
+    log.info(f"Updated {list(fields)} in {filename}")
+
+
+class LazyConfig(dict):
+    """
+    Configuration dictionary that resolves AWS discovered fields on first access.
+    Fields come from the on-disk cache when available, otherwise from the resolver
+    group that produces them. Independent groups can be resolved concurrently with prefetch
+    """
+    def __init__(self, static_config, cached_config=None):
+        super().__init__(static_config)
+        self.resolved = set()
+        # Fields read from the on-disk cache, dropped when a resolver finds one of them stale
+        self.cached = set()
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.cache_lock = threading.Lock()
+        # Resolver groups: name -> (fields produced, resolver function)
+        self.groups = {
+            "domain": (["SubnetIds", "VpcId", "EfsId", "DefaultSecurityGroups", "DefaultExecutionRole"], self.resolve_domain),
+            "profile": (["UserUid", "UserProfileArn", "SecurityGroups", "ExecutionRole"], self.resolve_profile),
+            "tags": (["Tags"], self.resolve_tags),
+            "image": (["ImageId"], self.resolve_image),
+            "efs": (["MountTargets"], self.resolve_efs),
+            "subnets": (["SubnetAvailabilityZones"], self.resolve_subnets),
+            "efs-client": (["EFSClient"], self.resolve_efs_client),
+            "preflight": (["LaunchSecurityGroups"], self.resolve_preflight)
+        }
+        self.group_locks = {group: threading.Lock() for group in self.groups}
+        self.field_groups = {field: group for group, (fields, _) in self.groups.items() for field in fields}
+        if cached_config:
+            log.info("Using cached SageMaker Studio configuration")
+            for field, value in cached_config.items():
+                if field not in self:
+                    dict.__setitem__(self, field, value)
+                    self.resolved.add(field)
+                    self.cached.add(field)
+
+
+    def __missing__(self, key):
+        """
+        Resolve the group producing key, called by dict when key is not set yet
+        """
+        if key not in self.field_groups:
+            raise KeyError(key)
+        self.resolve(self.field_groups[key])
+        return dict.__getitem__(self, key)
+
+
+    def get_client(self, service):
+        """
+        Create boto3 clients once, client creation is not thread safe
+        """
+        with self.clients_lock:
+            if service not in self.clients:
+                self.clients[service] = boto3.client(service, region_name=self["Region"])
+            return self.clients[service]
+
+
+    def resolve(self, group):
+        """
+        Run resolver for group unless all of its fields are already set. When the resolver finds a
+        resource of the cached configuration gone, the cache is cleared and the resolver runs once more
+        """
+        fields, resolver = self.groups[group]
+        with self.group_locks[group]:
+            if all(dict.__contains__(self, field) for field in fields):
+                return
+            log.info(f"Resolving {group} configuration")
+            try:
+                with phase(f"config:{group}"):
+                    values = resolver()
+            except Exception as error:
+                if not is_stale_resource_error(error) or not self.invalidate_cached():
+                    UnhandledError(error)
+                log.warning(f"Cached configuration is stale ({error.response['Error']['Code']}), resolving {group} again")
+                try:
+                    with phase(f"config:{group}"):
+                        values = resolver()
+                except Exception as error:
+                    UnhandledError(error)
+            dict.update(self, values)
+            self.resolved.update(field for field in values if field in cached_fields)
+            log.debug(f"Resource: {values}")
+        self.save_cache()
+
+
+    def prefetch(self, *fields):
+        """
+        Resolve groups for fields concurrently, dependent groups wait on each other
+        """
+        groups = {self.field_groups[field] for field in fields if field in self.field_groups and not dict.__contains__(self, field)}
+        if len(groups) == 0:
+            return
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            for future in [executor.submit(self.resolve, group) for group in groups]:
+                future.result()
+
+
+    def refresh(self, group):
+        """
+        Resolve group again even if its fields are cached, eg. after its resources changed
+        """
+        with self.group_locks[group]:
+            for field in self.groups[group][0]:
+                dict.pop(self, field, None)
+        self.resolve(group)
+
+
+    def invalidate_cached(self):
+        """
+        Drop the fields read from the on-disk cache, in memory and on disk, so they are resolved again.
+        Returns False when no field came from the cache
+        """
+        with self.cache_lock:
+            stale = self.cached
+            self.cached = set()
+        if not stale:
+            return False
+        invalidate_config_cache(self["DomainId"], self["UserProfile"])
+        for field in stale:
+            dict.pop(self, field, None)
+        self.resolved.difference_update(stale)
+        return True
+
+
+    def save_cache(self):
+        """
+        Write resolved cacheable fields to the on-disk cache
+        """
+        with self.cache_lock:
+            write_config_cache(self["DomainId"], self["UserProfile"], {field: self[field] for field in list(self.resolved)})
+
+
+    def resolve_domain(self):
+        response = self.get_client("sagemaker").describe_domain(DomainId=self["DomainId"])
+        return {
+            "SubnetIds": response["SubnetIds"],
+            "VpcId": response["VpcId"],
+            "EfsId": response["HomeEfsFileSystemId"],
+            "DefaultSecurityGroups": response["DefaultUserSettings"].get("SecurityGroups", []),
+            "DefaultExecutionRole": response["DefaultUserSettings"].get("ExecutionRole")
+        }
+
+
+    def resolve_profile(self):
+        response = self.get_client("sagemaker").describe_user_profile(
+            DomainId=self["DomainId"],
+            UserProfileName=self["UserProfile"]
+        )
+        user_settings = response.get("UserSettings", {})
+        return {
+            "UserUid": response["HomeEfsFileSystemUid"],
+            "UserProfileArn": response["UserProfileArn"],
+            "SecurityGroups": user_settings["SecurityGroups"] if "SecurityGroups" in user_settings else self["DefaultSecurityGroups"],
+            "ExecutionRole": user_settings["ExecutionRole"] if "ExecutionRole" in user_settings else self["DefaultExecutionRole"]
+        }
+
+
+    def resolve_tags(self):
+        # TODO add pagination support
+        response = self.get_client("sagemaker").list_tags(ResourceArn=self["UserProfileArn"])
+        return {"Tags": response["Tags"]}
+
+
+    def resolve_image(self):
+        images = []
+        paginator = self.get_client("ec2").get_paginator("describe_images")
+        for page in paginator.paginate(
+            Owners=["amazon"],
+            Filters=[{
+                "Name": "name",
+                "Values": ["AWS Deep Learning Base AMI (Amazon Linux 2) Version *"]
+            }]
+        ):
+            images.extend(page["Images"])
+        # Latest AMI first, describe_images does not sort its results
+        images.sort(key=lambda image: image["CreationDate"], reverse=True)
+        return {"ImageId": images[0]["ImageId"]}
+
+
+    def resolve_efs(self):
+        efs_client = self["EFSClient"]
+        response = efs_client.describe_mount_targets(FileSystemId=self["EfsId"])
+        mount_targets = response["MountTargets"]
+        # One mount target per AZ, fetch their security groups concurrently
+        with ThreadPoolExecutor(max_workers=max(1, len(mount_targets))) as executor:
+            security_groups = list(executor.map(
+                lambda mount_target: efs_client.describe_mount_target_security_groups(
+                    MountTargetId=mount_target["MountTargetId"]
+                )["SecurityGroups"],
+                mount_targets
+            ))
+        return {
+            "MountTargets": [
+                {
+                    "MountTargetId": mount_target["MountTargetId"],
+                    "IpAddress": mount_target["IpAddress"],
+                    "NetworkInterfaceId": mount_target["NetworkInterfaceId"],
+                    "SubnetId": mount_target["SubnetId"],
+                    "AvailabilityZone": mount_target["AvailabilityZoneName"],
+                    "SecurityGroups": mount_target_security_groups
+                }
+                for mount_target, mount_target_security_groups in zip(mount_targets, security_groups)
+            ]
+        }
+
+
+    def resolve_subnets(self):
+        response = self.get_client("ec2").describe_subnets(SubnetIds=self["SubnetIds"])
+        return {"SubnetAvailabilityZones": {subnet["SubnetId"]: subnet["AvailabilityZone"] for subnet in response["Subnets"]}}
+
+
+    def resolve_efs_client(self):
+        return {"EFSClient": self.get_client("efs")}
+
+
+    def resolve_preflight(self):
+        # Also returns MountTargets with the EFSDockerHost group added, so the cache stays accurate
+        return run_preflight(
+            self.get_client("ec2"),
+            self["EFSClient"],
+            self["VpcId"],
+            self["SecurityGroups"][0],
+            self["MountTargets"]
+        )
+
+
 class ReadConfig():
-    def __init__(self):
+    def __init__(self, refresh=False):
         """
-        Prepare configuration based on Studio, networking and configuration file
+        Prepare configuration based on Studio, networking and configuration file.
+        Only local files are read here, AWS discovered fields are resolved lazily by LazyConfig
+        and cached under ~/.sdocker, pass refresh=True to bypass the cache
         """ 
         log.info("Fetching SageMaker Studio configuration")
-        self.config={}
-        home = get_home()
+        static_config = {}
         internal_metadata = "/opt/.sagemakerinternal/internal-metadata.json"
         resource_metadata = "/opt/ml/metadata/resource-metadata.json"
-        config_file = f"{home}/.sdocker/sdocker.conf"
+        config_file = get_config_filename()
         internal_meta = ReadFromFile(internal_metadata)
         resource_meta = ReadFromFile(resource_metadata)
         try:
             config_data = ReadFromFile(config_file)
         except FileNotFoundError:
             config_data = {}
-        self.config["UserProfile"] = resource_meta["UserProfileName"]
-        self.config["DomainId"] = resource_meta["DomainId"]
+        static_config["UserProfile"] = resource_meta["UserProfileName"]
+        static_config["DomainId"] = resource_meta["DomainId"]
         if internal_meta["AppNetworkAccessType"]=="VpcOnly":
-            self.config["VPCOnly"] = True
+            static_config["VPCOnly"] = True
         else:
-            self.config["VPCOnly"] = False
-        self.config["Region"] = os.environ.get("REGION_NAME")
+            static_config["VPCOnly"] = False
+        static_config["Region"] = os.environ.get("REGION_NAME")
         
-        if not self.config["VPCOnly"]:
+        if not static_config["VPCOnly"]:
             log.error("SageMaker Studio Domain must be in \"VPCOnly mode\".")
-        assert self.config["VPCOnly"], "SageMaker Studio Domain must be in \"VPCOnly mode\"."
+        assert static_config["VPCOnly"], "SageMaker Studio Domain must be in \"VPCOnly mode\"."
         
-        sm_client = boto3.client("sagemaker", region_name=self.config["Region"])
-        try:
-            domain_reponse = sm_client.describe_domain(DomainId=self.config["DomainId"])
-            UserProfile_reponse = sm_client.describe_user_profile(
-                DomainId=self.config["DomainId"],
-                UserProfileName=self.config["UserProfile"]
-            )
-            self.config["SubnetIds"] = domain_reponse["SubnetIds"]
-            self.config["VpcId"] = domain_reponse["VpcId"]
-            self.config["EfsId"] = domain_reponse["HomeEfsFileSystemId"]
-            self.config["UserUid"] = UserProfile_reponse["HomeEfsFileSystemUid"]
-            if "UserSettings"  in UserProfile_reponse.keys() and "SecurityGroups" in UserProfile_reponse["UserSettings"].keys():
-                self.config["SecurityGroups"] = UserProfile_reponse["UserSettings"]["SecurityGroups"] 
-            else:
-                self.config["SecurityGroups"] = domain_reponse["DefaultUserSettings"]["SecurityGroups"]
-            if "UserSettings" in UserProfile_reponse.keys() and "ExecutionRole" in UserProfile_reponse["UserSettings"]:
-                self.config["ExecutionRole"] = UserProfile_reponse["UserSettings"]["ExecutionRole"]
-            else:
-                self.config["ExecutionRole"] = domain_reponse["DefaultUserSettings"]["ExecutionRole"]
-            self.config["UserProfileArn"] = UserProfile_reponse["UserProfileArn"]
-            # TODO add pagination support
-            Tags_reponse = sm_client.list_tags(ResourceArn=self.config["UserProfileArn"])
-            self.config["Tags"] = Tags_reponse["Tags"]
-            ec2_client = boto3.client("ec2", region_name=self.config["Region"])
-            if "ImageId" not in config_data.keys():
-                Image_response = ec2_client.describe_images(
-                    Owners=["amazon"],
-                    Filters=[{
-                        "Name": "name",
-                        "Values": ["AWS Deep Learning Base AMI (Amazon Linux 2) Version *"]
-                    }]
-                )
-                image_id = Image_response["Images"][0]["ImageId"]
-            else:
-                image_id = config_data["ImageId"]
-            self.config["ImageId"] = image_id
-            if "Key" in config_data.keys():
-                self.config["Key"] = config_data["Key"]
-            else:
-                self.config["Key"] = None
-            if "EBSVolumeSize" in config_data.keys() and type(config_data["EBSVolumeSize"])==int:
-                self.config["EBSVolumeSize"] = config_data["EBSVolumeSize"]
-            else:
-                self.config["EBSVolumeSize"] = 400
-            efs_client = boto3.client("efs", region_name=self.config["Region"])
-            self.config["EFSClient"] = efs_client
-            Efs_response = efs_client.describe_mount_targets(FileSystemId=self.config["EfsId"])
-            self.config["EfsIpAddress"] = Efs_response["MountTargets"][0]["IpAddress"]
-            self.config["NetworkInterfaceId"] = Efs_response["MountTargets"][0]["NetworkInterfaceId"]
-            self.config["MountTargetId"] = Efs_response["MountTargets"][0]["MountTargetId"]
-            Mount_target_response = efs_client.describe_mount_target_security_groups(
-                MountTargetId=self.config["MountTargetId"]
-            )
-            self.config["MountTargetSecurityGroups"] = Mount_target_response["SecurityGroups"]
-            log.debug(f"Resource: {self.config}")
-        except Exception as error:
-            UnhandledError(error)
+        if "ImageId" in config_data.keys():
+            static_config["ImageId"] = config_data["ImageId"]
+        if "Key" in config_data.keys():
+            static_config["Key"] = config_data["Key"]
+        else:
+            static_config["Key"] = None
+        if "EBSVolumeSize" in config_data.keys() and type(config_data["EBSVolumeSize"])==int:
+            static_config["EBSVolumeSize"] = config_data["EBSVolumeSize"]
+        else:
+            static_config["EBSVolumeSize"] = 400
+        if "DockerDataRoot" in config_data.keys() and config_data["DockerDataRoot"] in ["auto", "nvme", "ebs"]:
+            static_config["DockerDataRoot"] = config_data["DockerDataRoot"]
+        else:
+            static_config["DockerDataRoot"] = "auto"
+        if "DockerDaemon" in config_data.keys() and type(config_data["DockerDaemon"])==dict:
+            static_config["DockerDaemon"] = config_data["DockerDaemon"]
+        else:
+            static_config["DockerDaemon"] = {}
+        if "EfsMount" in config_data.keys() and type(config_data["EfsMount"])==dict:
+            static_config["EfsMount"] = config_data["EfsMount"]
+        else:
+            static_config["EfsMount"] = {}
+        if "BakeImages" in config_data.keys() and type(config_data["BakeImages"])==list:
+            static_config["BakeImages"] = config_data["BakeImages"]
+        else:
+            static_config["BakeImages"] = []
+        if "PoolHibernate" in config_data.keys() and type(config_data["PoolHibernate"])==bool:
+            static_config["PoolHibernate"] = config_data["PoolHibernate"]
+        else:
+            static_config["PoolHibernate"] = False
+        if "RegistryMirror" in config_data.keys() and type(config_data["RegistryMirror"])==str:
+            static_config["RegistryMirror"] = config_data["RegistryMirror"]
+        else:
+            static_config["RegistryMirror"] = None
+        if "ImageGC" in config_data.keys() and type(config_data["ImageGC"])==dict:
+            static_config["ImageGC"] = config_data["ImageGC"]
+        else:
+            static_config["ImageGC"] = {}
+        if "MaxJobsPerHost" in config_data.keys() and type(config_data["MaxJobsPerHost"])==int:
+            static_config["MaxJobsPerHost"] = config_data["MaxJobsPerHost"]
+        else:
+            static_config["MaxJobsPerHost"] = 8
+        if "ConfigCacheTTL" in config_data.keys() and type(config_data["ConfigCacheTTL"])==int:
+            ttl = config_data["ConfigCacheTTL"]
+        else:
+            ttl = config_cache_ttl
+
+        self.ttl = ttl
+        cached_config = None
+        if refresh:
+            log.info("Configuration cache refresh requested")
+        else:
+            cached_config = read_config_cache(static_config["DomainId"], static_config["UserProfile"], ttl)
+        self.config = LazyConfig(static_config, cached_config)
     
 
 def UnhandledError(error):
-    log.error(f"Unhandled Exception: {error}")
-    log.exception()
+    log.exception(f"Unhandled Exception: {error}")
     raise error
         
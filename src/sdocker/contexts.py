@@ -0,0 +1,130 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging as log
+from contextlib import contextmanager
+from config import get_home
+
+# Name docker CLI uses for the context of the local daemon, it has no entry in the context store
+default_context = "default"
+
+
+def get_docker_config_dir():
+    """
+    Docker CLI configuration directory
+    """
+    return os.getenv("DOCKER_CONFIG") or f"{get_home()}/.docker"
+
+
+def get_context_meta_dir(name):
+    """
+    Directory of context metadata, docker CLI names it after the sha256 of the context name
+    """
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return f"{get_docker_config_dir()}/contexts/meta/{digest}"
+
+
+def write_json(filename, data):
+    """
+    Write json file atomically
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f"{filename}.{os.getpid()}", "w") as json_file:
+        json.dump(data, json_file, indent=1)
+    os.replace(f"{filename}.{os.getpid()}", filename)
+
+
+@contextmanager
+def locked_docker_config():
+    """
+    Hold an exclusive lock while reading and writing the context store, so concurrent sdocker runs do not race
+    """
+    config_dir = get_docker_config_dir()
+    os.makedirs(config_dir, exist_ok=True)
+    with open(f"{config_dir}/.sdocker.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield config_dir
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_docker_config(config_dir):
+    """
+    Docker CLI config.json, empty if missing
+    """
+    try:
+        with open(f"{config_dir}/config.json", "r") as config_file:
+            return json.load(config_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def create_context(name, host, description="sdocker DockerHost"):
+    """
+    Create or replace docker context name pointing at docker daemon host, eg. tcp://dns:port
+    """
+    meta = {
+        "Name": name,
+        "Metadata": {"Description": description},
+        "Endpoints": {"docker": {"Host": host, "SkipTLSVerify": False}}
+    }
+    with locked_docker_config():
+        write_json(f"{get_context_meta_dir(name)}/meta.json", meta)
+    log.info(f"Created docker context {name} for {host}")
+
+
+def list_contexts():
+    """
+    Names of contexts in the context store
+    """
+    meta_root = f"{get_docker_config_dir()}/contexts/meta"
+    names = []
+    if not os.path.isdir(meta_root):
+        return names
+    for digest in os.listdir(meta_root):
+        try:
+            with open(f"{meta_root}/{digest}/meta.json", "r") as meta_file:
+                names.append(json.load(meta_file)["Name"])
+        except (FileNotFoundError, ValueError, KeyError):
+            continue
+    return names
+
+
+def get_current_context():
+    """
+    Name of current docker context
+    """
+    return read_docker_config(get_docker_config_dir()).get("currentContext") or default_context
+
+
+def use_context(name):
+    """
+    Make name the current docker context
+    """
+    with locked_docker_config() as config_dir:
+        if name != default_context and not os.path.exists(f"{get_context_meta_dir(name)}/meta.json"):
+            raise ValueError(f"Docker context {name} does not exist")
+        docker_config = read_docker_config(config_dir)
+        if name == default_context:
+            docker_config.pop("currentContext", None)
+        else:
+            docker_config["currentContext"] = name
+        write_json(f"{config_dir}/config.json", docker_config)
+    log.info(f"Current docker context is now {name}")
+
+
+def remove_context(name):
+    """
+    Remove docker context, switching back to the default context if it was current
+    """
+    with locked_docker_config() as config_dir:
+        docker_config = read_docker_config(config_dir)
+        if docker_config.get("currentContext") == name:
+            docker_config.pop("currentContext")
+            write_json(f"{config_dir}/config.json", docker_config)
+        shutil.rmtree(get_context_meta_dir(name), ignore_errors=True)
+        shutil.rmtree(f"{config_dir}/contexts/tls/{hashlib.sha256(name.encode('utf-8')).hexdigest()}", ignore_errors=True)
+    log.info(f"Removed docker context {name}")
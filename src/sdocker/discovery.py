@@ -0,0 +1,49 @@
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from config import UnhandledError, user_profile_tag
+from pool import pool_tag
+from readiness import probe_docker
+
+
+def find_running_hosts(ec2_client, config, instance_types=None, instance_ids=None):
+    """
+    Running DockerHost instances of the user profile, found with tag filters in a single describe_instances call.
+    Warm pool hosts are skipped, they are claimed through the pool
+    """
+    filters = [
+        {"Name": "tag:Name", "Values": ["DockerHost"]},
+        {"Name": f"tag:{user_profile_tag}", "Values": [config["UserProfile"]]},
+        {"Name": "instance-state-name", "Values": ["running"]}
+    ]
+    if instance_types:
+        filters.append({"Name": "instance-type", "Values": instance_types})
+    args = {"Filters": filters}
+    if instance_ids:
+        args["InstanceIds"] = instance_ids
+    instances = []
+    try:
+        paginator = ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(**args):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+    except Exception as error:
+        UnhandledError(error)
+    return [instance for instance in instances if pool_tag not in {tag["Key"] for tag in instance.get("Tags", [])}]
+
+
+def find_healthy_hosts(ec2_client, config, port, instance_types=None, instance_ids=None):
+    """
+    Running DockerHost instances whose docker daemon answers a ping, newest first
+    """
+    instances = find_running_hosts(ec2_client, config, instance_types, instance_ids)
+    if not instances:
+        return []
+    with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+        health = list(executor.map(lambda instance: probe_docker(instance["PrivateDnsName"], port), instances))
+    healthy = []
+    for instance, IsHealthy in zip(instances, health):
+        if IsHealthy[0]:
+            healthy.append(instance)
+        else:
+            log.warning(f"Found DockerHost {instance['InstanceId']} but its docker daemon did not answer: {IsHealthy[1]}")
+    return sorted(healthy, key=lambda instance: instance["LaunchTime"], reverse=True)
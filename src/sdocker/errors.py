@@ -0,0 +1,37 @@
+class SDockerError(Exception):
+    """
+    Base class of errors raised by sdocker commands and SDockerClient
+    """
+
+
+class InvalidRequestError(SDockerError, ValueError):
+    """
+    Invalid argument, eg. unknown instance type, subnet outside the Studio VPC or path outside EFS
+    """
+
+
+class HostNotFoundError(SDockerError, ValueError):
+    """
+    Host is not in the host registry, or there is no current host
+    """
+
+
+class HostNotReadyError(SDockerError):
+    """
+    Docker daemon of host did not become reachable, or no host could be attached
+    """
+
+
+class CapacityError(SDockerError):
+    """
+    No acceptable instance type and market could be launched in any Studio subnet
+    """
+
+
+class CommandFailedError(SDockerError):
+    """
+    Command run on the host failed, eg. an image build or dataset staging
+    """
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Metrics exporter of DockerHost instances, installed and started by the bootstrap script next to
+dockerd-server. Serves host CPU, memory, data root usage, GPU utilization and EFS (NFS) traffic in
+Prometheus text format on /metrics, read by sdocker status. Standard library only, it runs with the
+python3 of the host
+"""
+import os
+import argparse
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+exporter_port = 1112
+# Fields of the cpu line of /proc/stat, in order
+cpu_modes = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+
+
+def read_cpu():
+    """
+    Seconds spent by all CPUs in each mode since boot, as (mode, seconds)
+    """
+    with open("/proc/stat", "r") as stat_file:
+        fields = stat_file.readline().split()[1:len(cpu_modes) + 1]
+    ticks = os.sysconf("SC_CLK_TCK")
+    return [(mode, int(value) / ticks) for mode, value in zip(cpu_modes, fields)]
+
+
+def read_memory():
+    """
+    Total and available memory in bytes
+    """
+    values = {}
+    with open("/proc/meminfo", "r") as meminfo_file:
+        for line in meminfo_file:
+            name, value = line.split(":", 1)
+            values[name] = int(value.split()[0]) * 1024
+    return values["MemTotal"], values["MemAvailable"]
+
+
+def read_nfs(mount_point):
+    """
+    Bytes read from and written to the NFS server by mount_point since it was mounted, None if not mounted
+    """
+    in_mount = False
+    with open("/proc/self/mountstats", "r") as mountstats_file:
+        for line in mountstats_file:
+            if line.startswith("device "):
+                in_mount = f" mounted on {mount_point} with fstype nfs" in line
+            elif in_mount and line.strip().startswith("bytes:"):
+                # normal read, normal write, direct read, direct write, server read, server write, read pages, write pages
+                fields = [int(value) for value in line.split()[1:]]
+                return fields[4], fields[5]
+    return None
+
+
+def read_gpus():
+    """
+    NVIDIA GPUs as (index, utilization percent, memory used bytes, memory total bytes), empty without GPUs
+    """
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index,utilization.gpu,memory.used,memory.total", "--format=csv,noheader,nounits"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    gpus = []
+    for line in result.stdout.splitlines():
+        try:
+            index, utilization, memory_used, memory_total = [value.strip() for value in line.split(",")]
+            gpus.append((index, float(utilization), int(memory_used) * 2**20, int(memory_total) * 2**20))
+        except ValueError:
+            continue
+    return gpus
+
+
+def render_metrics(data_root, nfs_mount):
+    """
+    Current host metrics in Prometheus text format
+    """
+    lines = []
+    def add(name, metric_type, description, samples):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    add("sdocker_host_cpu_seconds_total", "counter", "Seconds all CPUs spent in each mode", [({"mode": mode}, seconds) for mode, seconds in read_cpu()])
+    add("sdocker_host_cpus", "gauge", "Online CPUs", [({}, os.cpu_count())])
+    memory_total, memory_available = read_memory()
+    add("sdocker_host_memory_total_bytes", "gauge", "Total memory", [({}, memory_total)])
+    add("sdocker_host_memory_available_bytes", "gauge", "Memory available without swapping", [({}, memory_available)])
+    stat = os.statvfs(data_root)
+    add("sdocker_host_data_root_size_bytes", "gauge", "Size of the docker data root volume", [({}, stat.f_blocks * stat.f_frsize)])
+    add("sdocker_host_data_root_used_bytes", "gauge", "Used space of the docker data root volume", [({}, (stat.f_blocks - stat.f_bfree) * stat.f_frsize)])
+    gpus = read_gpus()
+    if gpus:
+        add("sdocker_gpu_utilization_percent", "gauge", "GPU utilization", [({"gpu": index}, utilization) for index, utilization, _, _ in gpus])
+        add("sdocker_gpu_memory_used_bytes", "gauge", "GPU memory used", [({"gpu": index}, used) for index, _, used, _ in gpus])
+        add("sdocker_gpu_memory_total_bytes", "gauge", "GPU memory", [({"gpu": index}, total) for index, _, _, total in gpus])
+    nfs = read_nfs(nfs_mount)
+    if nfs:
+        add("sdocker_nfs_read_bytes_total", "counter", "Bytes read from EFS", [({"mount": nfs_mount}, nfs[0])])
+        add("sdocker_nfs_write_bytes_total", "counter", "Bytes written to EFS", [({"mount": nfs_mount}, nfs[1])])
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="sdocker-metrics")
+    parser.add_argument("--port", type=int, default=exporter_port)
+    parser.add_argument("--data-root", required=True)
+    parser.add_argument("--nfs-mount", default="/mnt/efs")
+    args = parser.parse_args()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics(args.data_root, args.nfs_mount).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("", args.port), MetricsHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
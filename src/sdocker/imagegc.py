@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Garbage collection agent of DockerHost instances, installed and started by the bootstrap script.
+Watches usage of the docker data root volume and, past the high-water mark, removes old stopped
+containers, then images and build cache in least recently used order until usage is under the
+low-water mark. Images used by containers are never removed. Standard library only, it runs with
+the python3 of the host, and in a container on the host for sdocker gc
+"""
+import os
+import json
+import time
+import socket
+import calendar
+import argparse
+import subprocess
+import http.client
+from urllib.parse import quote, urlencode
+
+# Defaults of "ImageGC" in sdocker.conf, marks are percents of the data root volume. HighWater null disables the agent
+default_image_gc = {
+    "HighWater": 85,
+    "LowWater": 70,
+    "Interval": 60,
+    "ContainerAge": 3600
+}
+# Image running sdocker gc on the host, next to the daemon
+gc_image = "python:3.11-alpine"
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection to the docker daemon socket
+    """
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerAPI():
+    """
+    Minimal docker Engine API client, docker_host is tcp://host:port or unix:///path
+    """
+    def __init__(self, docker_host):
+        self.docker_host = docker_host
+
+
+    def request(self, method, path, params=None, timeout=600):
+        if self.docker_host.startswith("unix://"):
+            connection = UnixHTTPConnection(self.docker_host[len("unix://"):], timeout)
+        else:
+            connection = http.client.HTTPConnection(self.docker_host.split("://")[-1], timeout=timeout)
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            body = response.read()
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise DockerAPIError(response.status, body.decode(errors="replace").strip())
+        return json.loads(body) if body else None
+
+
+def parse_time(timestamp):
+    """
+    Epoch seconds of an RFC 3339 timestamp of the Engine API, fractional seconds are dropped
+    """
+    if not timestamp:
+        return 0
+    return calendar.timegm(time.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S"))
+
+
+def get_disk_usage(data_root):
+    """
+    Used percent and size in bytes of the volume holding the docker data root
+    """
+    stat = os.statvfs(data_root)
+    total = stat.f_blocks * stat.f_frsize
+    used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    return 100 * used / total, total
+
+
+def get_stale_containers(df, container_age, now):
+    """
+    Stopped containers created more than container_age seconds ago, eg. finished local mode jobs
+    """
+    return [
+        container for container in df["Containers"] or []
+        if container["State"] in ["exited", "dead", "created"] and now - container["Created"] > container_age
+    ]
+
+
+def get_eviction_candidates(api, df):
+    """
+    Images no container uses and unused build cache records, least recently used first, as dicts with
+    Kind, Id, Name, Size (bytes freed) and LastUsed. An image was last used when it was pulled, tagged or
+    a container was created from it
+    """
+    used_at = {}
+    for container in df["Containers"] or []:
+        used_at[container["ImageID"]] = max(used_at.get(container["ImageID"], 0), container["Created"])
+    candidates = []
+    for image in df["Images"] or []:
+        if image["Id"] in used_at or image.get("Containers", 0) > 0:
+            continue
+        try:
+            last_tagged = parse_time(api.request("GET", f"/images/{image['Id']}/json")["Metadata"].get("LastTagTime"))
+        except DockerAPIError:
+            continue
+        tags = [tag for tag in image.get("RepoTags") or [] if tag != "<none>:<none>"]
+        candidates.append({
+            "Kind": "image",
+            "Id": image["Id"],
+            "Name": ", ".join(tags) or image["Id"][:19],
+            "Tags": tags,
+            "Size": image["Size"] - max(image.get("SharedSize", 0), 0),
+            "LastUsed": max(image["Created"], last_tagged)
+        })
+    for record in df.get("BuildCache") or []:
+        if record.get("InUse"):
+            continue
+        candidates.append({
+            "Kind": "build-cache",
+            "Id": record["ID"],
+            "Name": record.get("Description") or record["ID"],
+            "Size": record["Size"],
+            "LastUsed": parse_time(record.get("LastUsedAt") or record.get("CreatedAt"))
+        })
+    return sorted(candidates, key=lambda candidate: candidate["LastUsed"])
+
+
+def remove_image(api, candidate):
+    """
+    Untag image, removing it with its tags gone. Returns False when the daemon refuses, eg. a child image uses it
+    """
+    try:
+        for reference in candidate["Tags"] or [candidate["Id"]]:
+            api.request("DELETE", f"/images/{quote(reference, safe='')}")
+        return True
+    except DockerAPIError as error:
+        gc_log(f"Skipping image {candidate['Name']}: {error}")
+        return False
+
+
+def collect(api, data_root, low_water, container_age, dry_run=False):
+    """
+    Remove stale containers, then images and build cache least recently used first until data root usage
+    is under low_water percent. With dry_run, print what would be removed from estimated sizes.
+    Returns the removed (or would be removed) candidates
+    """
+    usage, total = get_disk_usage(data_root)
+    gc_log(f"Data root usage {usage:.1f}%, low-water mark {low_water}%")
+    estimate = usage
+    removed = []
+    df = api.request("GET", "/system/df")
+    for container in get_stale_containers(df, container_age, time.time()):
+        if estimate <= low_water:
+            break
+        name = container["Names"][0].lstrip("/") if container.get("Names") else container["Id"][:12]
+        gc_log(f"{'Would remove' if dry_run else 'Removing'} stopped container {name} ({container.get('SizeRw', 0) / 2**20:.0f} MiB)")
+        if not dry_run:
+            try:
+                api.request("DELETE", f"/containers/{container['Id']}")
+            except DockerAPIError as error:
+                gc_log(f"Skipping container {name}: {error}")
+                continue
+        removed.append({"Kind": "container", "Id": container["Id"], "Name": name, "Size": container.get("SizeRw", 0)})
+        estimate -= 100 * container.get("SizeRw", 0) / total
+        if not dry_run:
+            estimate = get_disk_usage(data_root)[0]
+    if removed and not dry_run:
+        # Images of removed containers become candidates
+        df = api.request("GET", "/system/df")
+    cache_size = sum(record["Size"] for record in df.get("BuildCache") or [])
+    for candidate in get_eviction_candidates(api, df):
+        if estimate <= low_water:
+            break
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.gmtime(candidate["LastUsed"]))
+        gc_log(f"{'Would remove' if dry_run else 'Removing'} {candidate['Kind']} {candidate['Name']} ({candidate['Size'] / 2**20:.0f} MiB, last used {last_used} UTC)")
+        if not dry_run:
+            if candidate["Kind"] == "image" and not remove_image(api, candidate):
+                continue
+            if candidate["Kind"] == "build-cache":
+                # BuildKit prunes least recently used records first until the cache fits keep-storage
+                cache_size -= candidate["Size"]
+                api.request("POST", "/build/prune", {"keep-storage": max(cache_size, 0)})
+        removed.append(candidate)
+        estimate -= 100 * candidate["Size"] / total
+        if not dry_run:
+            estimate = get_disk_usage(data_root)[0]
+    freed = sum(candidate["Size"] for candidate in removed)
+    gc_log(f"{'Would free' if dry_run else 'Freed'} {freed / 2**30:.2f} GiB, data root usage {usage:.1f}% -> {estimate:.1f}%{' (estimated)' if dry_run else ''}")
+    if estimate > low_water:
+        gc_log("Low-water mark not reached, remaining images and build cache are in use")
+    return removed
+
+
+def gc_log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} sdocker-gc: {message}", flush=True)
+
+
+def get_agent_source():
+    """
+    Source of this module, run in a container on the host by sdocker gc. The agent started by the
+    bootstrap script is the copy in ~/.sdocker/agents on EFS
+    """
+    with open(os.path.abspath(__file__), "r") as source_file:
+        return source_file.read()
+
+
+def gc_on_host(host, low_water, container_age, dry_run=False):
+    """
+    Run a collection pass on host from Studio, in a container next to the daemon. Returns its exit code
+    """
+    command = [
+        "docker", "-H", f"tcp://{host['InstanceDns']}:{host['Port']}",
+        "run", "--rm",
+        "-v", "/var/run/docker.sock:/var/run/docker.sock",
+        "-v", "/var/lib/docker:/data-root:ro",
+        gc_image,
+        "python", "-u", "-c", get_agent_source(),
+        "--once",
+        "--docker-host", "unix:///var/run/docker.sock",
+        "--data-root", "/data-root",
+        "--low-water", str(low_water),
+        "--container-age", str(container_age)
+    ]
+    if dry_run:
+        command.append("--dry-run")
+    return subprocess.run(command).returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="sdocker-gc")
+    parser.add_argument("--docker-host", default="tcp://localhost:2375")
+    parser.add_argument("--data-root", required=True)
+    parser.add_argument("--high-water", type=float, default=default_image_gc["HighWater"])
+    parser.add_argument("--low-water", type=float, default=default_image_gc["LowWater"])
+    parser.add_argument("--interval", type=int, default=default_image_gc["Interval"])
+    parser.add_argument("--container-age", type=int, default=default_image_gc["ContainerAge"])
+    parser.add_argument("--once", action="store_true", help="collect down to the low-water mark once, then exit")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    api = DockerAPI(args.docker_host)
+    if args.once:
+        collect(api, args.data_root, args.low_water, args.container_age, args.dry_run)
+        return
+    gc_log(f"Watching {args.data_root}, high-water mark {args.high_water}%, low-water mark {args.low_water}%")
+    while True:
+        try:
+            if get_disk_usage(args.data_root)[0] >= args.high_water:
+                collect(api, args.data_root, args.low_water, args.container_age, args.dry_run)
+        except Exception as error:
+            # Daemon restarting or not up yet
+            gc_log(f"Collection failed: {error}")
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
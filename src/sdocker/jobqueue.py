@@ -0,0 +1,491 @@
+#!/opt/conda/bin/python3
+"""
+Job queue of sdocker submit. Jobs are kept in ~/.sdocker/queue.json and placed on registered hosts by a
+detached scheduler, based on the free vCPUs, memory and GPUs of each host
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import signal
+import argparse
+import subprocess
+import requests
+import logging as log
+import boto3
+from contextlib import contextmanager
+from config import get_home
+from registry import list_hosts
+from catalog import load_catalog, get_instance_type_info
+from errors import CommandFailedError
+from spot import check_interruptions
+
+# Seconds between scheduler passes over the queue
+poll_interval = 5
+# (connect, read) timeout in seconds of docker daemon API requests
+daemon_timeout = (2, 10)
+# Memory of the host left to the OS and dockerd, never reserved by jobs
+host_memory_reserve_mib = 1024
+# Finished jobs kept in the queue file, older ones are removed
+max_finished_jobs = 200
+# Prefix of job container names, followed by the job id
+job_container_prefix = "sdocker-job-"
+active_states = ["queued", "starting", "running"]
+
+
+def get_queue_filename():
+    """
+    Location of the job queue
+    """
+    return f"{get_home()}/.sdocker/queue.json"
+
+
+def get_jobs_dir():
+    """
+    Directory of local-mode job logs and exit codes
+    """
+    return f"{get_home()}/.sdocker/jobs"
+
+
+def load_queue(filename):
+    """
+    Read queue file, missing or empty file is an empty queue
+    """
+    try:
+        with open(filename, "r") as queue_file:
+            queue = json.load(queue_file)
+    except (FileNotFoundError, ValueError):
+        queue = {}
+    queue.setdefault("Jobs", [])
+    queue.setdefault("SchedulerPid", None)
+    return queue
+
+
+@contextmanager
+def locked_queue(write=True):
+    """
+    Hold an exclusive lock on the queue and yield it, changes are written back atomically on exit
+    """
+    filename = get_queue_filename()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f"{filename}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        try:
+            queue = load_queue(filename)
+            yield queue
+            if write:
+                finished = [job for job in queue["Jobs"] if job["Status"] not in active_states]
+                for job in finished[:-max_finished_jobs]:
+                    queue["Jobs"].remove(job)
+                with open(f"{filename}.{os.getpid()}", "w") as queue_file:
+                    json.dump(queue, queue_file, indent=4)
+                os.replace(f"{filename}.{os.getpid()}", filename)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def list_jobs():
+    """
+    All jobs of the queue, oldest first
+    """
+    with locked_queue(write=False) as queue:
+        return queue["Jobs"]
+
+
+def get_job(job_id):
+    """
+    Job of the queue, or None if unknown
+    """
+    for job in list_jobs():
+        if job["JobId"] == job_id:
+            return job
+    return None
+
+
+def add_job(command, image=None, local_mode=False, cpus=1, memory_mib=1024, gpus=0, name=None, env=[], instance_id=None, working_dir=None):
+    """
+    Queue a container run of image, or with local_mode a command run in Studio with DOCKER_HOST set to
+    the host, eg. a SageMaker local mode training script. cpus, memory_mib and gpus are reserved on the host
+    """
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        "JobId": job_id,
+        "Name": name or job_id,
+        "Mode": "local" if local_mode else "container",
+        "Image": image,
+        "Command": command,
+        "Env": env,
+        "WorkingDir": working_dir,
+        "Cpus": cpus,
+        "MemoryMiB": memory_mib,
+        "Gpus": gpus,
+        "RequestedHost": instance_id,
+        "Status": "queued",
+        "SubmittedAt": time.time()
+    }
+    with locked_queue() as queue:
+        queue["Jobs"].append(job)
+    log.info(f"Queued job {job_id}: {command}")
+    return job
+
+
+def update_job(job_id, **fields):
+    """
+    Update fields of a job, returns the updated job or None if unknown
+    """
+    with locked_queue() as queue:
+        for job in queue["Jobs"]:
+            if job["JobId"] == job_id:
+                job.update(fields)
+                return dict(job)
+    return None
+
+
+def claim_job(job_id, instance_id, gpu_devices):
+    """
+    Move queued job to starting on host, False if it was cancelled meanwhile
+    """
+    with locked_queue() as queue:
+        for job in queue["Jobs"]:
+            if job["JobId"] == job_id and job["Status"] == "queued":
+                job.update(Status="starting", InstanceId=instance_id, GpuDevices=gpu_devices)
+                return True
+    return False
+
+
+def get_host_url(host):
+    return f"tcp://{host['InstanceDns']}:{host['Port']}"
+
+
+def get_host_capacity(host, catalog, ec2_client, region):
+    """
+    vCPUs and memory of host from its docker daemon /info, GPUs from its instance type. None if unreachable
+    """
+    try:
+        response = requests.get(f"http://{host['InstanceDns']}:{host['Port']}/info", timeout=daemon_timeout)
+        response.raise_for_status()
+        info = response.json()
+    except Exception as error:
+        log.info(f"Failed to read capacity of host {host['InstanceId']}: {error}")
+        return None
+    gpus = get_instance_type_info(ec2_client, region, host["InstanceType"], catalog)["Gpus"] if host.get("Gpu") else 0
+    return {
+        "Cpus": info["NCPU"],
+        "MemoryMiB": info["MemTotal"] // 2**20 - host_memory_reserve_mib,
+        "Gpus": gpus
+    }
+
+
+def get_free_capacity(host, capacity, jobs):
+    """
+    Capacity of host minus the reservations of its active jobs, with the GPU devices still free
+    """
+    placed = [job for job in jobs if job.get("InstanceId") == host["InstanceId"] and job["Status"] in ["starting", "running"]]
+    used_devices = {device for job in placed for device in job.get("GpuDevices", [])}
+    return {
+        "Cpus": capacity["Cpus"] - sum(job["Cpus"] for job in placed),
+        "MemoryMiB": capacity["MemoryMiB"] - sum(job["MemoryMiB"] for job in placed),
+        "GpuDevices": [device for device in range(capacity["Gpus"]) if device not in used_devices],
+        "Jobs": len(placed)
+    }
+
+
+def place_job(job, free, max_jobs_per_host):
+    """
+    Host for job, the one left with the least free GPUs, vCPUs then memory so small jobs are packed onto
+    few hosts and GPU hosts stay free for GPU jobs. None when no host fits
+    """
+    candidates = []
+    for instance_id, host_free in free.items():
+        if job.get("RequestedHost") and job["RequestedHost"] != instance_id:
+            continue
+        if (host_free["Jobs"] < max_jobs_per_host
+                and host_free["Cpus"] >= job["Cpus"]
+                and host_free["MemoryMiB"] >= job["MemoryMiB"]
+                and len(host_free["GpuDevices"]) >= job["Gpus"]):
+            candidates.append((
+                len(host_free["GpuDevices"]) - job["Gpus"],
+                host_free["Cpus"] - job["Cpus"],
+                host_free["MemoryMiB"] - job["MemoryMiB"],
+                instance_id
+            ))
+    return min(candidates)[-1] if candidates else None
+
+
+def start_container_job(job, host):
+    """
+    Run job container detached on host with its reservations as limits, returns the container id.
+    The EFS home is mounted at the same path, as on Studio
+    """
+    home = get_home()
+    command = [
+        "docker", "-H", get_host_url(host),
+        "run", "-d",
+        "--name", f"{job_container_prefix}{job['JobId']}",
+        "--label", f"sdocker.job={job['JobId']}",
+        "--cpus", str(job["Cpus"]),
+        "--memory", f"{job['MemoryMiB']}m",
+        "-v", f"{home}:{home}"
+    ]
+    if job["GpuDevices"]:
+        command += ["--gpus", f"\"device={','.join(str(device) for device in job['GpuDevices'])}\""]
+    if job["WorkingDir"]:
+        command += ["-w", job["WorkingDir"]]
+    for variable in job["Env"]:
+        command += ["-e", variable]
+    command += [job["Image"], *job["Command"]]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise CommandFailedError(result.stderr.strip(), result.returncode)
+    return result.stdout.strip()
+
+
+def start_local_job(job, host):
+    """
+    Run job command in Studio against the docker daemon of host, returns its process. The exit code is
+    written next to its log so it survives scheduler restarts
+    """
+    os.makedirs(get_jobs_dir(), exist_ok=True)
+    env = {**os.environ, "DOCKER_HOST": get_host_url(host), "SDOCKER_JOB_EXIT": f"{get_jobs_dir()}/{job['JobId']}.exit"}
+    env.update(variable.split("=", 1) for variable in job["Env"] if "=" in variable)
+    if job["GpuDevices"]:
+        env["SDOCKER_GPU_DEVICES"] = ",".join(str(device) for device in job["GpuDevices"])
+    script = '"$@"; code=$?; echo $code > "$SDOCKER_JOB_EXIT.tmp"; mv "$SDOCKER_JOB_EXIT.tmp" "$SDOCKER_JOB_EXIT"'
+    with open(f"{get_jobs_dir()}/{job['JobId']}.log", "w") as log_file:
+        process = subprocess.Popen(
+            ["sh", "-c", script, "sh", *job["Command"]],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            cwd=job["WorkingDir"],
+            env=env,
+            start_new_session=True
+        )
+    return process
+
+
+def start_job(job, host):
+    """
+    Start claimed job on host and mark it running, or failed when it could not start
+    """
+    try:
+        if job["Mode"] == "local":
+            process = start_local_job(job, host)
+            fields = {"Pid": process.pid}
+        else:
+            process = None
+            fields = {"ContainerId": start_container_job(job, host)}
+    except Exception as error:
+        log.error(f"Unable to start job {job['JobId']} on host {host['InstanceId']}: {error}")
+        update_job(job["JobId"], Status="failed", Error=str(error), FinishedAt=time.time())
+        return None
+    log.info(f"Started job {job['JobId']} on host {host['InstanceId']}")
+    with locked_queue() as queue:
+        for entry in queue["Jobs"]:
+            if entry["JobId"] == job["JobId"]:
+                entry.update(StartedAt=time.time(), **fields)
+                if entry["Status"] == "starting":
+                    entry["Status"] = "running"
+                job = dict(entry)
+    # Job was cancelled while it was starting
+    if job["Status"] != "running":
+        stop_job(job)
+    return process
+
+
+def get_job_exit(job, hosts):
+    """
+    Exit code of a finished job as (finished, exit code, error), finished is False while it runs
+    """
+    if job["Mode"] == "local":
+        try:
+            with open(f"{get_jobs_dir()}/{job['JobId']}.exit", "r") as exit_file:
+                return (True, int(exit_file.read().strip()), None)
+        except (FileNotFoundError, ValueError):
+            pass
+        try:
+            os.kill(job["Pid"], 0)
+            return (False, None, None)
+        except ProcessLookupError:
+            return (True, None, "job process exited without exit code")
+        except PermissionError:
+            return (False, None, None)
+    host = hosts.get(job["InstanceId"])
+    if host is None:
+        return (True, None, f"host {job['InstanceId']} is no longer registered")
+    try:
+        response = requests.get(f"http://{host['InstanceDns']}:{host['Port']}/containers/{job['ContainerId']}/json", timeout=daemon_timeout)
+        if response.status_code == 404:
+            return (True, None, "job container was removed")
+        response.raise_for_status()
+        state = response.json()["State"]
+    except Exception as error:
+        # Host may be rebooting, the job is checked again on the next pass
+        log.info(f"Failed to read state of job {job['JobId']}: {error}")
+        return (False, None, None)
+    if state["Status"] in ["exited", "dead"]:
+        return (True, state["ExitCode"], state.get("Error") or None)
+    return (False, None, None)
+
+
+def stop_job(job):
+    """
+    Stop a running job, its container is removed
+    """
+    if job["Mode"] == "local" and job.get("Pid"):
+        try:
+            os.killpg(job["Pid"], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    elif job.get("ContainerId"):
+        host = {host["InstanceId"]: host for host in list_hosts()}.get(job["InstanceId"])
+        if host:
+            subprocess.run(["docker", "-H", get_host_url(host), "rm", "-f", job["ContainerId"]], capture_output=True)
+
+
+def cancel_job(job_id):
+    """
+    Cancel queued or running job, returns the cancelled job or None if it was not active
+    """
+    with locked_queue() as queue:
+        for job in queue["Jobs"]:
+            if job["JobId"] == job_id and job["Status"] in active_states:
+                previous = job["Status"]
+                job.update(Status="cancelled", FinishedAt=time.time())
+                break
+        else:
+            return None
+    if previous == "running":
+        stop_job(job)
+    log.info(f"Cancelled job {job_id}")
+    return job
+
+
+def is_scheduler_alive(pid):
+    """
+    Scheduler process pid is still running
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def start_scheduler(region, max_jobs_per_host):
+    """
+    Start a detached scheduler unless one is running, it exits once the queue has no active job
+    """
+    with locked_queue(write=False) as queue:
+        if is_scheduler_alive(queue["SchedulerPid"]):
+            return queue["SchedulerPid"]
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--region", region, "--max-jobs-per-host", str(max_jobs_per_host)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    log.info(f"Started job scheduler {process.pid}")
+    return process.pid
+
+
+def register_scheduler():
+    """
+    Record this process as the scheduler, False if another scheduler is already running
+    """
+    with locked_queue() as queue:
+        if queue["SchedulerPid"] != os.getpid() and is_scheduler_alive(queue["SchedulerPid"]):
+            return False
+        queue["SchedulerPid"] = os.getpid()
+        return True
+
+
+def unregister_scheduler_if_idle():
+    """
+    Clear the scheduler pid when no job is active, under the queue lock so a new submission starts a new scheduler
+    """
+    with locked_queue() as queue:
+        if any(job["Status"] in active_states for job in queue["Jobs"]):
+            return False
+        queue["SchedulerPid"] = None
+        return True
+
+
+def schedule(ec2_client, region, catalog, max_jobs_per_host, processes):
+    """
+    One scheduler pass: record finished jobs, then place queued jobs in submission order. Jobs that fit
+    nowhere yet wait without blocking smaller jobs behind them
+    """
+    # Spot hosts with an interruption notice take no new jobs, the jobs they ran are stopped by the drain and fail
+    check_interruptions(list_hosts())
+    registered = {host["InstanceId"]: host for host in list_hosts()}
+    hosts = {instance_id: host for instance_id, host in registered.items() if host.get("Status", "running") == "running"}
+    for process in processes:
+        process.poll()
+    for job in list_jobs():
+        if job["Status"] == "running":
+            finished, exit_code, error = get_job_exit(job, registered)
+            if finished:
+                status = "succeeded" if exit_code == 0 else "failed"
+                log.info(f"Job {job['JobId']} {status} with exit code {exit_code}")
+                update_job(job["JobId"], Status=status, ExitCode=exit_code, Error=error, FinishedAt=time.time())
+    jobs = list_jobs()
+    queued = [job for job in jobs if job["Status"] == "queued"]
+    if not queued:
+        return
+    free = {}
+    for instance_id, host in hosts.items():
+        capacity = get_host_capacity(host, catalog, ec2_client, region)
+        if capacity:
+            free[instance_id] = get_free_capacity(host, capacity, jobs)
+    for job in queued:
+        instance_id = place_job(job, free, max_jobs_per_host)
+        if instance_id is None:
+            continue
+        gpu_devices = free[instance_id]["GpuDevices"][:job["Gpus"]]
+        if not claim_job(job["JobId"], instance_id, gpu_devices):
+            continue
+        free[instance_id]["Cpus"] -= job["Cpus"]
+        free[instance_id]["MemoryMiB"] -= job["MemoryMiB"]
+        free[instance_id]["GpuDevices"] = free[instance_id]["GpuDevices"][job["Gpus"]:]
+        free[instance_id]["Jobs"] += 1
+        process = start_job({**job, "GpuDevices": gpu_devices}, hosts[instance_id])
+        if process:
+            processes.append(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="sdocker-scheduler")
+    parser.add_argument("--region", required=True)
+    parser.add_argument("--max-jobs-per-host", type=int, required=True)
+    args = parser.parse_args()
+    if not register_scheduler():
+        log.info("Job scheduler already running, exiting")
+        return
+    ec2_client = boto3.client("ec2", region_name=args.region)
+    catalog = load_catalog(ec2_client, args.region)
+    processes = []
+    while True:
+        try:
+            schedule(ec2_client, args.region, catalog, args.max_jobs_per_host, processes)
+        except Exception as error:
+            log.exception(f"Job scheduler pass failed: {error}")
+        if unregister_scheduler_if_idle():
+            break
+        time.sleep(poll_interval)
+    log.info("Job queue is empty, job scheduler exiting")
+
+
+if __name__ == "__main__":
+    log.basicConfig(format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d]: %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    filename=f'{get_home()}/.sdocker/sdocker.log',
+                    level=log.INFO)
+    main()
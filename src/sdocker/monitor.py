@@ -0,0 +1,249 @@
+import time
+import requests
+import logging as log
+from concurrent.futures import ThreadPoolExecutor
+from hostmetrics import exporter_port
+
+# (connect, read) timeout in seconds of docker daemon and exporter requests, container stats take about a second
+metrics_timeout = (2, 10)
+# Containers whose stats are read concurrently
+stats_workers = 16
+
+
+def get_daemon_url(host):
+    return f"http://{host['InstanceDns']}:{host['Port']}"
+
+
+def summarize_container_stats(stats):
+    """
+    CPU, memory, block and network I/O of a container from a one-shot /containers/{id}/stats sample,
+    computed the way docker stats does. I/O values are totals since the container started
+    """
+    cpu, precpu = stats["cpu_stats"], stats.get("precpu_stats", {})
+    cpu_delta = cpu["cpu_usage"]["total_usage"] - precpu.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - precpu.get("system_cpu_usage", 0)
+    online_cpus = cpu.get("online_cpus") or len(cpu["cpu_usage"].get("percpu_usage") or [None])
+    memory = stats.get("memory_stats", {})
+    memory_stats = memory.get("stats", {})
+    # Reclaimable page cache is left out, as with docker stats. cgroup v2 names it inactive_file, v1 total_inactive_file
+    page_cache = memory_stats.get("inactive_file", memory_stats.get("total_inactive_file", 0))
+    blkio = stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []
+    networks = (stats.get("networks") or {}).values()
+    return {
+        "Name": stats["name"].lstrip("/"),
+        "Id": stats["id"][:12],
+        "CpuPercent": 100 * cpu_delta / system_delta * online_cpus if system_delta > 0 and cpu_delta > 0 else 0.0,
+        "MemoryBytes": max(memory.get("usage", 0) - page_cache, 0),
+        "MemoryLimitBytes": memory.get("limit", 0),
+        "BlockReadBytes": sum(entry["value"] for entry in blkio if entry["op"].lower() == "read"),
+        "BlockWriteBytes": sum(entry["value"] for entry in blkio if entry["op"].lower() == "write"),
+        "NetworkReceiveBytes": sum(network["rx_bytes"] for network in networks),
+        "NetworkTransmitBytes": sum(network["tx_bytes"] for network in networks)
+    }
+
+
+def get_container_stats(host):
+    """
+    Stats of the running containers of host, read concurrently
+    """
+    url = get_daemon_url(host)
+    containers = requests.get(f"{url}/containers/json", timeout=metrics_timeout).json()
+
+    def get_stats(container):
+        try:
+            response = requests.get(f"{url}/containers/{container['Id']}/stats", params={"stream": "false"}, timeout=metrics_timeout)
+            response.raise_for_status()
+            return summarize_container_stats(response.json())
+        except Exception as error:
+            # Container stopped since it was listed
+            log.info(f"Failed to read stats of container {container['Id'][:12]} on {host['InstanceId']}: {error}")
+            return None
+
+    if not containers:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(containers), stats_workers)) as executor:
+        return [stats for stats in executor.map(get_stats, containers) if stats]
+
+
+def get_disk_summary(host):
+    """
+    Space used by images, containers, build cache and volumes on host, from /system/df
+    """
+    df = requests.get(f"{get_daemon_url(host)}/system/df", timeout=(2, 60)).json()
+    return {
+        "Images": len(df.get("Images") or []),
+        "ImagesBytes": df.get("LayersSize", 0),
+        "ContainersBytes": sum(container.get("SizeRw", 0) for container in df.get("Containers") or []),
+        "BuildCacheBytes": sum(record["Size"] for record in df.get("BuildCache") or [] if not record.get("Shared")),
+        "VolumesBytes": sum(max(volume.get("UsageData", {}).get("Size", 0), 0) for volume in df.get("Volumes") or [])
+    }
+
+
+def parse_prometheus(text):
+    """
+    Types and samples of Prometheus text format, samples are (name, labels, value)
+    """
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, metric_type = line.split(" ", 3)
+            types[name] = metric_type
+        elif line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            name, _, label_text = series.partition("{")
+            labels = {}
+            for pair in label_text.rstrip("}").split(","):
+                if "=" in pair:
+                    key, label = pair.split("=", 1)
+                    labels[key] = label.strip('"')
+            samples.append((name, labels, float(value)))
+    return types, samples
+
+
+def get_host_metrics(host):
+    """
+    Metrics of the host exporter, None for hosts created before it existed or while it starts
+    """
+    try:
+        response = requests.get(f"http://{host['InstanceDns']}:{exporter_port}/metrics", timeout=metrics_timeout)
+        response.raise_for_status()
+    except Exception as error:
+        log.info(f"Failed to read host metrics of {host['InstanceId']}: {error}")
+        return None
+    types, samples = parse_prometheus(response.text)
+    return {"Time": time.time(), "Types": types, "Samples": samples}
+
+
+def get_sample(metrics, name, **labels):
+    """
+    Value of a sample, summed over the series matching labels, None when missing
+    """
+    values = [value for sample_name, sample_labels, value in metrics["Samples"] if sample_name == name and labels.items() <= sample_labels.items()]
+    return sum(values) if values else None
+
+
+def summarize_host_metrics(previous, current):
+    """
+    Host CPU, memory, data root, GPU and EFS figures. CPU and EFS rates need a previous scrape
+    """
+    summary = {
+        "MemoryUsedBytes": get_sample(current, "sdocker_host_memory_total_bytes") - get_sample(current, "sdocker_host_memory_available_bytes"),
+        "MemoryTotalBytes": get_sample(current, "sdocker_host_memory_total_bytes"),
+        "DataRootUsedBytes": get_sample(current, "sdocker_host_data_root_used_bytes"),
+        "DataRootSizeBytes": get_sample(current, "sdocker_host_data_root_size_bytes"),
+        "Gpus": [
+            {
+                "Gpu": labels["gpu"],
+                "UtilizationPercent": value,
+                "MemoryUsedBytes": get_sample(current, "sdocker_gpu_memory_used_bytes", gpu=labels["gpu"]),
+                "MemoryTotalBytes": get_sample(current, "sdocker_gpu_memory_total_bytes", gpu=labels["gpu"])
+            }
+            for name, labels, value in current["Samples"] if name == "sdocker_gpu_utilization_percent"
+        ],
+        "CpuPercent": None,
+        "NfsReadBytesPerSecond": None,
+        "NfsWriteBytesPerSecond": None
+    }
+    elapsed = current["Time"] - previous["Time"] if previous else 0
+    if elapsed > 0:
+        total = get_sample(current, "sdocker_host_cpu_seconds_total") - get_sample(previous, "sdocker_host_cpu_seconds_total")
+        idle = sum(get_sample(current, "sdocker_host_cpu_seconds_total", mode=mode) - get_sample(previous, "sdocker_host_cpu_seconds_total", mode=mode) for mode in ["idle", "iowait"])
+        summary["CpuPercent"] = 100 * (1 - idle / total) if total > 0 else 0.0
+        if get_sample(current, "sdocker_nfs_read_bytes_total") is not None and get_sample(previous, "sdocker_nfs_read_bytes_total") is not None:
+            summary["NfsReadBytesPerSecond"] = (get_sample(current, "sdocker_nfs_read_bytes_total") - get_sample(previous, "sdocker_nfs_read_bytes_total")) / elapsed
+            summary["NfsWriteBytesPerSecond"] = (get_sample(current, "sdocker_nfs_write_bytes_total") - get_sample(previous, "sdocker_nfs_write_bytes_total")) / elapsed
+    return summary
+
+
+def collect_host_status(host, previous_metrics=None):
+    """
+    Container stats, disk usage and host metrics of host. Host rates are computed against previous_metrics,
+    or against a scrape taken before the container stats, which take about a second
+    """
+    first = previous_metrics or get_host_metrics(host)
+    containers = get_container_stats(host)
+    disk = get_disk_summary(host)
+    current = get_host_metrics(host)
+    return {
+        "Containers": containers,
+        "Disk": disk,
+        "Host": summarize_host_metrics(first, current) if current else None,
+        "HostMetrics": current
+    }
+
+
+def format_bytes(value):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(value) < 1024:
+            return f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
+
+
+def format_host_status(status):
+    """
+    Status of a host as printable lines
+    """
+    lines = []
+    host = status["Host"]
+    if host:
+        cpu = f"{host['CpuPercent']:.1f}%" if host["CpuPercent"] is not None else "-"
+        lines.append(f"  CPU {cpu}  Memory {format_bytes(host['MemoryUsedBytes'])}/{format_bytes(host['MemoryTotalBytes'])}  "
+                     f"Data root {format_bytes(host['DataRootUsedBytes'])}/{format_bytes(host['DataRootSizeBytes'])}")
+        if host["NfsReadBytesPerSecond"] is not None:
+            lines.append(f"  EFS read {format_bytes(host['NfsReadBytesPerSecond'])}/s  write {format_bytes(host['NfsWriteBytesPerSecond'])}/s")
+        for gpu in host["Gpus"]:
+            lines.append(f"  GPU {gpu['Gpu']} {gpu['UtilizationPercent']:.0f}%  Memory {format_bytes(gpu['MemoryUsedBytes'])}/{format_bytes(gpu['MemoryTotalBytes'])}")
+    else:
+        lines.append("  Host metrics unavailable, the exporter starts with hosts created by this sdocker version")
+    disk = status["Disk"]
+    lines.append(f"  Images {disk['Images']} ({format_bytes(disk['ImagesBytes'])})  Containers {format_bytes(disk['ContainersBytes'])}  "
+                 f"Build cache {format_bytes(disk['BuildCacheBytes'])}  Volumes {format_bytes(disk['VolumesBytes'])}")
+    if status["Containers"]:
+        lines.append(f"  {'CONTAINER':<32}{'CPU':>8}{'MEMORY':>24}{'BLOCK I/O':>24}{'NET I/O':>24}")
+    for container in status["Containers"]:
+        memory = f"{format_bytes(container['MemoryBytes'])}/{format_bytes(container['MemoryLimitBytes'])}"
+        block = f"{format_bytes(container['BlockReadBytes'])}/{format_bytes(container['BlockWriteBytes'])}"
+        network = f"{format_bytes(container['NetworkReceiveBytes'])}/{format_bytes(container['NetworkTransmitBytes'])}"
+        lines.append(f"  {container['Name'][:31]:<32}{container['CpuPercent']:>7.1f}%{memory:>24}{block:>24}{network:>24}")
+    return lines
+
+
+def format_prometheus(statuses):
+    """
+    Prometheus text format of host statuses, as (registry entry, status) pairs. Every series is labeled
+    with the instance id and type of its host
+    """
+    metrics = {}
+
+    def add(name, metric_type, description, labels, value):
+        metrics.setdefault(name, (metric_type, description, []))[2].append((labels, value))
+
+    for host, status in statuses:
+        host_labels = {"instance_id": host["InstanceId"], "instance_type": host["InstanceType"]}
+        for container in status["Containers"]:
+            labels = {**host_labels, "container": container["Name"]}
+            add("sdocker_container_cpu_percent", "gauge", "Container CPU usage, 100 per CPU", labels, container["CpuPercent"])
+            add("sdocker_container_memory_bytes", "gauge", "Container memory usage without page cache", labels, container["MemoryBytes"])
+            add("sdocker_container_memory_limit_bytes", "gauge", "Container memory limit", labels, container["MemoryLimitBytes"])
+            add("sdocker_container_block_read_bytes_total", "counter", "Bytes read from block devices by container", labels, container["BlockReadBytes"])
+            add("sdocker_container_block_write_bytes_total", "counter", "Bytes written to block devices by container", labels, container["BlockWriteBytes"])
+            add("sdocker_container_network_receive_bytes_total", "counter", "Bytes received by container", labels, container["NetworkReceiveBytes"])
+            add("sdocker_container_network_transmit_bytes_total", "counter", "Bytes sent by container", labels, container["NetworkTransmitBytes"])
+        disk = status["Disk"]
+        add("sdocker_disk_images_bytes", "gauge", "Space used by image layers", host_labels, disk["ImagesBytes"])
+        add("sdocker_disk_containers_bytes", "gauge", "Space used by container writable layers", host_labels, disk["ContainersBytes"])
+        add("sdocker_disk_build_cache_bytes", "gauge", "Space used by build cache", host_labels, disk["BuildCacheBytes"])
+        add("sdocker_disk_volumes_bytes", "gauge", "Space used by volumes", host_labels, disk["VolumesBytes"])
+        if status["HostMetrics"]:
+            types = status["HostMetrics"]["Types"]
+            for name, labels, value in status["HostMetrics"]["Samples"]:
+                add(name, types.get(name, "untyped"), "Host metric of the sdocker exporter", {**host_labels, **labels}, value)
+    lines = []
+    for name, (metric_type, description, samples) in metrics.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+    return "\n".join(lines) + "\n" if lines else ""
@@ -1,5 +1,166 @@
 import argparse
 
+# sdocker commands, see Commands for their implementation
+commands = [
+    "create-host",
+    "terminate-current-host",
+    "terminate-host",
+    "pool",
+    "stop-host",
+    "start-host",
+    "list-hosts",
+    "use-host",
+    "build",
+    "bake-ami",
+    "stage",
+    "attach",
+    "recommend",
+    "wait",
+    "status",
+    "timings",
+    "registry-cache",
+    "submit",
+    "queue",
+    "gc",
+    "relaunch"
+]
+# Arguments of each command, as (argument, required, extra add_argument options)
+sub_args = {
+    "create-host": [
+        ("--instance-type", True),
+        ("--subnet-id", False),
+        ("--no-pool", False, {"action": "store_true", "help": "always launch a new instance instead of claiming a warm pool host"}),
+        ("--count", False, {"type": int, "default": 1, "help": "number of hosts to launch per instance type, types can also be given as type:count,type:count"}),
+        ("--reuse", False, {"action": "store_true", "help": "attach healthy running hosts of the user profile before launching new ones"}),
+        ("--no-wait", False, {"action": "store_true", "help": "return once instances are launched, a background worker waits on them"}),
+        ("--fallback-instance-types", False, {"help": "acceptable instance types tried in order when no subnet has capacity, type,type"}),
+        ("--market", False, {"choices": ["on-demand", "spot", "spot-preferred"], "default": "on-demand", "help": "spot-preferred falls back to on-demand"})
+    ],
+    "terminate-current-host": [],
+    "terminate-host": [
+        ("--instance-id", True)
+    ],
+    "pool": [
+        ("action", True, {"choices": ["refill", "drain", "list"]}),
+        ("--instance-type", False),
+        ("--subnet-id", False),
+        ("--size", False, {"type": int, "default": 1, "help": "number of warm hosts to keep for instance type"})
+    ],
+    "stop-host": [
+        ("--instance-id", False)
+    ],
+    "start-host": [
+        ("--instance-id", False)
+    ],
+    "list-hosts": [],
+    "use-host": [
+        ("--instance-id", True)
+    ],
+    "build": [
+        ("path", True, {"help": "build context on the EFS home directory"}),
+        ("--tag", True),
+        ("--file", False, {"help": "Dockerfile, relative to build context"}),
+        ("--build-arg", False, {"action": "append", "default": []}),
+        ("--target", False),
+        ("--cache-dir", False, {"help": "BuildKit cache directory on EFS, defaults to ~/.sdocker/build-cache/<tag>"}),
+        ("--no-cache-export", False, {"action": "store_true"}),
+        ("--instance-id", False)
+    ],
+    "bake-ami": [
+        ("--instance-type", False, {"default": "c5.xlarge"}),
+        ("--image", False, {"action": "append", "default": [], "help": "framework image to pre-pull, can be repeated"}),
+        ("--name", False),
+        ("--iam-instance-profile", False, {"help": "instance profile allowed to pull framework images from ECR"}),
+        ("--subnet-id", False)
+    ],
+    "stage": [
+        ("path", True, {"help": "dataset directory on the EFS home directory"}),
+        ("--name", False, {"help": "staged dataset name, defaults to directory name"}),
+        ("--delete", False, {"action": "store_true", "help": "remove staged files no longer in source"}),
+        ("--instance-id", False)
+    ],
+    "attach": [
+        ("--instance-id", False),
+        ("--instance-type", False)
+    ],
+    "recommend": [
+        ("--gpus", False, {"type": int, "default": 0, "help": "number of NVIDIA GPUs"}),
+        ("--memory", False, {"type": float, "default": 0, "help": "memory in GiB"}),
+        ("--vcpus", False, {"type": int, "default": 0}),
+        ("--image-size", False, {"type": float, "default": 0, "help": "uncompressed size of the largest image in GiB"}),
+        ("--architecture", False, {"choices": ["x86_64", "arm64"], "default": "x86_64"}),
+        ("--nvme", False, {"action": "store_true", "help": "only instance types with NVMe instance store"}),
+        ("--limit", False, {"type": int, "default": 5, "help": "number of instance types to list"})
+    ],
+    "wait": [
+        ("--instance-id", False, {"help": "defaults to every pending host"}),
+        ("--timeout", False, {"type": int, "default": 900, "help": "seconds to wait"})
+    ],
+    "status": [
+        ("--instance-id", False),
+        ("--watch", False, {"action": "store_true", "help": "refresh until interrupted"}),
+        ("--interval", False, {"type": int, "default": 5, "help": "seconds between refreshes with --watch"}),
+        ("--format", False, {"choices": ["table", "prometheus"], "default": "table"}),
+        ("--output", False, {"help": "write Prometheus text format to this file instead of printing it"})
+    ],
+    "timings": [
+        ("--command", False, {"default": "create-host", "help": "command whose traces are summarized"}),
+        ("--last", False, {"type": int, "default": None, "help": "only the last runs"})
+    ],
+    "registry-cache": [
+        ("action", True, {"choices": ["create", "use", "terminate", "status"]}),
+        ("--instance-type", False, {"default": "m5.large"}),
+        ("--storage", False, {"choices": ["ebs", "efs"], "default": "ebs", "help": "where cached image layers are stored"}),
+        ("--subnet-id", False)
+    ],
+    "submit": [
+        ("--image", False, {"help": "image of the job container"}),
+        ("--local-mode", False, {"action": "store_true", "help": "run the command in Studio with DOCKER_HOST set to the host, eg. SageMaker local mode"}),
+        ("--cpus", False, {"type": float, "default": 1, "help": "vCPUs reserved for the job"}),
+        ("--memory", False, {"type": float, "default": 1, "help": "memory in GiB reserved for the job"}),
+        ("--gpus", False, {"type": int, "default": 0, "help": "GPUs reserved for the job"}),
+        ("--name", False),
+        ("--env", False, {"action": "append", "default": [], "help": "KEY=VALUE, can be repeated"}),
+        ("--instance-id", False, {"help": "only place the job on this host"}),
+        ("job_command", False, {"nargs": argparse.REMAINDER, "help": "command of the job"})
+    ],
+    "queue": [
+        ("action", True, {"choices": ["list", "cancel", "logs"]}),
+        ("--job-id", False)
+    ],
+    "gc": [
+        ("--dry-run", False, {"action": "store_true", "help": "print what would be removed"}),
+        ("--low-water", False, {"type": float, "default": None, "help": "target data root usage in percent, defaults to ImageGC LowWater"}),
+        ("--instance-id", False)
+    ],
+    "relaunch": [
+        ("--instance-id", False, {"help": "defaults to the current host"}),
+        ("--market", False, {"choices": ["on-demand", "spot", "spot-preferred"], "help": "defaults to the market of the replaced host"}),
+        ("--subnet-id", False)
+    ]
+}
+# Options accepted by every command, as (argument, required, extra add_argument options)
+common_args = [
+    ("--refresh-config", False, {"action": "store_true", "help": "ignore cached configuration and query AWS again"})
+]
+
+
+def get_command_args(command, **fields):
+    """
+    Arguments of command with their command line defaults, overridden by fields. Used by SDockerClient
+    """
+    args = {"func": command}
+    for sub_arg, required, *options in sub_args[command] + common_args:
+        options = options[0] if options else {}
+        default = options.get("default", False if options.get("action") == "store_true" else None)
+        args[sub_arg.lstrip("-").replace("-", "_")] = list(default) if isinstance(default, list) else default
+    for field, value in fields.items():
+        if field not in args:
+            raise TypeError(f"{command} got an unexpected argument {field}")
+        args[field] = value
+    return argparse.Namespace(**args)
+
+
 class ParseArgs():
     """
     Parsing Arguments class
@@ -8,28 +169,16 @@ class ParseArgs():
         """
         """
         parser = argparse.ArgumentParser(prog="sdocker")
-        commands = [
-            "create-host",
-            "terminate-current-host",
-            "terminate-host"
-        ]
-        sub_args = {
-            "create-host": [
-                ("--instance-type", True),
-                ("--subnet-id", False)
-            ],
-            "terminate-current-host": [],
-            "terminate-host": [
-                ("--instance-id", True)
-            ]
-        }
         command_parser = parser.add_subparsers(title="commands", dest=str(commands), required=True)
         arg_commands = {}
         for command in commands:
             arg_commands[command] = command_parser.add_parser(command)
             arg_commands[command].set_defaults(func=command)
-            for sub_arg, required in sub_args[command]:
-                arg_commands[command].add_argument(sub_arg, required=required)
+            for sub_arg, required, *options in sub_args[command] + common_args:
+                options = dict(options[0]) if options else {}
+                if sub_arg.startswith("--"):
+                    options["required"] = required
+                arg_commands[command].add_argument(sub_arg, **options)
         args = parser.parse_args()
         self.parser = parser
         self.args = args
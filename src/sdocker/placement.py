@@ -0,0 +1,65 @@
+import logging as log
+from config import UnhandledError
+
+# run_instances error codes meaning another AZ may still be able to launch the instance type
+capacity_errors = ["InsufficientInstanceCapacity", "Unsupported"]
+# run_instances error codes meaning another instance type or market may still launch, eg. a per family vCPU quota
+fallback_errors = capacity_errors + ["VcpuLimitExceeded", "InstanceLimitExceeded", "MaxSpotInstanceCountExceeded", "SpotMaxPriceTooLow", "InsufficientCapacityOnHost"]
+# Options of run_instances launching one-time spot instances, terminated on interruption
+spot_market_options = {"MarketType": "spot", "SpotOptions": {"SpotInstanceType": "one-time", "InstanceInterruptionBehavior": "terminate"}}
+
+
+def get_placements(config, subnet_id=None):
+    """
+    Candidate (subnet id, EFS mount target) pairs in order of preference.
+    Subnets in an AZ that has a mount target come first and mount it, other subnets
+    fall back to a mount target in another AZ
+    """
+    mount_targets = {mount_target["AvailabilityZone"]: mount_target for mount_target in config["MountTargets"]}
+    subnets = [subnet_id] if subnet_id else config["SubnetIds"]
+    same_az = []
+    cross_az = []
+    for subnet in subnets:
+        availability_zone = config["SubnetAvailabilityZones"].get(subnet)
+        if availability_zone in mount_targets:
+            same_az.append((subnet, mount_targets[availability_zone]))
+        else:
+            cross_az.append((subnet, config["MountTargets"][0]))
+    for subnet, mount_target in cross_az:
+        log.warning(f"Subnet {subnet} has no EFS mount target in its AZ, it would mount {mount_target['MountTargetId']} in {mount_target['AvailabilityZone']}")
+    return same_az + cross_az
+
+
+def get_offered_zones(ec2_client, instance_types):
+    """
+    AZs offering each of instance_types, with paginated calls covering all of them
+    """
+    offered = {instance_type: set() for instance_type in instance_types}
+    try:
+        paginator = ec2_client.get_paginator("describe_instance_type_offerings")
+        for page in paginator.paginate(
+            LocationType="availability-zone",
+            Filters=[{"Name": "instance-type", "Values": list(instance_types)}]
+        ):
+            for offering in page["InstanceTypeOfferings"]:
+                offered[offering["InstanceType"]].add(offering["Location"])
+    except Exception as error:
+        UnhandledError(error)
+    return offered
+
+
+def filter_offered_placements(ec2_client, config, instance_type, placements, offered=None):
+    """
+    Drop placements whose AZ does not offer instance_type, keeps all placements if none offers it.
+    offered are the AZs offering instance_type when already known
+    """
+    if offered is None:
+        offered = get_offered_zones(ec2_client, [instance_type])[instance_type]
+    filtered = []
+    for subnet, mount_target in placements:
+        availability_zone = config["SubnetAvailabilityZones"].get(subnet)
+        if availability_zone in offered:
+            filtered.append((subnet, mount_target))
+        else:
+            log.info(f"{instance_type} is not offered in {availability_zone}, skipping subnet {subnet}")
+    return filtered or placements
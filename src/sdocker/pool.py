@@ -0,0 +1,104 @@
+import time
+import uuid
+import botocore
+import logging as log
+from config import UnhandledError, user_profile_tag
+
+# Instance type of the pool a host belongs to
+pool_tag = "sdocker:pool"
+# Pool host lifecycle: warming (booting), ready (stopped and prepared), claimed (being resumed)
+pool_state_tag = "sdocker:pool-state"
+# Unique id of the session claiming a pool host, the last session to tag it owns the claim
+pool_claim_tag = "sdocker:pool-claim"
+# Seconds to let concurrent claim tags settle before reading them back
+claim_settle_time = 1
+
+
+def list_pool_hosts(ec2_client, config, instance_type=None, pool_states=["warming", "ready"], instance_states=["pending", "running", "stopping", "stopped"]):
+    """
+    List pool hosts of the user profile, optionally for a single instance type
+    """
+    filters = [
+        {"Name": f"tag:{user_profile_tag}", "Values": [config["UserProfile"]]},
+        {"Name": f"tag:{pool_state_tag}", "Values": pool_states},
+        {"Name": "instance-state-name", "Values": instance_states}
+    ]
+    if instance_type:
+        filters.append({"Name": f"tag:{pool_tag}", "Values": [instance_type]})
+    else:
+        filters.append({"Name": "tag-key", "Values": [pool_tag]})
+    instances = []
+    try:
+        paginator = ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=filters):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+    except Exception as error:
+        UnhandledError(error)
+    return instances
+
+
+def set_pool_state(ec2_client, instance_ids, state):
+    """
+    Tag pool hosts with their pool state
+    """
+    try:
+        ec2_client.create_tags(
+            Resources=instance_ids,
+            Tags=[{"Key": pool_state_tag, "Value": state}]
+        )
+    except Exception as error:
+        UnhandledError(error)
+
+
+def claim_pool_host(ec2_client, config, instance_type, subnet_id=None):
+    """
+    Claim a stopped pool host of instance_type and start it, returns the instance or None when pool is empty.
+    A claim is won when the host still carries this session's claim tag and start_instances found it stopped,
+    StartInstances succeeds on a host another session already started
+    """
+    candidates = list_pool_hosts(ec2_client, config, instance_type, pool_states=["ready"], instance_states=["stopped"])
+    if subnet_id:
+        candidates = [instance for instance in candidates if instance["SubnetId"] == subnet_id]
+    claimant = uuid.uuid4().hex
+    for instance in candidates:
+        instance_id = instance["InstanceId"]
+        log.info(f"Claiming pool host {instance_id}")
+        try:
+            ec2_client.create_tags(
+                Resources=[instance_id],
+                Tags=[{"Key": pool_state_tag, "Value": "claimed"}, {"Key": pool_claim_tag, "Value": claimant}]
+            )
+            time.sleep(claim_settle_time)
+            response = ec2_client.describe_instances(InstanceIds=[instance_id])
+        except Exception as error:
+            UnhandledError(error)
+        tags = {tag["Key"]: tag["Value"] for tag in response["Reservations"][0]["Instances"][0].get("Tags", [])}
+        if tags.get(pool_claim_tag) != claimant:
+            log.info(f"Pool host {instance_id} was claimed by another session")
+            continue
+        try:
+            response = ec2_client.start_instances(InstanceIds=[instance_id])
+        except botocore.exceptions.ClientError as error:
+            if error.response["Error"]["Code"] == "IncorrectInstanceState":
+                log.info(f"Pool host {instance_id} was claimed by another session")
+                continue
+            if error.response["Error"]["Code"] == "InsufficientInstanceCapacity":
+                log.info(f"No capacity to start pool host {instance_id}, returning it to the pool")
+                set_pool_state(ec2_client, [instance_id], "ready")
+                continue
+            UnhandledError(error)
+        if response["StartingInstances"][0]["PreviousState"]["Name"] != "stopped":
+            # Started by another session in between
+            log.info(f"Pool host {instance_id} was claimed by another session")
+            continue
+        try:
+            ec2_client.delete_tags(
+                Resources=[instance_id],
+                Tags=[{"Key": pool_tag}, {"Key": pool_state_tag}, {"Key": pool_claim_tag}]
+            )
+        except Exception as error:
+            UnhandledError(error)
+        return instance
+    log.info(f"No warm pool host available for {instance_type}")
+    return None
@@ -0,0 +1,154 @@
+import logging as log
+import botocore
+from concurrent.futures import ThreadPoolExecutor
+
+# Security groups used by DockerHost instances, with their ingress rules as (from port, to port, source).
+# Source "studio" is the Studio security group of the user profile, "self" is the group itself.
+# Port 5000 lets hosts reach the registry cache, see registrycache.py
+security_group_specs = {
+    "DockerHost": {
+        "Description": "Docker host security group",
+        "Rules": [(0, 65535, "studio"), (5000, 5000, "self")]
+    },
+    "EFSDockerHost": {
+        "Description": "EFS security group used with Docker host",
+        "Rules": [(2049, 2049, "self")]
+    }
+}
+# Group added to every EFS mount target so hosts can mount EFS in any AZ
+efs_security_group = "EFSDockerHost"
+
+
+def describe_launch_security_groups(ec2_client, vpc_id):
+    """
+    Existing sdocker security groups of the VPC with their ingress rules, in a single call
+    """
+    response = ec2_client.describe_security_groups(
+        Filters=[
+            {"Name": "group-name", "Values": list(security_group_specs)},
+            {"Name": "vpc-id", "Values": [vpc_id]}
+        ]
+    )
+    return {group["GroupName"]: group for group in response["SecurityGroups"]}
+
+
+def has_rule(group, from_port, to_port, source_id):
+    """
+    Ingress rules of group already allow tcp from_port-to_port from source security group
+    """
+    for permission in group.get("IpPermissions", []):
+        if permission["IpProtocol"] == "-1":
+            covers = True
+        else:
+            covers = permission["IpProtocol"] == "tcp" and permission.get("FromPort", 0) <= from_port and permission.get("ToPort", 65535) >= to_port
+        if covers and source_id in [pair["GroupId"] for pair in permission.get("UserIdGroupPairs", [])]:
+            return True
+    return False
+
+
+def plan_preflight(groups, studio_security_group, mount_targets):
+    """
+    Changes needed so security groups, their rules and EFS mount targets match security_group_specs.
+    Rules of groups that do not exist yet are planned once the group is created, see run_preflight
+    """
+    plan = []
+    for name, spec in security_group_specs.items():
+        if name not in groups:
+            plan.append({"Action": "CreateSecurityGroup", "GroupName": name})
+            continue
+        for from_port, to_port, source in spec["Rules"]:
+            source_id = studio_security_group if source == "studio" else groups[name]["GroupId"]
+            if not has_rule(groups[name], from_port, to_port, source_id):
+                plan.append({"Action": "AuthorizeIngress", "GroupName": name, "FromPort": from_port, "ToPort": to_port, "SourceGroupId": source_id})
+    efs_group_id = groups[efs_security_group]["GroupId"] if efs_security_group in groups else None
+    for mount_target in mount_targets:
+        if efs_group_id is None or efs_group_id not in mount_target["SecurityGroups"]:
+            plan.append({"Action": "AddMountTargetSecurityGroup", "MountTargetId": mount_target["MountTargetId"]})
+    return plan
+
+
+def create_security_group(ec2_client, vpc_id, name):
+    """
+    Create security group, or return the existing one when a concurrent run created it first
+    """
+    log.info(f"Creating {name} security group")
+    try:
+        group_id = ec2_client.create_security_group(
+            Description=security_group_specs[name]["Description"],
+            GroupName=name,
+            VpcId=vpc_id
+        )["GroupId"]
+        return {"GroupId": group_id, "GroupName": name, "IpPermissions": []}
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] != "InvalidGroup.Duplicate":
+            raise
+    log.info(f"Security group {name} was created concurrently, using it")
+    return describe_launch_security_groups(ec2_client, vpc_id)[name]
+
+
+def authorize_ingress(ec2_client, group_id, from_port, to_port, source_group_id, description):
+    """
+    Add tcp ingress rule from source security group, rules added concurrently are ignored
+    """
+    try:
+        ec2_client.authorize_security_group_ingress(
+            GroupId=group_id,
+            IpPermissions=[
+                {
+                    "FromPort": from_port,
+                    "IpProtocol": "tcp",
+                    "ToPort": to_port,
+                    "UserIdGroupPairs": [{"Description": description, "GroupId": source_group_id}]
+                }
+            ]
+        )
+    except botocore.exceptions.ClientError as error:
+        if error.response["Error"]["Code"] != "InvalidPermission.Duplicate":
+            raise
+
+
+def run_preflight(ec2_client, efs_client, vpc_id, studio_security_group, mount_targets):
+    """
+    Read security groups once, apply only missing groups, rules and mount target memberships.
+    Returns launch security group ids and mount targets with their updated security groups
+    """
+    groups = describe_launch_security_groups(ec2_client, vpc_id)
+    plan = plan_preflight(groups, studio_security_group, mount_targets)
+    if plan:
+        log.info(f"Preflight changes: {plan}")
+    else:
+        log.info("Security groups and EFS mount targets are already prepared")
+    for step in [step for step in plan if step["Action"] == "CreateSecurityGroup"]:
+        groups[step["GroupName"]] = create_security_group(ec2_client, vpc_id, step["GroupName"])
+    # New groups have no rules yet, plan again now their ids are known
+    if any(step["Action"] == "CreateSecurityGroup" for step in plan):
+        plan = plan_preflight(groups, studio_security_group, mount_targets)
+    for step in [step for step in plan if step["Action"] == "AuthorizeIngress"]:
+        authorize_ingress(
+            ec2_client,
+            groups[step["GroupName"]]["GroupId"],
+            step["FromPort"],
+            step["ToPort"],
+            step["SourceGroupId"],
+            security_group_specs[step["GroupName"]]["Description"]
+        )
+    efs_group_id = groups[efs_security_group]["GroupId"]
+    missing = [step["MountTargetId"] for step in plan if step["Action"] == "AddMountTargetSecurityGroup"]
+    mount_targets = [
+        {**mount_target, "SecurityGroups": [*mount_target["SecurityGroups"], efs_group_id]}
+        if mount_target["MountTargetId"] in missing else mount_target
+        for mount_target in mount_targets
+    ]
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            list(executor.map(
+                lambda mount_target: efs_client.modify_mount_target_security_groups(
+                    MountTargetId=mount_target["MountTargetId"],
+                    SecurityGroups=mount_target["SecurityGroups"]
+                ),
+                [mount_target for mount_target in mount_targets if mount_target["MountTargetId"] in missing]
+            ))
+    return {
+        "LaunchSecurityGroups": [groups[name]["GroupId"] for name in security_group_specs],
+        "MountTargets": mount_targets
+    }
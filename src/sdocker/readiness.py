@@ -0,0 +1,142 @@
+import os
+import time
+import botocore
+import requests
+import logging as log
+from config import get_home
+from timing import phase, record_bootstrap_timings
+
+# (connect, read) timeout in seconds of a single docker daemon probe
+probe_timeout = (2, 5)
+# Backoff between probes grows from min_backoff to max_backoff
+min_backoff = 0.5
+max_backoff = 5
+backoff_factor = 1.5
+# Seconds between instance state checks while probing the daemon
+state_check_interval = 15
+# Seconds between checks of the ready marker written by the bootstrap script
+marker_poll_interval = 0.2
+
+
+def get_ready_marker(instance_id):
+    """
+    Marker file the bootstrap script writes on EFS once dockerd is up
+    """
+    return f"{get_home()}/.sdocker/ready/{instance_id}"
+
+
+def clear_ready_marker(instance_id):
+    """
+    Remove ready marker left by a previous boot of instance
+    """
+    try:
+        os.remove(get_ready_marker(instance_id))
+    except FileNotFoundError:
+        pass
+
+
+def probe_docker(dns, port):
+    """
+    Request /_ping from docker daemon on host, returns (healthy, error)
+    """
+    try:
+        response = requests.get(f"http://{dns}:{port}/_ping", timeout=probe_timeout)
+        response.raise_for_status()
+        log.info(f"DockerHost {dns} is healthy!")
+        return (True, None)
+    except Exception as error:
+        log.info(f"Failed to reach {dns}: {error}")
+        return (False, error)
+
+
+def get_instance_state(ec2_client, instance_id):
+    """
+    Current state name of instance
+    """
+    response = ec2_client.describe_instances(InstanceIds=[instance_id])
+    return response["Reservations"][0]["Instances"][0]["State"]["Name"]
+
+
+def read_bootstrap_timings(instance_id):
+    """
+    Bootstrap steps recorded in the ready marker as (step, epoch seconds), empty when missing.
+    Markers of agents without step timings hold a single timestamp
+    """
+    steps = []
+    try:
+        with open(get_ready_marker(instance_id), "r") as marker:
+            for line in marker.read().split("\n"):
+                fields = line.split()
+                if len(fields) == 1:
+                    steps.append(("ready", float(fields[0])))
+                elif len(fields) == 2:
+                    steps.append((fields[0], float(fields[1])))
+    except (OSError, ValueError) as error:
+        log.info(f"No bootstrap timings for {instance_id}: {error}")
+    return steps
+
+
+def wait_for_marker(instance_id, seconds):
+    """
+    Sleep up to seconds, returns early when the ready marker shows up
+    """
+    marker = get_ready_marker(instance_id)
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if os.path.exists(marker):
+            return True
+        time.sleep(marker_poll_interval)
+    return os.path.exists(marker)
+
+
+def wait_until_ready(ec2_client, instance_id, dns, port, timeout=720):
+    """
+    Wait for instance to be running, then for its docker daemon to answer.
+    Probes back off adaptively and fail early when the instance leaves the running state.
+    Returns (healthy, error)
+    """
+    deadline = time.time() + timeout
+    log.info(f"Waiting on instance {instance_id} to be running")
+    try:
+        with phase("instance-running", InstanceId=instance_id):
+            ec2_client.get_waiter("instance_running").wait(
+                InstanceIds=[instance_id],
+                WaiterConfig={"Delay": 2, "MaxAttempts": max(1, timeout // 2)}
+            )
+    except botocore.exceptions.WaiterError as error:
+        log.error(f"Instance {instance_id} did not reach running state: {error}")
+        return (False, error)
+    with phase("docker-ready", InstanceId=instance_id):
+        IsHealthy = wait_for_docker(ec2_client, instance_id, dns, port, deadline)
+    if IsHealthy[0]:
+        record_bootstrap_timings(instance_id, read_bootstrap_timings(instance_id))
+    return IsHealthy
+
+
+def wait_for_docker(ec2_client, instance_id, dns, port, deadline):
+    """
+    Probe docker daemon of running instance until deadline, returns (healthy, error)
+    """
+    backoff = min_backoff
+    last_state_check = time.time()
+    marker_seen = False
+    while time.time() < deadline:
+        IsHealthy = probe_docker(dns, port)
+        if IsHealthy[0]:
+            return IsHealthy
+        if time.time() - last_state_check > state_check_interval:
+            state = get_instance_state(ec2_client, instance_id)
+            last_state_check = time.time()
+            if state != "running":
+                error = RuntimeError(f"Instance {instance_id} left running state, current state is {state}")
+                log.error(str(error))
+                return (False, error)
+        wait = min(backoff, max(0, deadline - time.time()))
+        backoff = min(backoff * backoff_factor, max_backoff)
+        if marker_seen:
+            time.sleep(wait)
+        elif wait_for_marker(instance_id, wait):
+            # Probe right away, only the first time the marker shows up
+            log.info(f"Instance {instance_id} reported dockerd is up")
+            marker_seen = True
+    return (False, TimeoutError(f"Docker daemon on {dns} not ready before deadline"))
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import fcntl
+import logging as log
+from contextlib import contextmanager
+from config import get_home
+from errors import HostNotFoundError
+
+
+def get_registry_filename():
+    """
+    Location of the host registry
+    """
+    return f"{get_home()}/.sdocker/sdocker-hosts.conf"
+
+
+def load_registry(filename):
+    """
+    Read registry file, missing or empty file is an empty registry. Files written by older versions have
+    no CurrentHost, their first host is the current host, and no Context, named type_id by those versions
+    """
+    try:
+        with open(filename, "r") as registry_file:
+            registry = json.load(registry_file)
+    except (FileNotFoundError, ValueError):
+        registry = {}
+    registry.setdefault("ActiveHosts", [])
+    if "CurrentHost" not in registry:
+        registry["CurrentHost"] = registry["ActiveHosts"][0]["InstanceId"] if registry["ActiveHosts"] else None
+    for host in registry["ActiveHosts"]:
+        host["Context"] = get_context_name(host)
+    return registry
+
+
+def get_context_name(host):
+    """
+    Docker context of host
+    """
+    return host.get("Context") or f"{host['InstanceType']}_{host['InstanceId']}"
+
+
+@contextmanager
+def locked_registry(write=True):
+    """
+    Hold an exclusive lock on the registry and yield it, changes are written back atomically on exit
+    """
+    filename = get_registry_filename()
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f"{filename}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        try:
+            registry = load_registry(filename)
+            yield registry
+            if write:
+                with open(f"{filename}.{os.getpid()}", "w") as registry_file:
+                    json.dump(registry, registry_file, indent=4)
+                os.replace(f"{filename}.{os.getpid()}", filename)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_registry():
+    """
+    Snapshot of the registry
+    """
+    with locked_registry(write=False) as registry:
+        return registry
+
+
+def list_hosts():
+    """
+    All registered hosts
+    """
+    return read_registry()["ActiveHosts"]
+
+
+def get_host(instance_id):
+    """
+    Registry entry of instance, or None if not registered
+    """
+    for host in list_hosts():
+        if host["InstanceId"] == instance_id:
+            return host
+    return None
+
+
+def get_current_host():
+    """
+    Registry entry of the current host, None when no host is current, eg. after it was terminated
+    """
+    registry = read_registry()
+    for host in registry["ActiveHosts"]:
+        if host["InstanceId"] == registry["CurrentHost"]:
+            return host
+    return None
+
+
+def add_host(instance_id, instance_dns, port, instance_type, gpu=False, availability_zone=None, status="pending", context=None):
+    """
+    Register a host. A host already registered, eg. attached again, keeps its creation time, status and
+    other fields, updated with the new location and instance type
+    """
+    host = {
+        "InstanceId": instance_id,
+        "InstanceDns": instance_dns,
+        "Port": port,
+        "InstanceType": instance_type,
+        "Gpu": gpu,
+        "AvailabilityZone": availability_zone,
+        "CreatedAt": time.time(),
+        "Status": status,
+        "Context": context
+    }
+    with locked_registry() as registry:
+        for entry in registry["ActiveHosts"]:
+            if entry["InstanceId"] == instance_id:
+                host.update(CreatedAt=entry.get("CreatedAt", host["CreatedAt"]), Status=entry.get("Status", status), Context=entry.get("Context") or context)
+                entry.update(host)
+                host = entry
+                break
+        else:
+            registry["ActiveHosts"].append(host)
+        host["Context"] = get_context_name(host)
+    log.info(f"Registered host {instance_id} with status {host['Status']}")
+    return host
+
+
+def update_host(instance_id, **fields):
+    """
+    Update fields of a registered host, returns the updated entry or None if not registered
+    """
+    with locked_registry() as registry:
+        for host in registry["ActiveHosts"]:
+            if host["InstanceId"] == instance_id:
+                host.update(fields)
+                return host
+    return None
+
+
+def remove_host(instance_id):
+    """
+    Remove host from registry, clearing current host if it was the current one
+    """
+    with locked_registry() as registry:
+        registry["ActiveHosts"] = [host for host in registry["ActiveHosts"] if host["InstanceId"] != instance_id]
+        if registry["CurrentHost"] == instance_id:
+            registry["CurrentHost"] = None
+    log.info(f"Removed host {instance_id} from registry")
+
+
+def set_current_host(instance_id):
+    """
+    Mark registered host as current host
+    """
+    with locked_registry() as registry:
+        if instance_id not in [host["InstanceId"] for host in registry["ActiveHosts"]]:
+            raise HostNotFoundError(f"Host {instance_id} is not registered, see sdocker list-hosts")
+        registry["CurrentHost"] = instance_id
@@ -0,0 +1,114 @@
+import time
+import requests
+import logging as log
+from config import UnhandledError
+from bootstrap import default_efs_mount, generate_efs_mount_options
+
+# Tag of registry cache instances, its value is the VPC the cache serves
+registry_cache_tag = "sdocker:registry-cache"
+registry_cache_image = "registry:2"
+registry_cache_port = 5000
+# registry:2 proxies a single upstream, and needs no credentials for public Docker Hub images. dockerd only
+# mirrors Docker Hub, SageMaker framework images from ECR bypass the cache
+registry_cache_upstream = "https://registry-1.docker.io"
+# Seconds to wait on the registry after the instance is running
+registry_cache_timeout = 600
+
+
+def generate_registry_cache_script(storage, efs_ip_address=None, user_uid=None):
+    """
+    User data running registry:2 as a pull-through cache of Docker Hub, storing blobs on the
+    root EBS volume, or on EFS with storage "efs" so the cache survives the instance
+    """
+    if storage == "efs":
+        storage_setup = f"""rpm -q nfs-utils > /dev/null || yum install -y nfs-utils
+    mkdir -p /mnt/efs
+    mountpoint -q /mnt/efs || mount -t nfs -o {generate_efs_mount_options(default_efs_mount)} {efs_ip_address}:/{user_uid} /mnt/efs
+    STORAGE=/mnt/efs/.sdocker/registry-cache"""
+    else:
+        storage_setup = "STORAGE=/var/lib/sdocker/registry-cache"
+    return f"""Content-Type: multipart/mixed; boundary="//"
+MIME-Version: 1.0
+
+--//
+Content-Type: text/cloud-config; charset="us-ascii"
+MIME-Version: 1.0
+Content-Transfer-Encoding: 7bit
+Content-Disposition: attachment; filename="cloud-config.txt"
+
+#cloud-config
+cloud_final_modules:
+- [scripts-user, always]
+
+--//
+Content-Type: text/x-shellscript; charset="us-ascii"
+MIME-Version: 1.0
+Content-Transfer-Encoding: 7bit
+Content-Disposition: attachment; filename="userdata.txt"
+
+#!/bin/bash
+set -x
+exec > >(tee /var/log/sdocker-registry-cache.log|logger -t sdocker-registry-cache -s 2>/dev/console) 2>&1
+
+    {storage_setup}
+    mkdir -p $STORAGE
+    if [[ -n "$(docker ps -aq --filter name=^sdocker-registry-cache$)" ]]
+    then
+        docker start sdocker-registry-cache
+    else
+        docker run -d --restart always --name sdocker-registry-cache \\
+        -p {registry_cache_port}:5000 \\
+        -v $STORAGE:/var/lib/registry \\
+        -e REGISTRY_PROXY_REMOTEURL={registry_cache_upstream} \\
+        -e REGISTRY_STORAGE_DELETE_ENABLED=true \\
+        {registry_cache_image}
+    fi
+--//--"""
+
+
+def find_registry_caches(ec2_client, vpc_id, instance_states=["pending", "running", "stopping", "stopped"]):
+    """
+    Registry cache instances serving vpc_id, newest first. They are shared by every user profile of the VPC
+    """
+    instances = []
+    try:
+        paginator = ec2_client.get_paginator("describe_instances")
+        for page in paginator.paginate(Filters=[
+            {"Name": f"tag:{registry_cache_tag}", "Values": [vpc_id]},
+            {"Name": "instance-state-name", "Values": instance_states}
+        ]):
+            for reservation in page["Reservations"]:
+                instances.extend(reservation["Instances"])
+    except Exception as error:
+        UnhandledError(error)
+    return sorted(instances, key=lambda instance: instance["LaunchTime"], reverse=True)
+
+
+def get_mirror_url(instance):
+    """
+    Registry mirror URL of registry cache instance, reachable inside the VPC only
+    """
+    return f"http://{instance['PrivateIpAddress']}:{registry_cache_port}"
+
+
+def probe_registry(url):
+    """
+    Registry answers the registry API
+    """
+    try:
+        return requests.get(f"{url}/v2/", timeout=(2, 5)).status_code == 200
+    except Exception as error:
+        log.info(f"Failed to reach registry cache {url}: {error}")
+        return False
+
+
+def wait_for_registry(url, timeout=registry_cache_timeout):
+    """
+    Wait on registry cache to answer, returns True when it does before timeout
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if probe_registry(url):
+            return True
+        time.sleep(5)
+    return False
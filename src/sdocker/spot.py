@@ -0,0 +1,55 @@
+import os
+import json
+import logging as log
+from config import get_home
+from registry import update_host
+
+# Markets of create-host --market, as the run_instances markets tried in order
+markets = {
+    "on-demand": ["on-demand"],
+    "spot": ["spot"],
+    "spot-preferred": ["spot", "on-demand"]
+}
+
+
+def get_interruption_marker(instance_id):
+    """
+    Marker file the spot agent writes on EFS when the instance receives an interruption notice
+    """
+    return f"{get_home()}/.sdocker/interrupted/{instance_id}"
+
+
+def read_interruption(instance_id):
+    """
+    Interruption notice of instance, the instance-action document of the instance metadata, None without notice
+    """
+    try:
+        with open(get_interruption_marker(instance_id), "r") as marker_file:
+            return json.loads(marker_file.readline())
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return {"action": "unknown"}
+
+
+def clear_interruption_marker(instance_id):
+    try:
+        os.remove(get_interruption_marker(instance_id))
+    except FileNotFoundError:
+        pass
+
+
+def check_interruptions(hosts):
+    """
+    Mark running spot hosts with an interruption notice as interrupted, so nothing new is placed on them.
+    Returns their updated registry entries
+    """
+    interrupted = []
+    for host in hosts:
+        if host.get("Market") != "spot" or host.get("Status") == "interrupted":
+            continue
+        notice = read_interruption(host["InstanceId"])
+        if notice:
+            log.warning(f"Spot host {host['InstanceId']} received an interruption notice: {notice}")
+            interrupted.append(update_host(host["InstanceId"], Status="interrupted", Interruption=notice))
+    return [host for host in interrupted if host]
@@ -0,0 +1,100 @@
+import os
+import subprocess
+import logging as log
+from config import get_home
+from build import get_efs_path
+
+# Image running the staging copy on the host
+stage_image = "python:3.11-alpine"
+# Parallel copy workers and chunk size used for each file
+stage_workers = 16
+stage_chunk_size = 8 * 1024 * 1024
+
+# Runs in stage_image on the host: copies changed files from EFS to local disk, in parallel and chunked
+stage_script = """
+import os, sys, time, threading
+from concurrent.futures import ThreadPoolExecutor
+source, destination, workers, chunk_size, delete = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5] == "1"
+lock = threading.Lock()
+done = {"files": 0, "bytes": 0}
+def copy(relative, size, mtime):
+    target = os.path.join(destination, relative)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(os.path.join(source, relative), "rb") as src, open(target + ".sdocker-partial", "wb") as dst:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(chunk)
+            with lock:
+                done["bytes"] += len(chunk)
+    os.utime(target + ".sdocker-partial", (mtime, mtime))
+    os.replace(target + ".sdocker-partial", target)
+    with lock:
+        done["files"] += 1
+pending, seen, skipped = [], set(), 0
+for root, _, files in os.walk(source):
+    for name in files:
+        path = os.path.join(root, name)
+        relative = os.path.relpath(path, source)
+        seen.add(relative)
+        stat = os.stat(path)
+        try:
+            target = os.stat(os.path.join(destination, relative))
+            if target.st_size == stat.st_size and int(target.st_mtime) == int(stat.st_mtime):
+                skipped += 1
+                continue
+        except FileNotFoundError:
+            pass
+        pending.append((relative, stat.st_size, stat.st_mtime))
+total_bytes = sum(size for _, size, _ in pending)
+print(f"{len(pending)} files to copy ({total_bytes / 2**20:.1f} MiB), {skipped} unchanged", flush=True)
+start = time.time()
+with ThreadPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(copy, *item) for item in pending]
+    while not all(future.done() for future in futures):
+        time.sleep(1)
+        elapsed = max(time.time() - start, 1e-6)
+        print(f"{done['files']}/{len(pending)} files, {done['bytes'] / 2**20:.1f}/{total_bytes / 2**20:.1f} MiB, {done['bytes'] / 2**20 / elapsed:.1f} MiB/s", flush=True)
+    for future in futures:
+        future.result()
+removed = 0
+if delete:
+    for root, _, files in os.walk(destination):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, destination) not in seen:
+                os.remove(path)
+                removed += 1
+print(f"Staged {len(pending)} files ({total_bytes / 2**20:.1f} MiB) in {time.time() - start:.1f}s, {skipped} unchanged, {removed} removed", flush=True)
+"""
+
+
+def get_staging_root():
+    """
+    Staging directory, the host daemon mounts local disk here while Studio sees an empty directory on EFS
+    """
+    return f"{get_home()}/.sdocker/staging"
+
+
+def stage_on_host(host, path, name=None, delete=False):
+    """
+    Copy dataset at path on EFS to local disk of host, returns (exit code, staged path)
+    """
+    path = get_efs_path(path)
+    name = name or os.path.basename(path.rstrip("/"))
+    destination = f"{get_staging_root()}/{name}"
+    command = [
+        "docker", "-H", f"tcp://{host['InstanceDns']}:{host['Port']}",
+        "run", "--rm",
+        "-v", f"{path}:{path}:ro",
+        "-v", f"{get_staging_root()}:{get_staging_root()}",
+        stage_image,
+        "python", "-u", "-c", stage_script,
+        path, destination, str(stage_workers), str(stage_chunk_size), "1" if delete else "0"
+    ]
+    log.info(f"Staging {path} to {destination} on host {host['InstanceId']}")
+    returncode = subprocess.run(command).returncode
+    # SageMaker local mode checks file:// channels exist locally, the daemon sees local disk at the same path
+    os.makedirs(destination, exist_ok=True)
+    return returncode, destination
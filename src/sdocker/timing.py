@@ -0,0 +1,181 @@
+import os
+import json
+import math
+import time
+import glob
+import threading
+import boto3
+import logging as log
+from contextlib import contextmanager
+
+# Trace files kept in ~/.sdocker/traces, older ones are removed
+max_traces = 200
+
+
+class Trace():
+    """
+    Timed spans of one sdocker invocation: phases, AWS API calls and bootstrap steps of hosts
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.command = None
+        self.start = time.time()
+        self.spans = []
+
+
+    def add_span(self, name, start, duration, **attributes):
+        """
+        Record span, ignored when no trace was started, eg. from SDockerClient
+        """
+        if self.command is None:
+            return
+        with self.lock:
+            self.spans.append({
+                "Name": name,
+                "Start": round(start - self.start, 3),
+                "Duration": round(duration, 3),
+                "Attributes": attributes
+            })
+
+
+trace = Trace()
+
+
+def get_traces_dir():
+    """
+    Directory of trace files, one per invocation
+    """
+    # config imports this module to time its resolvers
+    from config import get_home
+    return f"{get_home()}/.sdocker/traces"
+
+
+def start_trace(command):
+    """
+    Start tracing an invocation of command, AWS API calls of boto3 clients created from now on are traced
+    """
+    trace.command = command
+    trace.start = time.time()
+    trace.spans = []
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    events = boto3.DEFAULT_SESSION.events
+    events.register("before-call", before_aws_call, unique_id="sdocker-trace-before-call")
+    events.register("after-call", after_aws_call, unique_id="sdocker-trace-after-call")
+    events.register("after-call-error", after_aws_call_error, unique_id="sdocker-trace-after-call-error")
+
+
+@contextmanager
+def phase(name, **attributes):
+    """
+    Time the enclosed block as span name
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.time() - start, **attributes)
+
+
+def before_aws_call(model, context, **kwargs):
+    context["sdocker-trace"] = (f"aws:{model.service_model.service_name}.{model.name}", time.time())
+
+
+def after_aws_call(parsed, context, **kwargs):
+    if "sdocker-trace" not in context:
+        return
+    name, start = context["sdocker-trace"]
+    trace.add_span(name, start, time.time() - start, Retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+
+
+def after_aws_call_error(exception, context, **kwargs):
+    if "sdocker-trace" not in context:
+        return
+    name, start = context["sdocker-trace"]
+    trace.add_span(name, start, time.time() - start, Error=type(exception).__name__)
+
+
+def record_bootstrap_timings(instance_id, steps):
+    """
+    Record bootstrap steps of host as spans, steps are (step, epoch seconds) in the order they finished
+    """
+    for (_, previous), (step, finished) in zip(steps, steps[1:]):
+        trace.add_span(f"bootstrap:{step}", previous, finished - previous, InstanceId=instance_id)
+
+
+def save_trace():
+    """
+    Write trace of the invocation to its own file, then prune old traces
+    """
+    if trace.command is None:
+        return
+    traces_dir = get_traces_dir()
+    filename = f"{traces_dir}/{time.strftime('%Y%m%d%H%M%S', time.localtime(trace.start))}{int(trace.start * 1000) % 1000:03d}-{trace.command}-{os.getpid()}.json"
+    try:
+        os.makedirs(traces_dir, exist_ok=True)
+        with trace.lock:
+            data = {
+                "Command": trace.command,
+                "Start": trace.start,
+                "Duration": round(time.time() - trace.start, 3),
+                "Spans": sorted(trace.spans, key=lambda span: span["Start"])
+            }
+        with open(f"{filename}.tmp", "w") as trace_file:
+            json.dump(data, trace_file, indent=1)
+        os.replace(f"{filename}.tmp", filename)
+        for old_trace in sorted(glob.glob(f"{traces_dir}/*.json"))[:-max_traces]:
+            os.remove(old_trace)
+    except OSError as error:
+        log.warning(f"Unable to write trace {filename}: {error}")
+
+
+def read_traces(command=None, last=None):
+    """
+    Saved traces, oldest first, optionally of one command and limited to the last runs
+    """
+    traces = []
+    for filename in sorted(glob.glob(f"{get_traces_dir()}/*.json")):
+        try:
+            with open(filename, "r") as trace_file:
+                data = json.load(trace_file)
+        except (OSError, ValueError):
+            continue
+        if command is None or data["Command"] == command:
+            traces.append(data)
+    return traces[-last:] if last else traces
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of values
+    """
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def summarize_traces(traces):
+    """
+    Per span name: runs it appears in, calls per run and percentiles of its durations across runs.
+    "total" is the duration of whole invocations
+    """
+    durations = {"total": [data["Duration"] for data in traces]}
+    runs = {"total": len(traces)}
+    for data in traces:
+        for name in {span["Name"] for span in data["Spans"]}:
+            runs[name] = runs.get(name, 0) + 1
+        for span in data["Spans"]:
+            durations.setdefault(span["Name"], []).append(span["Duration"])
+    summary = []
+    for name, values in durations.items():
+        if not values:
+            continue
+        summary.append({
+            "Name": name,
+            "Runs": runs[name],
+            "CallsPerRun": len(values) / runs[name],
+            "P50": percentile(values, 50),
+            "P90": percentile(values, 90),
+            "P99": percentile(values, 99),
+            "Max": max(values)
+        })
+    return sorted(summary, key=lambda row: row["P50"], reverse=True)
@@ -0,0 +1,100 @@
+#!/opt/conda/bin/python3
+"""
+Background worker started by create-host --no-wait, waits on launched hosts and records their status
+in the host registry, see sdocker wait and sdocker status
+"""
+import os
+import sys
+import argparse
+import subprocess
+import logging as log
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from config import get_home
+from readiness import wait_until_ready
+from registry import get_host, update_host, set_current_host, get_context_name
+from contexts import create_context, use_context
+from timing import start_trace, save_trace
+
+
+def start_worker(region, instance_ids, timeout, make_current=False):
+    """
+    Start a detached worker for instance_ids, it outlives the sdocker command and notebook cell
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--region", region, "--timeout", str(timeout)]
+    if make_current:
+        command.append("--make-current")
+    command += instance_ids
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    for instance_id in instance_ids:
+        update_host(instance_id, WorkerPid=process.pid)
+    log.info(f"Started background worker {process.pid} for {instance_ids}")
+    return process.pid
+
+
+def is_worker_alive(host):
+    """
+    Background worker of pending host is still running
+    """
+    if not host.get("WorkerPid"):
+        return False
+    try:
+        os.kill(host["WorkerPid"], 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def finish_host(ec2_client, instance_id, timeout):
+    """
+    Wait on host, then create its docker context and mark it running, or terminate it and mark it failed
+    """
+    host = get_host(instance_id)
+    IsHealthy = wait_until_ready(ec2_client, instance_id, host["InstanceDns"], host["Port"], timeout)
+    if IsHealthy[0]:
+        create_context(get_context_name(host), f"tcp://{host['InstanceDns']}:{host['Port']}", f"sdocker DockerHost {instance_id}")
+        update_host(instance_id, Status="running", WorkerPid=None)
+        return True
+    log.error(f"Not able to reach docker daemon on host {instance_id}: {IsHealthy[1]}, terminating instance")
+    update_host(instance_id, Status="failed", Error=str(IsHealthy[1]), WorkerPid=None)
+    try:
+        ec2_client.terminate_instances(InstanceIds=[instance_id])
+    except Exception as error:
+        log.exception(f"Unable to terminate failed host {instance_id}: {error}")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="sdocker-worker")
+    parser.add_argument("--region", required=True)
+    parser.add_argument("--timeout", type=int, required=True)
+    parser.add_argument("--make-current", action="store_true")
+    parser.add_argument("instance_ids", nargs="+")
+    args = parser.parse_args()
+    start_trace("worker")
+    ec2_client = boto3.client("ec2", region_name=args.region)
+    with ThreadPoolExecutor(max_workers=len(args.instance_ids)) as executor:
+        health = list(executor.map(lambda instance_id: finish_host(ec2_client, instance_id, args.timeout), args.instance_ids))
+    ready = [instance_id for instance_id, healthy in zip(args.instance_ids, health) if healthy]
+    # First healthy host of the fleet becomes current host, as with a blocking create-host
+    if args.make_current and ready:
+        set_current_host(ready[0])
+        use_context(get_context_name(get_host(ready[0])))
+    log.info(f"Background worker done, ready hosts: {ready}")
+    save_trace()
+
+
+if __name__ == "__main__":
+    log.basicConfig(format='%(asctime)s %(levelname)s [%(filename)s:%(lineno)d]: %(message)s',
+                    datefmt='%m/%d/%Y %H:%M:%S',
+                    filename=f'{get_home()}/.sdocker/sdocker.log',
+                    level=log.INFO)
+    main()
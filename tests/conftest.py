@@ -0,0 +1,16 @@
+import os
+import sys
+import pytest
+
+# sdocker modules import each other from the script directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "sdocker"))
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """
+    Empty home directory, so registry, queue and cache files are written under tmp_path
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".sdocker").mkdir()
+    return tmp_path
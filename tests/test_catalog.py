@@ -0,0 +1,48 @@
+from catalog import recommend_instance_types
+
+
+def instance_type(vcpus, memory_gib, gpus=0, nvme_gib=0, architectures=["x86_64"], current=True):
+    return {
+        "VCpus": vcpus,
+        "MemoryMiB": memory_gib * 1024,
+        "Gpus": gpus,
+        "GpuManufacturer": "NVIDIA" if gpus else None,
+        "GpuMemoryMiB": 16384 * gpus,
+        "NvmeGiB": nvme_gib,
+        "Architectures": architectures,
+        "NetworkPerformance": "Up to 10 Gigabit",
+        "CurrentGeneration": current
+    }
+
+
+catalog = {
+    "c5.xlarge": instance_type(4, 8),
+    "c5d.xlarge": instance_type(4, 8, nvme_gib=100),
+    "m5.2xlarge": instance_type(8, 32),
+    "g4dn.xlarge": instance_type(4, 16, gpus=1, nvme_gib=125),
+    "c6g.xlarge": instance_type(4, 8, architectures=["arm64"]),
+    "c4.xlarge": instance_type(4, 8, current=False)
+}
+
+
+def names(candidates):
+    return [name for name, _ in candidates]
+
+
+def test_smallest_first_with_nvme_preferred_between_equal_sizes():
+    assert names(recommend_instance_types(catalog, ebs_volume_size=400)) == ["c5d.xlarge", "c5.xlarge", "m5.2xlarge", "g4dn.xlarge"]
+
+
+def test_gpus_and_memory_filter():
+    assert names(recommend_instance_types(catalog, gpus=1, ebs_volume_size=400)) == ["g4dn.xlarge"]
+    assert names(recommend_instance_types(catalog, memory_gib=16, ebs_volume_size=400)) == ["m5.2xlarge", "g4dn.xlarge"]
+
+
+def test_image_size_checks_the_data_root_volume():
+    # NVMe instance store holds the images unless the data root is on EBS
+    assert names(recommend_instance_types(catalog, image_size_gib=60, ebs_volume_size=100)) == ["g4dn.xlarge"]
+    assert names(recommend_instance_types(catalog, image_size_gib=60, ebs_volume_size=400, data_root="ebs")) == ["c5d.xlarge", "c5.xlarge", "m5.2xlarge", "g4dn.xlarge"]
+
+
+def test_architecture():
+    assert names(recommend_instance_types(catalog, architecture="arm64", ebs_volume_size=400)) == ["c6g.xlarge"]
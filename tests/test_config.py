@@ -0,0 +1,53 @@
+import botocore
+import pytest
+from config import LazyConfig, write_config_cache, read_config_cache
+
+static_config = {"DomainId": "d-1", "UserProfile": "user", "Region": "us-east-1"}
+cached_config = {"SecurityGroups": ["sg-deleted"], "MountTargets": [{"MountTargetId": "fsmt-deleted"}]}
+
+
+def client_error(code):
+    return botocore.exceptions.ClientError({"Error": {"Code": code, "Message": code}}, "Operation")
+
+
+def get_config(resolve_preflight):
+    """
+    Configuration loaded from a cache holding deleted resources, with every resolver replaced
+    """
+    write_config_cache("d-1", "user", cached_config)
+    config = LazyConfig(dict(static_config), read_config_cache("d-1", "user"))
+    config.groups["profile"] = (["SecurityGroups"], lambda: {"SecurityGroups": ["sg-new"]})
+    config.groups["efs"] = (["MountTargets"], lambda: {"MountTargets": [{"MountTargetId": "fsmt-new"}]})
+    config.groups["preflight"] = (["LaunchSecurityGroups"], lambda: resolve_preflight(config))
+    config.field_groups.update(SecurityGroups="profile", MountTargets="efs")
+    return config
+
+
+def test_stale_cache_is_cleared_and_resolved_again(home):
+    def resolve_preflight(config):
+        if config["SecurityGroups"] == ["sg-deleted"]:
+            raise client_error("InvalidGroup.NotFound")
+        return {"LaunchSecurityGroups": config["SecurityGroups"]}
+    config = get_config(resolve_preflight)
+    assert config["LaunchSecurityGroups"] == ["sg-new"]
+    assert config["MountTargets"] == [{"MountTargetId": "fsmt-new"}]
+    assert read_config_cache("d-1", "user")["SecurityGroups"] == ["sg-new"]
+
+
+def test_stale_error_is_raised_when_nothing_came_from_the_cache(home):
+    def resolve_preflight(config):
+        raise client_error("MountTargetNotFound")
+    config = get_config(resolve_preflight)
+    with pytest.raises(botocore.exceptions.ClientError):
+        config["LaunchSecurityGroups"]
+    # Retried once with the cache cleared
+    assert read_config_cache("d-1", "user") is None
+
+
+def test_other_errors_keep_the_cache(home):
+    def resolve_preflight(config):
+        raise client_error("UnauthorizedOperation")
+    config = get_config(resolve_preflight)
+    with pytest.raises(botocore.exceptions.ClientError):
+        config["LaunchSecurityGroups"]
+    assert read_config_cache("d-1", "user")["SecurityGroups"] == ["sg-deleted"]
@@ -0,0 +1,95 @@
+import json
+import pytest
+from parse import get_command_args
+from commands import Commands
+from errors import CapacityError
+from registry import add_host, update_host, get_host
+from spot import check_interruptions, get_interruption_marker
+
+config = {
+    "SubnetIds": ["subnet-a", "subnet-b"],
+    "SubnetAvailabilityZones": {"subnet-a": "us-east-1a", "subnet-b": "us-east-1b"},
+    "MountTargets": [{"MountTargetId": "fsmt-a", "AvailabilityZone": "us-east-1a"}]
+}
+
+
+class EC2Client():
+    def __init__(self):
+        self.terminated = []
+
+    def terminate_instances(self, InstanceIds):
+        self.terminated.extend(InstanceIds)
+
+
+def get_commands(*launched):
+    """
+    create-host Commands whose launches only succeed for the (instance type, market) pairs in launched
+    """
+    # Launches are replaced below, EC2 is only called to terminate surplus instances
+    commands = Commands(get_command_args("create-host", instance_type="g5.xlarge"), config, EC2Client())
+    attempts = []
+
+    def launch_instances(instance_type, count, market="on-demand", offered=None):
+        attempts.append((instance_type, market))
+        if (instance_type, market) not in launched:
+            raise CapacityError(f"No {market} {instance_type} capacity")
+        return [{"InstanceId": f"i-{instance_type}-{market}", "InstanceType": instance_type}]
+    commands.launch_instances = launch_instances
+    return commands, attempts
+
+
+def test_every_instance_type_on_spot_before_on_demand():
+    commands, attempts = get_commands(("g4dn.xlarge", "on-demand"))
+    instances = commands.launch_with_fallback("g5.xlarge", 1, ["g4dn.xlarge"], "spot-preferred")
+    assert instances[0]["InstanceType"] == "g4dn.xlarge"
+    # Instance types of a market are launched concurrently
+    assert set(attempts[:2]) == {("g5.xlarge", "spot"), ("g4dn.xlarge", "spot")}
+    assert set(attempts[2:]) == {("g5.xlarge", "on-demand"), ("g4dn.xlarge", "on-demand")}
+
+
+def test_first_success_in_priority_order_is_kept():
+    commands, attempts = get_commands(("g5.xlarge", "spot"), ("g4dn.xlarge", "spot"), ("g6.xlarge", "spot"))
+    instances = commands.launch_with_fallback("g5.xlarge", 1, ["g4dn.xlarge", "g6.xlarge"], "spot-preferred")
+    assert instances[0]["InstanceType"] == "g5.xlarge"
+    assert sorted(commands.ec2_client.terminated) == ["i-g4dn.xlarge-spot", "i-g6.xlarge-spot"]
+    assert all(market == "spot" for _, market in attempts)
+
+
+def test_non_capacity_error_stops_the_fallback():
+    commands, attempts = get_commands()
+
+    def launch_instances(instance_type, count, market="on-demand", offered=None):
+        raise ValueError("invalid launch")
+    commands.launch_instances = launch_instances
+    with pytest.raises(ValueError):
+        commands.launch_with_fallback("g5.xlarge", 1, ["g4dn.xlarge"], "spot-preferred")
+
+
+def test_instance_types_not_offered_in_studio_subnets_are_skipped():
+    commands, attempts = get_commands(("g4dn.xlarge", "on-demand"))
+    offered_zones = {"g5.xlarge": {"us-east-1c"}, "g4dn.xlarge": {"us-east-1b"}}
+    commands.launch_with_fallback("g5.xlarge", 1, ["g4dn.xlarge"], "on-demand", offered_zones)
+    assert attempts == [("g4dn.xlarge", "on-demand")]
+
+
+def test_capacity_error_when_every_candidate_fails():
+    commands, attempts = get_commands()
+    with pytest.raises(CapacityError):
+        commands.launch_with_fallback("g5.xlarge", 1, ["g4dn.xlarge"], "spot")
+    assert sorted(attempts) == [("g4dn.xlarge", "spot"), ("g5.xlarge", "spot")]
+    assert commands.ec2_client.terminated == []
+
+
+def test_spot_host_with_interruption_notice_is_interrupted(home):
+    add_host("i-spot", "ip-1", 1111, "g5.xlarge", status="running")
+    update_host("i-spot", Market="spot")
+    add_host("i-on-demand", "ip-2", 1111, "g5.xlarge", status="running")
+    (home / ".sdocker" / "interrupted").mkdir()
+    for instance_id in ["i-spot", "i-on-demand"]:
+        with open(get_interruption_marker(instance_id), "w") as marker_file:
+            marker_file.write(json.dumps({"action": "terminate", "time": "2026-10-18T12:00:00Z"}) + "\n")
+    interrupted = check_interruptions([get_host("i-spot"), get_host("i-on-demand")])
+    assert [host["InstanceId"] for host in interrupted] == ["i-spot"]
+    assert get_host("i-spot")["Status"] == "interrupted"
+    assert get_host("i-spot")["Interruption"]["action"] == "terminate"
+    assert get_host("i-on-demand")["Status"] == "running"
@@ -0,0 +1,13 @@
+from commands import parse_instance_types
+
+
+def test_single_instance_type_uses_count():
+    assert parse_instance_types("c5.xlarge", 3) == [("c5.xlarge", 3)]
+
+
+def test_mixed_fleet_with_counts():
+    assert parse_instance_types("c5.xlarge:4, g4dn.xlarge:2") == [("c5.xlarge", 4), ("g4dn.xlarge", 2)]
+
+
+def test_types_without_count_use_default_count():
+    assert parse_instance_types("c5.xlarge:4,m5.large", 2) == [("c5.xlarge", 4), ("m5.large", 2)]
@@ -0,0 +1,49 @@
+import pytest
+from parse import get_command_args
+from commands import Commands
+from registry import add_host, set_current_host, update_host, get_current_host
+
+
+class StartEC2Client():
+    def start_instances(self, InstanceIds):
+        pass
+
+    def get_waiter(self, name):
+        class Waiter():
+            def wait(self, InstanceIds):
+                pass
+        return Waiter()
+
+    def describe_instances(self, InstanceIds):
+        return {"Reservations": [{"Instances": [{"InstanceId": InstanceIds[0], "InstanceType": "c5.xlarge", "PrivateDnsName": "ip-new"}]}]}
+
+
+def start_host(instance_id):
+    commands = Commands(get_command_args("start-host", instance_id=instance_id), {}, StartEC2Client())
+    commands.wait_for_host = lambda instance_id, instance_dns: (True, None)
+    return commands.start_host()
+
+
+@pytest.fixture
+def hosts(home, monkeypatch):
+    monkeypatch.delenv("DOCKER_CONFIG", raising=False)
+    add_host("i-selected", "ip-1", 1111, "c5.xlarge", status="running")
+    add_host("i-stopped", "ip-2", 1111, "c5.xlarge", status="running")
+    update_host("i-stopped", Status="stopped")
+
+
+def test_starting_another_host_keeps_current_host(hosts):
+    set_current_host("i-selected")
+    start_host("i-stopped")
+    assert get_current_host()["InstanceId"] == "i-selected"
+
+
+def test_starting_current_host_keeps_it_current(hosts):
+    set_current_host("i-stopped")
+    assert start_host("i-stopped")["InstanceDns"] == "ip-new"
+    assert get_current_host()["InstanceId"] == "i-stopped"
+
+
+def test_started_host_becomes_current_without_current_host(hosts):
+    start_host("i-stopped")
+    assert get_current_host()["InstanceId"] == "i-stopped"
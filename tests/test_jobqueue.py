@@ -0,0 +1,69 @@
+import pytest
+from parse import get_command_args
+from commands import Commands
+from errors import InvalidRequestError
+from jobqueue import get_free_capacity, place_job, list_jobs
+
+
+def job(cpus=1, memory_mib=1024, gpus=0, requested_host=None):
+    return {"Cpus": cpus, "MemoryMiB": memory_mib, "Gpus": gpus, "RequestedHost": requested_host}
+
+
+def free(cpus, memory_mib, gpu_devices=[], jobs=0):
+    return {"Cpus": cpus, "MemoryMiB": memory_mib, "GpuDevices": list(gpu_devices), "Jobs": jobs}
+
+
+def test_best_fit_packs_small_jobs():
+    hosts = {"i-big": free(16, 65536), "i-small": free(4, 8192)}
+    assert place_job(job(cpus=2, memory_mib=4096), hosts, 8) == "i-small"
+
+
+def test_gpu_hosts_are_kept_for_gpu_jobs():
+    hosts = {"i-gpu": free(4, 16384, gpu_devices=[0]), "i-cpu": free(8, 32768)}
+    assert place_job(job(), hosts, 8) == "i-cpu"
+    assert place_job(job(gpus=1), hosts, 8) == "i-gpu"
+
+
+def test_no_host_fits():
+    hosts = {"i-1": free(2, 4096), "i-2": free(8, 32768, jobs=8)}
+    assert place_job(job(cpus=4), hosts, 8) is None
+
+
+def test_requested_host():
+    hosts = {"i-big": free(16, 65536), "i-small": free(4, 8192)}
+    assert place_job(job(requested_host="i-big"), hosts, 8) == "i-big"
+    assert place_job(job(cpus=8, requested_host="i-small"), hosts, 8) is None
+
+
+def test_free_capacity_subtracts_active_jobs_on_host():
+    host = {"InstanceId": "i-1"}
+    capacity = {"Cpus": 8, "MemoryMiB": 30720, "Gpus": 4}
+    jobs = [
+        {"InstanceId": "i-1", "Status": "running", "Cpus": 2, "MemoryMiB": 4096, "GpuDevices": [0, 1]},
+        {"InstanceId": "i-1", "Status": "starting", "Cpus": 1, "MemoryMiB": 1024, "GpuDevices": []},
+        {"InstanceId": "i-1", "Status": "succeeded", "Cpus": 4, "MemoryMiB": 4096, "GpuDevices": [2]},
+        {"InstanceId": "i-2", "Status": "running", "Cpus": 4, "MemoryMiB": 4096, "GpuDevices": [3]}
+    ]
+    assert get_free_capacity(host, capacity, jobs) == {"Cpus": 5, "MemoryMiB": 25600, "GpuDevices": [2, 3], "Jobs": 2}
+
+
+def submit(home, **fields):
+    # Validation fails before anything is queued or any AWS call is made
+    return Commands(get_command_args("submit", **fields), {}, object()).submit()
+
+
+@pytest.mark.parametrize("fields", [
+    {"job_command": ["--", "python", "train.py"]},
+    {},
+    {"local_mode": True},
+    {"local_mode": True, "image": "python:3.11", "job_command": ["python", "train.py"]}
+])
+def test_submit_rejects_invalid_jobs(home, fields):
+    with pytest.raises(InvalidRequestError):
+        submit(home, **fields)
+    assert list_jobs() == []
+
+
+def test_submit_container_job_without_image_names_image(home):
+    with pytest.raises(InvalidRequestError, match="--image"):
+        submit(home, job_command=["python", "train.py"])
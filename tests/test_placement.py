@@ -0,0 +1,29 @@
+from placement import get_placements
+
+config = {
+    "SubnetIds": ["subnet-a", "subnet-b", "subnet-c"],
+    "SubnetAvailabilityZones": {"subnet-a": "us-east-1a", "subnet-b": "us-east-1b", "subnet-c": "us-east-1c"},
+    "MountTargets": [
+        {"MountTargetId": "fsmt-b", "AvailabilityZone": "us-east-1b"},
+        {"MountTargetId": "fsmt-c", "AvailabilityZone": "us-east-1c"}
+    ]
+}
+
+
+def test_subnets_with_mount_target_in_their_az_come_first():
+    placements = get_placements(config)
+    assert [(subnet, mount_target["MountTargetId"]) for subnet, mount_target in placements] == [
+        ("subnet-b", "fsmt-b"),
+        ("subnet-c", "fsmt-c"),
+        ("subnet-a", "fsmt-b")
+    ]
+
+
+def test_subnet_id_restricts_placements():
+    placements = get_placements(config, "subnet-c")
+    assert [(subnet, mount_target["MountTargetId"]) for subnet, mount_target in placements] == [("subnet-c", "fsmt-c")]
+
+
+def test_subnet_without_mount_target_falls_back_to_first_mount_target():
+    placements = get_placements(config, "subnet-a")
+    assert [(subnet, mount_target["MountTargetId"]) for subnet, mount_target in placements] == [("subnet-a", "fsmt-b")]
@@ -0,0 +1,67 @@
+import pool
+from pool import claim_pool_host, pool_claim_tag
+from parse import get_command_args
+from commands import Commands
+
+
+class PoolEC2Client():
+    """
+    EC2 client with one stopped pool host. other_claimant tags the host after this session, previous_state
+    is the state start_instances reports
+    """
+    def __init__(self, other_claimant=None, previous_state="stopped"):
+        self.tags = {}
+        self.other_claimant = other_claimant
+        self.previous_state = previous_state
+        self.started = False
+        self.deleted_tags = []
+
+    def get_paginator(self, operation):
+        class Paginator():
+            def paginate(self, **kwargs):
+                return [{"Reservations": [{"Instances": [{"InstanceId": "i-pool", "InstanceType": "c5.xlarge", "SubnetId": "subnet-a", "State": {"Name": "stopped"}}]}]}]
+        return Paginator()
+
+    def create_tags(self, Resources, Tags):
+        self.tags.update({tag["Key"]: tag["Value"] for tag in Tags})
+        if self.other_claimant:
+            self.tags[pool_claim_tag] = self.other_claimant
+
+    def describe_instances(self, InstanceIds):
+        return {"Reservations": [{"Instances": [{"InstanceId": "i-pool", "Tags": [{"Key": key, "Value": value} for key, value in self.tags.items()]}]}]}
+
+    def start_instances(self, InstanceIds):
+        self.started = True
+        return {"StartingInstances": [{"InstanceId": "i-pool", "PreviousState": {"Name": self.previous_state}}]}
+
+    def delete_tags(self, Resources, Tags):
+        self.deleted_tags.extend(tag["Key"] for tag in Tags)
+
+
+config = {"UserProfile": "user"}
+
+
+def test_claim_wins_stopped_host(monkeypatch):
+    monkeypatch.setattr(pool, "claim_settle_time", 0)
+    ec2_client = PoolEC2Client()
+    assert claim_pool_host(ec2_client, config, "c5.xlarge")["InstanceId"] == "i-pool"
+    assert pool_claim_tag in ec2_client.deleted_tags
+
+
+def test_claim_tagged_by_another_session_is_lost(monkeypatch):
+    monkeypatch.setattr(pool, "claim_settle_time", 0)
+    ec2_client = PoolEC2Client(other_claimant="other")
+    assert claim_pool_host(ec2_client, config, "c5.xlarge") is None
+    assert not ec2_client.started
+
+
+def test_claim_of_host_already_started_is_lost(monkeypatch):
+    monkeypatch.setattr(pool, "claim_settle_time", 0)
+    ec2_client = PoolEC2Client(previous_state="pending")
+    assert claim_pool_host(ec2_client, config, "c5.xlarge") is None
+    assert ec2_client.deleted_tags == []
+
+
+def test_pool_command_returns_action_result():
+    commands = Commands(get_command_args("pool", action="list"), config, PoolEC2Client())
+    assert [instance["InstanceId"] for instance in commands.run()] == ["i-pool"]
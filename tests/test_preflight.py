@@ -0,0 +1,42 @@
+from preflight import plan_preflight
+
+studio_group = "sg-studio"
+
+
+def rule(from_port, to_port, source_id, protocol="tcp"):
+    return {"IpProtocol": protocol, "FromPort": from_port, "ToPort": to_port, "UserIdGroupPairs": [{"GroupId": source_id}]}
+
+
+def prepared_groups():
+    return {
+        "DockerHost": {"GroupId": "sg-host", "IpPermissions": [rule(0, 65535, studio_group), rule(5000, 5000, "sg-host")]},
+        "EFSDockerHost": {"GroupId": "sg-efs", "IpPermissions": [rule(2049, 2049, "sg-efs")]}
+    }
+
+
+def test_prepared_account_needs_no_changes():
+    mount_targets = [{"MountTargetId": "fsmt-1", "SecurityGroups": ["sg-default", "sg-efs"]}]
+    assert plan_preflight(prepared_groups(), studio_group, mount_targets) == []
+
+
+def test_new_account_creates_groups_and_mount_target_memberships():
+    mount_targets = [{"MountTargetId": "fsmt-1", "SecurityGroups": ["sg-default"]}]
+    assert plan_preflight({}, studio_group, mount_targets) == [
+        {"Action": "CreateSecurityGroup", "GroupName": "DockerHost"},
+        {"Action": "CreateSecurityGroup", "GroupName": "EFSDockerHost"},
+        {"Action": "AddMountTargetSecurityGroup", "MountTargetId": "fsmt-1"}
+    ]
+
+
+def test_only_missing_rules_are_planned():
+    groups = prepared_groups()
+    groups["DockerHost"]["IpPermissions"] = [rule(0, 65535, studio_group)]
+    assert plan_preflight(groups, studio_group, []) == [
+        {"Action": "AuthorizeIngress", "GroupName": "DockerHost", "FromPort": 5000, "ToPort": 5000, "SourceGroupId": "sg-host"}
+    ]
+
+
+def test_all_traffic_rule_covers_every_port():
+    groups = prepared_groups()
+    groups["EFSDockerHost"]["IpPermissions"] = [rule(None, None, "sg-efs", protocol="-1")]
+    assert plan_preflight(groups, studio_group, []) == []
@@ -0,0 +1,41 @@
+import json
+from registry import add_host, update_host, remove_host, get_host, get_current_host, set_current_host, list_hosts
+
+
+def write_registry(home, registry):
+    with open(home / ".sdocker" / "sdocker-hosts.conf", "w") as registry_file:
+        json.dump(registry, registry_file)
+
+
+def test_legacy_registry_first_host_is_current(home):
+    # Written by versions before the host registry: no CurrentHost and no Context
+    write_registry(home, {"ActiveHosts": [{"InstanceId": "i-1", "InstanceDns": "ip-1", "Port": 1111, "InstanceType": "c5.xlarge"}]})
+    host = get_current_host()
+    assert host["InstanceId"] == "i-1"
+    assert host["Context"] == "c5.xlarge_i-1"
+
+
+def test_no_current_host_after_current_host_is_removed(home):
+    add_host("i-1", "ip-1", 1111, "c5.xlarge")
+    add_host("i-2", "ip-2", 1111, "c5.xlarge")
+    set_current_host("i-1")
+    remove_host("i-1")
+    assert get_current_host() is None
+    assert [host["InstanceId"] for host in list_hosts()] == ["i-2"]
+
+
+def test_explicit_null_current_host_is_kept(home):
+    write_registry(home, {"ActiveHosts": [{"InstanceId": "i-1", "InstanceDns": "ip-1", "Port": 1111, "InstanceType": "c5.xlarge"}], "CurrentHost": None})
+    assert get_current_host() is None
+
+
+def test_add_host_merges_into_existing_entry(home):
+    add_host("i-1", "ip-1", 1111, "c5.xlarge")
+    update_host("i-1", Status="interrupted", FallbackInstanceTypes=["m5.xlarge"], CreatedAt=1)
+    add_host("i-1", "ip-2", 1111, "c5.xlarge")
+    host = get_host("i-1")
+    assert host["InstanceDns"] == "ip-2"
+    assert host["CreatedAt"] == 1
+    assert host["Status"] == "interrupted"
+    assert host["FallbackInstanceTypes"] == ["m5.xlarge"]
+    assert len(list_hosts()) == 1
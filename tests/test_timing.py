@@ -0,0 +1,32 @@
+from timing import percentile, summarize_traces
+
+
+def trace(duration, spans):
+    return {"Command": "create-host", "Duration": duration, "Spans": [{"Name": name, "Duration": span_duration} for name, span_duration in spans]}
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 90) == 90
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+
+
+def test_summary_counts_runs_and_calls_per_run():
+    traces = [
+        trace(10, [("launch", 2), ("aws:ec2.RunInstances", 1), ("aws:ec2.RunInstances", 1)]),
+        trace(20, [("launch", 4), ("aws:ec2.RunInstances", 3)])
+    ]
+    summary = {row["Name"]: row for row in summarize_traces(traces)}
+    assert summary["total"]["Runs"] == 2
+    assert summary["total"]["Max"] == 20
+    assert summary["aws:ec2.RunInstances"]["Runs"] == 2
+    assert summary["aws:ec2.RunInstances"]["CallsPerRun"] == 1.5
+    assert summary["launch"]["P50"] == 2
+    assert summary["launch"]["Max"] == 4
+
+
+def test_summary_is_sorted_slowest_first():
+    traces = [trace(10, [("docker-ready", 6), ("config", 1)])]
+    assert [row["Name"] for row in summarize_traces(traces)] == ["total", "docker-ready", "config"]